@@ -1,4 +1,5 @@
 import os
+import threading
 
 from loguru import logger
 
@@ -19,6 +20,21 @@ def _init_global_toml():
     GLOBAL_TOML = os.path.join('.', 'pyproject.toml')
 
 
+def _discover_installations(app):
+    """
+    Log the repositories the app is installed on, and fill the installation
+    cache used by the webhooks.
+    """
+    try:
+        repos = github_auth.repo_to_installation_id_mapping()
+    except Exception:
+        logger.exception("Failed to auth with GitHub")
+    else:
+        logger.info(f"Installed on the following repos {repos}")
+    finally:
+        app.installations_discovered.set()
+
+
 def create_app(name, register_blueprints=True):
     """
     Create a flask app based on Baldrick.
@@ -32,6 +48,19 @@ def create_app(name, register_blueprints=True):
     register_blueprints : `bool`
         Register the default blueprints included with Baldrick.
 
+    Notes
+    -----
+    The repositories the app is installed on are listed in a background
+    thread, so that the app can handle webhooks as soon as it is created.
+    ``app.installations_discovered`` is a `threading.Event` which is set once
+    this is done. Set ``BALDRICK_INSTALLATION_DISCOVERY`` to ``sync`` to list
+    them before returning, or to ``off`` to skip it.
+
+    The ``/ready`` route can be used as a readiness check: webhooks don't
+    depend on the list of installations, so it answers as soon as the app is
+    created, and reports in ``installations_discovered`` whether they have
+    been listed yet.
+
     Returns
     -------
     app
@@ -64,12 +93,16 @@ def create_app(name, register_blueprints=True):
     app.integration_id = int(os.environ['GITHUB_APP_INTEGRATION_ID'])
     app.private_key = os.environ['GITHUB_APP_PRIVATE_KEY']
 
-    try:
-        repos = github_auth.repo_to_installation_id_mapping()
-    except Exception as e:
-        logger.exception("Failed to auth with GitHub")
+    app.installations_discovered = threading.Event()
+
+    discovery = os.environ.get('BALDRICK_INSTALLATION_DISCOVERY', 'background')
+    if discovery == 'sync':
+        _discover_installations(app)
+    elif discovery == 'off':
+        app.installations_discovered.set()
     else:
-        logger.info(f"Installed on the following repos {repos}")
+        threading.Thread(target=_discover_installations, args=(app,),
+                         name='baldrick-installation-discovery', daemon=True).start()
 
     app.bot_username = name
 
@@ -85,6 +118,11 @@ def create_app(name, register_blueprints=True):
     def installation_authorized():
         return "Installation authorized"
 
+    @app.route("/ready")
+    def ready():
+        return {'ready': True,
+                'installations_discovered': app.installations_discovered.is_set()}
+
     return app
 
 
@@ -1,9 +1,9 @@
-import json
 from pprint import pformat
 
 from loguru import logger
 
-from baldrick.github.github_auth import repo_to_installation_id_mapping
+from baldrick import json_backend
+from baldrick.github.github_auth import get_installation_id
 from baldrick.github.github_api import RepoHandler
 
 from flask import Blueprint, request
@@ -33,7 +33,7 @@ def circleci_handler():
     if not request.data:
         return "No payload received"
 
-    payload = json.loads(request.data)['payload']
+    payload = json_backend.loads(request.data)['payload']
 
     # Validate we have the keys we need, otherwise ignore the push
     required_keys = {'vcs_revision',
@@ -46,13 +46,13 @@ def circleci_handler():
         return 'Payload missing {}'.format(' '.join(required_keys - payload.keys()))
 
     # Get installation id
-    repos = repo_to_installation_id_mapping()
     repo = f"{payload['username']}/{payload['reponame']}"
+    installation = get_installation_id(repo)
 
-    if repo not in repos:
+    if installation is None:
         return f"circleci: Not installed for {repo}"
 
-    repo_handler = RepoHandler(repo, branch="master", installation=repos[repo])
+    repo_handler = RepoHandler(repo, branch="master", installation=installation)
 
     for handler in CIRCLECI_WEBHOOK_HANDLERS:
         handler(repo_handler, "v1", payload, request.headers, payload["status"], payload["vcs_revision"], payload["build_num"])
@@ -65,7 +65,7 @@ def circleci_new_handler():
     if not request.data:
         return "No payload received"
 
-    payload = json.loads(request.data)
+    payload = json_backend.loads(request.data)
 
     logger.debug(f"Got {pformat(payload)} on /circleci/v2")
     # Validate we have the keys we need, otherwise ignore the push
@@ -87,17 +87,15 @@ def circleci_new_handler():
         return msg
 
     # Get installation id
-    repos = repo_to_installation_id_mapping()
-
     repo = vcs["target_repository_url"].removeprefix("https://github.com/")
+    installation = get_installation_id(repo)
 
-    if repo not in repos:
+    if installation is None:
         msg = f"Not installed for {repo}"
         logger.error(msg)
-        logger.trace(f"Only installed for {repos.keys()}")
         return msg
 
-    repo_handler = RepoHandler(repo, branch=vcs["branch"], installation=repos[repo])
+    repo_handler = RepoHandler(repo, branch=vcs["branch"], installation=installation)
 
     for handler in CIRCLECI_WEBHOOK_HANDLERS:
         handler(repo_handler,
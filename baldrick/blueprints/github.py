@@ -1,8 +1,7 @@
-import json
-
 from flask import Blueprint, request
 
-from baldrick.github.github_api import RepoHandler
+from baldrick import json_backend
+from baldrick.github.github_api import RepoHandler, update_caches_from_webhook
 
 __all__ = ['github_blueprint', 'github_webhook_handler']
 
@@ -32,13 +31,18 @@ def github_webhook():
         return "No payload received"
 
     # Parse the JSON sent by GitHub
-    payload = json.loads(request.data)
+    payload = json_backend.loads(request.data)
+
+    update_caches_from_webhook(request.headers.get('X-GitHub-Event'), payload)
 
     if 'installation' not in payload:
         return "No installation key found in payload"
     else:
         installation = payload['installation']['id']
 
+    if 'repository' not in payload:
+        return "No repository key found in payload"
+
     repo_name = payload['repository']['full_name']
     repo = RepoHandler(repo_name, installation=installation)
 
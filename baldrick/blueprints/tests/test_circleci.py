@@ -32,8 +32,8 @@ class TestHook:
 
         data = {'payload': payload}
 
-        with patch('baldrick.blueprints.circleci.repo_to_installation_id_mapping') as mapping:
-            mapping.return_value = {'test/testbot': 15554}
+        with patch('baldrick.blueprints.circleci.get_installation_id') as get_installation_id:
+            get_installation_id.side_effect = {'test/testbot': 15554}.get
             client.post('/circleci', data=json.dumps(data),
                         content_type='application/json')
 
@@ -49,8 +49,8 @@ class TestHook:
 
         data = {'payload': payload}
 
-        with patch('baldrick.blueprints.circleci.repo_to_installation_id_mapping') as mapping:
-            mapping.return_value = {'test/testbot': 15554}
+        with patch('baldrick.blueprints.circleci.get_installation_id') as get_installation_id:
+            get_installation_id.side_effect = {'test/testbot': 15554}.get
             result = client.post('/circleci', data=json.dumps(data),
                                  content_type='application/json')
 
@@ -1,6 +1,6 @@
 import json
 from copy import copy
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from baldrick.blueprints.github import github_webhook_handler, GITHUB_WEBHOOK_HANDLERS
 
@@ -51,6 +51,22 @@ class TestHook:
 
         assert result.get_data() == b'No installation key found in payload'
 
+    def test_missing_repository(self, app, client):
+
+        data = {'action': 'added',
+                'installation': {'id': '123'},
+                'repositories_added': [{'full_name': 'test-repo'}]}
+
+        headers = {'X-GitHub-Event': 'installation_repositories'}
+
+        with patch('baldrick.blueprints.github.update_caches_from_webhook') as update:
+            result = client.post('/github', data=json.dumps(data), headers=headers,
+                                 content_type='application/json')
+
+        update.assert_called_once_with('installation_repositories', data)
+        assert result.get_data() == b'No repository key found in payload'
+        assert mock_hook.call_count == 0
+
     def test_missing_payload(self, app, client):
 
         headers = {'X-GitHub-Event': 'pull_request'}
@@ -0,0 +1,455 @@
+"""
+Caches used to avoid repeated requests to GitHub.
+
+By default caches only live in the memory of each process. If the
+``BALDRICK_CACHE_DB`` environment variable is set to the path of a SQLite
+database, caches created with `make_cache` are also backed by that database,
+which is shared by all the worker processes on a machine and survives
+restarts.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ['LRUCache', 'SQLiteCache', 'TieredCache', 'make_cache']
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe mapping which holds at most ``maxsize`` items.
+
+    When the cache is full the least recently used item is evicted. Items can
+    optionally expire after ``ttl`` seconds. The number of hits, misses and
+    evictions are counted and returned by `stats`.
+
+    Parameters
+    ----------
+    maxsize : `int`
+        The maximum number of items to hold.
+
+    ttl : `float` or `None`
+        The default number of seconds after which items expire. `None` means
+        items only leave the cache when they are evicted.
+
+    maxbytes : `int` or `None`
+        If given, the maximum total size of the items, as given by ``sizeof``.
+        Items larger than this are not stored.
+
+    sizeof : callable, optional
+        The function giving the size of an item in bytes, required if
+        ``maxbytes`` is given.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, maxbytes=None, sizeof=None):
+        if maxbytes is not None and sizeof is None:
+            raise ValueError("sizeof is required when maxbytes is set")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        # Must be called with the lock held
+        try:
+            expiry, value, size = self._data[key]
+        except KeyError:
+            return _MISSING
+        if expiry is not None and expiry < time.monotonic():
+            self._remove(key)
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _remove(self, key):
+        # Must be called with the lock held
+        self.nbytes -= self._data.pop(key)[2]
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        Add an item to the cache, optionally with a specific ``ttl``.
+        """
+        if ttl is _MISSING:
+            ttl = self.ttl
+        expiry = None if ttl is None else time.monotonic() + ttl
+        size = 0 if self.maxbytes is None else self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (expiry, value, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                return default
+            self._remove(key)
+            return value
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        """
+        Remove all items from the cache and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dictionary with the hit, miss and eviction counts.
+        """
+        with self._lock:
+            stats = {'hits': self.hits,
+                     'misses': self.misses,
+                     'evictions': self.evictions,
+                     'size': len(self._data),
+                     'maxsize': self.maxsize}
+            if self.maxbytes is not None:
+                stats['nbytes'] = self.nbytes
+                stats['maxbytes'] = self.maxbytes
+            return stats
+
+
+class SQLiteCache:
+    """
+    A cache stored in a SQLite database which can be shared between processes.
+
+    Several caches can share the same database file as long as they use
+    different namespaces. Keys and values must be serializable to JSON.
+
+    Parameters
+    ----------
+    path : `str`
+        The path to the database file, it will be created if needed.
+
+    namespace : `str`
+        The name of this cache within the database.
+
+    maxsize : `int`
+        The maximum number of items to hold in this namespace. The least
+        recently used items are removed first.
+
+    ttl : `float` or `None`
+        The default number of seconds after which items expire.
+
+    touch_interval : `float`
+        The access time used to evict items is only updated when it is older
+        than this number of seconds, so that most reads don't need to take
+        the write lock of the database.
+    """
+
+    def __init__(self, path, namespace='default', maxsize=10000, ttl=None, touch_interval=60):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _connection(self):
+        # Each thread gets its own connection, SQLite takes care of locking
+        # between threads and processes.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache ('
+                               'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                               'expires REAL, accessed REAL NOT NULL, '
+                               'PRIMARY KEY (namespace, key))')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed)')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """
+        Close the connections to the database opened by all threads.
+        """
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def get(self, key, default=None):
+        now = time.time()
+        key = json.dumps(key)
+        row = self._connection.execute(
+            'SELECT value, accessed FROM cache WHERE namespace = ? AND key = ? AND (expires IS NULL OR expires >= ?)',
+            (self.namespace, key, now)).fetchone()
+        if row is None:
+            with self._stats_lock:
+                self.misses += 1
+            return default
+        if now - row[1] > self.touch_interval:
+            self._connection.execute('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?',
+                                     (now, self.namespace, key))
+        with self._stats_lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        Add an item to the cache, optionally with a specific ``ttl``.
+        """
+        if ttl is _MISSING:
+            ttl = self.ttl
+        now = time.time()
+        expiry = None if ttl is None else now + ttl
+        connection = self._connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                               (self.namespace, json.dumps(key), json.dumps(value), expiry, now))
+            connection.execute('DELETE FROM cache WHERE namespace = ? AND expires < ?',
+                               (self.namespace, now))
+            connection.execute('DELETE FROM cache WHERE namespace = ? AND key IN '
+                               '(SELECT key FROM cache WHERE namespace = ? '
+                               'ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                               (self.namespace, self.namespace, self.maxsize))
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        row = self._connection.execute(
+            'SELECT 1 FROM cache WHERE namespace = ? AND key = ? AND (expires IS NULL OR expires >= ?)',
+            (self.namespace, json.dumps(key), time.time())).fetchone()
+        return row is not None
+
+    def pop(self, key, default=None):
+        connection = self._connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT value, expires FROM cache WHERE namespace = ? AND key = ?',
+                (self.namespace, json.dumps(key))).fetchone()
+            connection.execute('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                               (self.namespace, json.dumps(key)))
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def __len__(self):
+        row = self._connection.execute(
+            'SELECT COUNT(*) FROM cache WHERE namespace = ? AND (expires IS NULL OR expires >= ?)',
+            (self.namespace, time.time())).fetchone()
+        return row[0]
+
+    def clear(self):
+        """
+        Remove all items in this namespace and reset the counters.
+        """
+        with self._connection as connection:
+            connection.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+        with self._stats_lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Return a dictionary with the hit and miss counts.
+        """
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        return {'hits': hits,
+                'misses': misses,
+                'size': len(self),
+                'maxsize': self.maxsize}
+
+
+class TieredCache:
+    """
+    An in-memory `LRUCache` in front of a shared `SQLiteCache`.
+
+    Reads are served from memory when possible, then from the shared cache
+    (in which case the item is copied to memory). Writes and removals go to
+    both.
+
+    Parameters
+    ----------
+    local : `LRUCache`
+        The in-process cache.
+
+    shared : `SQLiteCache`
+        The cache shared with other processes.
+    """
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    @property
+    def maxsize(self):
+        return self.local.maxsize
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.shared.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self.local[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        Add an item to both caches, optionally with a specific ``ttl``.
+
+        The item is kept in memory for the shorter of ``ttl`` and the default
+        TTL of the local cache, so that it never outlives the shared copy.
+        """
+        local_ttl = self.local.ttl
+        if ttl is not _MISSING and ttl is not None and (local_ttl is None or ttl < local_ttl):
+            local_ttl = ttl
+        self.local.set(key, value, ttl=local_ttl)
+        self.shared.set(key, value, ttl=ttl)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return key in self.local or key in self.shared
+
+    def pop(self, key, default=None):
+        local = self.local.pop(key, _MISSING)
+        shared = self.shared.pop(key, _MISSING)
+        if local is not _MISSING:
+            return local
+        if shared is not _MISSING:
+            return shared
+        return default
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self):
+        return len(self.shared)
+
+    def keys(self):
+        return self.local.keys()
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self):
+        self.shared.close()
+
+    def stats(self):
+        return {'local': self.local.stats(),
+                'shared': self.shared.stats()}
+
+
+def make_cache(namespace, maxsize=128, ttl=None, immutable=False):
+    """
+    Create a cache, shared between processes if ``BALDRICK_CACHE_DB`` is set.
+
+    Parameters
+    ----------
+    namespace : `str`
+        A name for the cache, which must be unique within the database.
+
+    maxsize : `int`
+        The maximum number of items to keep in memory.
+
+    ttl : `float` or `None`
+        The number of seconds after which items expire.
+
+    immutable : `bool`
+        Whether the values for a key never change (e.g. when the key includes
+        a commit SHA). If not, items are only kept in memory for
+        ``BALDRICK_CACHE_DB_LOCAL_TTL`` seconds (default 5) so that updates
+        made by other processes are seen quickly.
+
+    Returns
+    -------
+    cache : `LRUCache` or `TieredCache`
+    """
+    path = os.environ.get('BALDRICK_CACHE_DB')
+    if not path:
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+
+    local_ttl = ttl
+    if not immutable:
+        local_ttl = float(os.environ.get('BALDRICK_CACHE_DB_LOCAL_TTL', 5))
+        if ttl is not None:
+            local_ttl = min(ttl, local_ttl)
+
+    shared = SQLiteCache(path, namespace=namespace, ttl=ttl,
+                         maxsize=int(os.environ.get('BALDRICK_CACHE_DB_SIZE', 10000)))
+
+    return TieredCache(LRUCache(maxsize=maxsize, ttl=local_ttl), shared)
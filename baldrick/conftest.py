@@ -1,4 +1,3 @@
-import os
 import logging
 
 import pytest
@@ -36,12 +35,45 @@ IJVMoU0lvK0zKm5VlXh3jbRXt/M5cTNu/1+xZxUbGJ0b+Go3FYc=
 """.strip()
 
 
+@pytest.fixture(autouse=True)
+def clear_github_caches():
+    """
+    Make sure that the caches shared between handlers don't leak between tests.
+    """
+    from baldrick.github.github_api import (CHECK_RUN_CACHE, CONFIG_CACHE, FILE_CACHE, LABEL_CACHE,
+                                            REF_CACHE, REPO_INFO_CACHE, TIMELINE_CACHE, COMMENT_CACHE,
+                                            MODIFIED_FILES_CACHE)
+    from baldrick.github.github_auth import (INSTALLATION_CACHE, MISSING_INSTALLATION_CACHE,
+                                            REPO_INSTALLATION_CACHE, TOKEN_MANAGER)
+    from baldrick.github.github_rate_limit import RATE_LIMITER
+    from baldrick.github.github_session import CONDITIONAL_REQUESTS, RESPONSE_CACHE, RETRY_POLICY
+    yield
+    CHECK_RUN_CACHE.clear()
+    CONFIG_CACHE.clear()
+    FILE_CACHE.clear()
+    LABEL_CACHE.clear()
+    MODIFIED_FILES_CACHE.clear()
+    REF_CACHE.clear()
+    REPO_INFO_CACHE.clear()
+    COMMENT_CACHE.clear()
+    RESPONSE_CACHE.clear()
+    CONDITIONAL_REQUESTS.clear()
+    TIMELINE_CACHE.clear()
+    INSTALLATION_CACHE.clear()
+    REPO_INSTALLATION_CACHE.clear()
+    MISSING_INSTALLATION_CACHE.clear()
+    TOKEN_MANAGER.clear()
+    RATE_LIMITER.clear()
+    RETRY_POLICY.clear()
+
+
 @pytest.fixture
-def app():
+def app(monkeypatch):
     from unittest.mock import patch
     from baldrick import create_app
-    os.environ['GITHUB_APP_INTEGRATION_ID'] = '1234'
-    os.environ['GITHUB_APP_PRIVATE_KEY'] = PRIVATE_KEY
+    monkeypatch.setenv('GITHUB_APP_INTEGRATION_ID', '1234')
+    monkeypatch.setenv('GITHUB_APP_PRIVATE_KEY', PRIVATE_KEY)
+    monkeypatch.setenv('BALDRICK_INSTALLATION_DISCOVERY', 'sync')
     with patch('baldrick.github.github_auth.repo_to_installation_id_mapping') as mock_mapping:
         mock_mapping.return_value = {'test/test-repo': 123}
         return create_app('testbot')
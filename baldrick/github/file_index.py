@@ -0,0 +1,86 @@
+"""
+A compact index of the files modified by a pull request.
+"""
+import bisect
+import re
+import sys
+from fnmatch import fnmatchcase
+
+__all__ = ['FileIndex']
+
+_WILDCARD = re.compile(r'[*?[]')
+
+
+class FileIndex:
+    """
+    An immutable collection of paths with fast membership, prefix and glob
+    lookups.
+
+    Iterating over the index gives the paths in the order they were given in.
+    The paths are interned, so that a path which is in the indexes of several
+    pull requests is only stored once, and a sorted copy is kept to find paths
+    by bisection. This keeps lookups fast on pull requests which modify
+    thousands of files.
+
+    Parameters
+    ----------
+    paths : iterable of `str`
+        The paths to index.
+    """
+
+    __slots__ = ('_paths', '_sorted')
+
+    def __init__(self, paths=()):
+        self._paths = tuple(sys.intern(path) for path in paths)
+        self._sorted = tuple(sorted(set(self._paths)))
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path):
+        index = bisect.bisect_left(self._sorted, path)
+        return index < len(self._sorted) and self._sorted[index] == path
+
+    def __repr__(self):
+        return f'<FileIndex with {len(self)} paths>'
+
+    def tolist(self):
+        """
+        Return the paths as a list, in their original order.
+        """
+        return list(self._paths)
+
+    def _prefix_range(self, prefix):
+        start = bisect.bisect_left(self._sorted, prefix)
+        end = bisect.bisect_right(self._sorted, prefix, lo=start, key=lambda path: path[:len(prefix)])
+        return start, end
+
+    def has_prefix(self, prefix):
+        """
+        Whether any path starts with ``prefix`` (e.g. a directory name
+        followed by ``/``).
+        """
+        start, end = self._prefix_range(prefix)
+        return end > start
+
+    def with_prefix(self, prefix):
+        """
+        Return the paths which start with ``prefix``, in sorted order.
+        """
+        start, end = self._prefix_range(prefix)
+        return list(self._sorted[start:end])
+
+    def match(self, pattern):
+        """
+        Return the paths which match a shell-style ``pattern``, in sorted
+        order.
+
+        As with `fnmatch.fnmatchcase`, ``*`` also matches ``/``. Only the
+        paths which start with the part of the pattern before the first
+        wildcard are compared with the pattern.
+        """
+        prefix = _WILDCARD.split(pattern, 1)[0]
+        return [path for path in self.with_prefix(prefix) if fnmatchcase(path, pattern)]
@@ -1,53 +1,591 @@
 """Module to handle GitHub API."""
 import base64
+import contextvars
+import copy
+import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
 
 import dateutil.parser
-import requests
 from flask import current_app
 from loguru import logger
-from ttldict import TTLOrderedDict
+from requests.utils import parse_header_links
 
+from baldrick.cache import LRUCache, make_cache
 from baldrick.config import Config, loads
-from baldrick.github.github_auth import github_request_headers
+from baldrick.github.file_index import FileIndex
+from baldrick.github.github_auth import github_request_headers, update_installations_from_webhook
+from baldrick.github.github_session import get_session
+from baldrick.github.projections import IssueInfo, PullRequestInfo
 
 __all__ = ['GitHubHandler', 'IssueHandler', 'RepoHandler', 'PullRequestHandler']
 
 HOST = "https://api.github.com"
 HOST_NONAPI = "https://github.com"
+GRAPHQL_URL = f"{HOST}/graphql"
 
-FILE_CACHE = TTLOrderedDict(default_ttl=os.environ.get('BALDRICK_FILE_CACHE_TTL', 60))
+# File contents, keyed by (repo, path, commit SHA). As commits never change
+# there is no need for these to expire.
+FILE_CACHE = make_cache('files', maxsize=int(os.environ.get('BALDRICK_FILE_CACHE_SIZE', 512)),
+                        immutable=True)
 
+# The commit SHA each branch points to, keyed by (repo, branch). This is kept
+# up to date by push and pull_request events, the TTL is only a backstop.
+REF_CACHE = make_cache('refs', maxsize=int(os.environ.get('BALDRICK_REF_CACHE_SIZE', 1024)),
+                       ttl=float(os.environ.get('BALDRICK_REF_CACHE_TTL', 60)))
 
-def paged_github_json_request(url, headers=None):
+SHA_PATTERN = re.compile('^[0-9a-f]{40}$')
 
-    response = requests.get(url, headers=headers)
+# Merged configurations, keyed by the content of the config file and the
+# settings of the app they were merged with.
+CONFIG_CACHE = LRUCache(maxsize=int(os.environ.get('BALDRICK_CONFIG_CACHE_SIZE', 128)))
+
+# The maximum page size allowed by the GitHub API
+PER_PAGE = 100
+
+PAGINATION_WORKERS = int(os.environ.get('BALDRICK_PAGINATION_WORKERS', 4))
+
+# Repository metadata (GET /repos/{repo}), shared by all handlers
+REPO_INFO_CACHE = make_cache('repo_info', maxsize=int(os.environ.get('BALDRICK_REPO_INFO_CACHE_SIZE', 256)),
+                             ttl=float(os.environ.get('BALDRICK_REPO_INFO_TTL', 300)))
+
+# The check runs posted by this app on each commit, keyed by (repo, SHA). This
+# is kept up to date by set_check, and check_run events remove the commit.
+CHECK_RUN_CACHE = make_cache('check_runs', maxsize=int(os.environ.get('BALDRICK_CHECK_RUN_CACHE_SIZE', 256)),
+                             ttl=float(os.environ.get('BALDRICK_CHECK_RUN_CACHE_TTL', 300)))
+
+# The names of the labels defined in each repository. Label events remove the
+# repository, the TTL is only a backstop.
+LABEL_CACHE = make_cache('labels', maxsize=int(os.environ.get('BALDRICK_LABEL_CACHE_SIZE', 256)),
+                         ttl=float(os.environ.get('BALDRICK_LABEL_CACHE_TTL', 600)))
+
+# What we know about the timeline of each issue, keyed by (repo, number): how
+# many events have been read so far and, for each label, when it was last
+# added (or `None` if it was removed since). Only newer events are requested
+# when an issue is looked at again.
+TIMELINE_CACHE = make_cache('timelines', maxsize=int(os.environ.get('BALDRICK_TIMELINE_CACHE_SIZE', 1024)),
+                            ttl=float(os.environ.get('BALDRICK_TIMELINE_CACHE_TTL', 86400)))
+
+# The comments on each issue, keyed by (repo, number) and indexed by the login
+# of their author. Only the comments created or edited since the last lookup
+# are requested when an issue is looked at again.
+COMMENT_CACHE = make_cache('comments', maxsize=int(os.environ.get('BALDRICK_COMMENT_CACHE_SIZE', 1024)),
+                           ttl=float(os.environ.get('BALDRICK_COMMENT_CACHE_TTL', 86400)))
+
+# The paths of the files modified by each pull request, keyed by (repo,
+# number, head SHA, base branch). The patches are not kept.
+MODIFIED_FILES_CACHE = make_cache('modified_files',
+                                  maxsize=int(os.environ.get('BALDRICK_MODIFIED_FILES_CACHE_SIZE', 256)),
+                                  immutable=True)
+
+
+def _split_url(url, params=None):
+    """
+    Split the query string off ``url`` and merge it with ``params``.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update(params or {})
+    return urlunsplit(parts._replace(query='')), query
+
+
+def _parse_links(response):
+    """
+    Return the ``Link`` header of a response as a ``{rel: url}`` dictionary.
+    """
+    if 'Link' not in response.headers:
+        return {}
+    links = parse_header_links(response.headers['Link'])
+    return {link['rel']: link['url'] for link in links if 'rel' in link}
+
+
+def _merge_pages(results, page):
+    """
+    Merge one page of results into the results so far.
+
+    Most collections are plain lists, but some endpoints (e.g. check runs)
+    return a dictionary with a single list of items and a total count.
+    """
+    if isinstance(results, list):
+        results.extend(page)
+    else:
+        for key, value in page.items():
+            if isinstance(value, list):
+                results.setdefault(key, []).extend(value)
+    return results
+
+
+def paged_github_json_request(url, headers=None, session=None, params=None,
+                              max_workers=None):
+    """
+    Get all the pages of a paginated GitHub collection.
+
+    The first page is requested with the maximum page size. If GitHub
+    tells us how many pages there are (through the ``last`` link) the remaining
+    pages are requested concurrently, otherwise we follow the ``next`` links.
+
+    Parameters
+    ----------
+    url : `str`
+        The URL of the collection. It may already include a query string.
+
+    headers : `dict`, optional
+        The headers to send with each request.
+
+    session : `requests.Session`, optional
+        The session to make the requests with.
+
+    params : `dict`, optional
+        Extra query parameters.
+
+    max_workers : `int`, optional
+        The maximum number of pages to fetch at the same time. Defaults to
+        ``BALDRICK_PAGINATION_WORKERS`` or 4.
+
+    Returns
+    -------
+    results : `list` or `dict`
+        All the items of the collection.
+    """
+
+    if session is None:
+        session = get_session()
+
+    if max_workers is None:
+        max_workers = PAGINATION_WORKERS
+
+    base_url, query = _split_url(url, params)
+    query.setdefault('per_page', PER_PAGE)
+
+    response = session.get(base_url, params=query, headers=headers)
     assert response.ok, response.content
     results = response.json()
 
-    if 'Link' in response.headers:
+    links = _parse_links(response)
 
-        links = response.headers['Link']
+    if 'last' in links:
 
-        # There are likely better ways to parse/extract the link information
-        # but here we just find the last page number mentioned in the header
-        # 'Link' section and then loop over all pages to get the comments
-        last_match = list(re.finditer('page=[0-9]+', links))[-1]
-        last_page = int(links[last_match.start():last_match.end()].split('=')[1])
+        last_page = int(_split_url(links['last'])[1].get('page', 1))
 
-        # If there are other pages, just loop over them and get all the
-        # comments
-        if last_page > 1:
-            for page in range(2, last_page + 1):
-                response = requests.get(url + '?page={0}'.format(page), headers=headers)
-                assert response.ok, response.content
-                results += response.json()
+        def get_page(page):
+            response = session.get(base_url, params={**query, 'page': page}, headers=headers)
+            assert response.ok, response.content
+            return response.json()
+
+        # Run the requests in the context of the caller, so that e.g. the
+        # priority of the requests is kept.
+        context = contextvars.copy_context()
+
+        pages = range(2, last_page + 1)
+        if len(pages) > 0:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+                for page in executor.map(lambda page: context.copy().run(get_page, page), pages):
+                    results = _merge_pages(results, page)
+
+    else:
+
+        # Some endpoints use cursors instead of page numbers, in which case we
+        # have to walk the pages one by one.
+        while 'next' in links:
+            response = session.get(links['next'], headers=headers)
+            assert response.ok, response.content
+            results = _merge_pages(results, response.json())
+            links = _parse_links(response)
 
     return results
 
 
+def iter_github_json(url, headers=None, session=None, params=None, key=None,
+                     prefetch=True):
+    """
+    Iterate lazily over the items of a paginated GitHub collection.
+
+    Pages are only requested as the items are consumed, so callers which stop
+    early never download the remaining pages. While the items of one page are
+    being consumed the next page is requested in the background.
+
+    Parameters
+    ----------
+    url : `str`
+        The URL of the collection. It may already include a query string.
+
+    headers : `dict`, optional
+        The headers to send with each request.
+
+    session : `requests.Session`, optional
+        The session to make the requests with.
+
+    params : `dict`, optional
+        Extra query parameters.
+
+    key : `str`, optional
+        For endpoints which return a dictionary (e.g. check runs), the key
+        holding the list of items.
+
+    prefetch : `bool`, optional
+        Whether to request the next page while the current one is consumed.
+
+    Yields
+    ------
+    item : `dict`
+        The items in the collection, in the order returned by GitHub.
+    """
+
+    if session is None:
+        session = get_session()
+
+    base_url, query = _split_url(url, params)
+    query.setdefault('per_page', PER_PAGE)
+
+    def get_page(page_url, page_params=None):
+        response = session.get(page_url, params=page_params, headers=headers)
+        assert response.ok, response.content
+        return response.json(), _parse_links(response)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    try:
+        page, links = get_page(base_url, query)
+        while True:
+            next_page = None
+            if 'next' in links and executor is not None:
+                next_page = executor.submit(contextvars.copy_context().run, get_page, links['next'])
+
+            yield from (page if key is None else page.get(key, []))
+
+            if 'next' not in links:
+                return
+            elif next_page is not None:
+                page, links = next_page.result()
+            else:
+                page, links = get_page(links['next'])
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _update_check_run_index(repo, check_run):
+    """
+    Record a check run posted by this app, if we know about its commit.
+    """
+    key = (repo, check_run['head_sha'])
+    checks = CHECK_RUN_CACHE.get(key)
+    if checks is not None and check_run.get('external_id'):
+        checks[check_run['external_id']] = _check_from_json(check_run)
+        CHECK_RUN_CACHE[key] = checks
+
+
+def update_caches_from_webhook(event, payload):
+    """
+    Update the caches shared between handlers following a webhook event.
+
+    Parameters
+    ----------
+    event : `str`
+        The event type, from the ``X-GitHub-Event`` header.
+
+    payload : `dict`
+        The webhook payload.
+    """
+
+    if event == 'repository':
+        repository = payload['repository']
+        REPO_INFO_CACHE.pop(repository['full_name'])
+        # Also forget about the old name of renamed repositories
+        old_name = payload.get('changes', {}).get('repository', {}).get('name', {}).get('from')
+        if old_name:
+            REPO_INFO_CACHE.pop(f"{repository['owner']['login']}/{old_name}")
+
+    elif event == 'installation_repositories':
+        for key in ('repositories_added', 'repositories_removed'):
+            for repository in payload.get(key, []):
+                REPO_INFO_CACHE.pop(repository['full_name'])
+        update_installations_from_webhook(event, payload)
+
+    elif event == 'installation':
+        update_installations_from_webhook(event, payload)
+
+    # Webhook payloads are not authenticated, so the SHAs they contain are
+    # never written to the shared caches, the branches are only looked up
+    # again the next time they are needed.
+    elif event == 'push':
+        if payload['ref'].startswith('refs/heads/'):
+            REF_CACHE.pop((payload['repository']['full_name'], payload['ref'][len('refs/heads/'):]))
+
+    elif event == 'pull_request':
+        head = payload['pull_request'].get('head') or {}
+        if head.get('repo') and head.get('ref'):
+            REF_CACHE.pop((head['repo']['full_name'], head['ref']))
+
+    # As for branches, the labels in the payload are not trusted, they are
+    # only requested again the next time they are needed.
+    elif event == 'label':
+        LABEL_CACHE.pop(payload['repository']['full_name'])
+
+    elif event == 'issue_comment':
+        # Deleted comments disappear from the timeline, so the events we have
+        # already read no longer line up with the pages.
+        if payload['action'] == 'deleted':
+            key = (payload['repository']['full_name'], payload['issue']['number'])
+            TIMELINE_CACHE.pop(key)
+            _remove_comment(key, payload['comment'])
+
+    # As above, the check runs in the payload are not trusted, the commit is
+    # only listed again the next time its checks are needed.
+    elif event == 'check_run':
+        check_run = payload['check_run']
+        if check_run['app']['id'] == current_app.integration_id:
+            CHECK_RUN_CACHE.pop((payload['repository']['full_name'], check_run['head_sha']))
+
+
+def _copy_comments(store):
+    """
+    Return a copy of an entry of `COMMENT_CACHE`, or a new empty one.
+    """
+    if store is None:
+        return {'since': None, 'logins': {}}
+    return {'since': store['since'],
+            'logins': {login: dict(comments) for login, comments in store['logins'].items()}}
+
+
+def _index_comments(store, comments, update_since=True):
+    """
+    Add comments returned by GitHub to an entry of `COMMENT_CACHE`.
+
+    Only the fields needed to look comments up are kept. Edited comments
+    replace the earlier version. Unless ``update_since`` is `False`, the date
+    from which to request new comments is moved to the last update seen.
+    """
+    for comment in comments:
+        by_id = store['logins'].setdefault(comment['user']['login'], {})
+        by_id[str(comment['id'])] = {'id': comment['id'],
+                                     'body': comment['body'],
+                                     'created_at': comment['created_at']}
+        if update_since and (store['since'] is None or comment['updated_at'] > store['since']):
+            store['since'] = comment['updated_at']
+    return store
+
+
+def _remove_comment(key, comment):
+    store = COMMENT_CACHE.get(key)
+    if store is not None:
+        store = _copy_comments(store)
+        store['logins'].get(comment['user']['login'], {}).pop(str(comment['id']), None)
+        COMMENT_CACHE[key] = store
+
+
+def _comment_params(store):
+    """
+    Return the query parameters to request the comments missing from an
+    entry of `COMMENT_CACHE`.
+    """
+    return {} if store['since'] is None else {'since': store['since']}
+
+
+def _timeline_event_id(event):
+    """
+    Return an identifier for a timeline event, which not all events have.
+    """
+    return event.get('node_id') or event.get('id') or f"{event.get('event')}@{event.get('created_at')}"
+
+
+class _TimelineUpdate:
+    """
+    Apply the events added to the timeline of an issue since it was last read
+    to a copy of its entry in `TIMELINE_CACHE`.
+
+    The events are read from the page which contains the last event that was
+    read before (``params``), and given one by one to `add`. `complete` then
+    tells whether that event is still at the same position, otherwise events
+    were removed from the timeline and it needs to be read again from the
+    start.
+    """
+
+    def __init__(self, timeline=None):
+        if timeline is None:
+            timeline = {'count': 0, 'labels': {}, 'last': None}
+        self.timeline = {'count': timeline['count'], 'labels': dict(timeline['labels']),
+                         'last': timeline.get('last')}
+        # The position of the last event read before, if any
+        self._page, self._skip = divmod(max(timeline['count'] - 1, 0), PER_PAGE)
+        self._resume = timeline['count'] > 0
+        self._seen = 0
+        self._matched = not self._resume
+
+    @property
+    def params(self):
+        return {'page': self._page + 1}
+
+    def add(self, event):
+        self._seen += 1
+        if self._seen <= self._skip:
+            return
+        if self._resume and self._seen == self._skip + 1:
+            self._matched = _timeline_event_id(event) == self.timeline['last']
+            return
+        self.timeline['count'] += 1
+        self.timeline['last'] = _timeline_event_id(event)
+        if 'label' in event:
+            if event['event'] == 'labeled':
+                self.timeline['labels'][event['label']['name']] = event['created_at']
+            elif event['event'] == 'unlabeled':
+                self.timeline['labels'][event['label']['name']] = None
+
+    def complete(self):
+        return self._matched
+
+
+def _check_run_params(only_ours):
+    """
+    Return the query parameters to list the latest check runs of a commit,
+    letting GitHub filter them by app if ``only_ours`` is set.
+    """
+    params = {'filter': 'latest'}
+    if only_ours:
+        params['app_id'] = current_app.integration_id
+    return params
+
+
+def _checks_from_results(results, only_ours):
+    """
+    Index the check runs returned by GitHub by external ID.
+    """
+    checks = {}
+    for result in results.get('check_runs', []):
+        # Skip checks from other apps if specified.
+        if only_ours and result['app']['id'] != current_app.integration_id:
+            continue
+        checks[result['external_id']] = _check_from_json(result)
+    return checks
+
+
+def _missing_labels(labels, issue_labels, repo_labels):
+    """
+    Return the labels which need to be added to an issue, warning about the
+    ones which don't exist in the repository.
+    """
+    if not isinstance(labels, list):
+        labels = [labels]
+
+    missing_labels = set(labels).difference(issue_labels)
+
+    nonexistent_labels = missing_labels.difference(repo_labels)
+    if len(nonexistent_labels) > 0:
+        print(f'-> WARNING: Label does not exist: {nonexistent_labels}')
+
+    return missing_labels.intersection(repo_labels)
+
+
+def _merge_repo_config(repo, branch, file_content):
+    """
+    Merge the config in a ``pyproject.toml`` file with the app config.
+    """
+    # The merged config only depends on the file and the app settings, so
+    # we only parse and merge each file once.
+    fall_back_config = getattr(current_app, "fall_back_config", None)
+    cache_key = (file_content, current_app.bot_username, fall_back_config,
+                 json.dumps(current_app.conf, sort_keys=True, default=str))
+
+    app_config = CONFIG_CACHE.get(cache_key)
+    if app_config is not None:
+        logger.trace(f"Using cached config for {repo}@{branch}")
+        return copy.deepcopy(app_config)
+
+    app_config = copy.deepcopy(current_app.conf)
+    fallback_config = Config()
+    repo_config = Config()
+
+    if file_content:
+        repo_config = loads(file_content, tool=current_app.bot_username) or {}
+        logger.trace(f"Got the following config from {repo}@{branch}: {repo_config}")
+        if len(repo_config) == 0:
+            logger.exception(
+                f"Failed to load config in {repo} on branch {branch}, despite finding a pyproject.toml file.")
+
+        if fall_back_config:
+            fallback_config = loads(file_content, tool=fall_back_config) or {}
+            if len(fallback_config) == 0:
+                logger.trace(f"Didn't find a fallback config in {repo}@{branch}.")
+
+    # Priority is 1) repo_config 2) fallback_config 3) app_config
+    app_config.update_from_config(fallback_config)
+    app_config.update_from_config(repo_config)
+
+    logger.debug(f"Got this combined config from {repo}@{branch}: {app_config}")
+
+    CONFIG_CACHE[cache_key] = app_config
+
+    return copy.deepcopy(app_config)
+
+
+def _config_value(cfg, cfg_key, cfg_default=None):
+    config = current_app.conf.get(cfg_key, {}).copy()
+    config.update(cfg.get(cfg_key, {}))
+
+    if len(config) > 0:
+        return config
+    else:
+        return cfg_default
+
+
+def _check_from_json(result):
+    # These keys match the kwargs to set_check
+    return {
+        'external_id': result['external_id'],
+        'title': result['output']['title'],
+        'summary': result['output']['summary'],
+        'name': result['name'],
+        'text': result['output'].get('text'),
+        'commit_hash': result['head_sha'],
+        'details_url': result.get('details_url'),
+        'status': result['status'],
+        'conclusion': result['conclusion'],
+        'check_id': result['id'],
+    }
+
+
+def _check_parameters(external_id, title, name, summary, text, commit_hash,
+                      details_url, status, conclusion, completed_at):
+    """
+    Build the body of a request to create or update a check run.
+    """
+    if completed_at is True:
+        completed_at = datetime.now(timezone.utc)
+    if completed_at is not None:
+        completed_at = completed_at.isoformat(timespec='seconds') + 'Z'
+
+    # If name isn't specified revert to external_id
+    name = name or f"{current_app.bot_username}:{external_id}"
+
+    output = {'title': title, 'summary': summary or ''}
+    if text is not None:
+        output['text'] = text
+
+    parameters = {'external_id': external_id, 'name': name, 'head_sha':
+                  commit_hash, 'status': status, 'output': output}
+
+    if details_url is not None:
+        parameters['details_url'] = details_url
+
+    if status == "completed" and conclusion is None:
+        logger.warning(
+            "When a GitHub check status is completed, conclusion must be specified, setting it to 'neutral'")
+        conclusion = "neutral"
+
+    if conclusion is not None:
+        parameters['conclusion'] = conclusion
+        if completed_at is not None:
+            parameters['completed_at'] = completed_at
+        # The GitHub API does this automatically, but we do it explicitly
+        # here for consistency and for tests!
+        parameters['status'] = "completed"
+
+    return parameters
+
+
 class GitHubHandler:
     """
     A base class for things that represent things the github app can operate on.
@@ -60,15 +598,28 @@ class GitHubHandler:
     def invalidate_cache(self):
         self._cache.clear()
 
+    @property
+    def _session(self):
+        return get_session(self.installation)
+
     @property
     def repo_info(self):
         """
         The return of GET /repos/{org}/{repo}
+
+        This is cached for all handlers of the same repository for
+        ``BALDRICK_REPO_INFO_TTL`` seconds (default 300), or until a
+        ``repository`` or ``installation_repositories`` event is received for
+        the repository.
         """
-        response = requests.get(f"{HOST}/repos/{self.repo}", headers=self._headers)
-        if not response.ok:
-            raise ValueError(f"Unable to fetch repo information {response.json()}")
-        return response.json()
+        info = REPO_INFO_CACHE.get(self.repo)
+        if info is None:
+            response = self._session.get(f"{HOST}/repos/{self.repo}", headers=self._headers)
+            if not response.ok:
+                raise ValueError(f"Unable to fetch repo information {response.json()}")
+            info = response.json()
+            REPO_INFO_CACHE[self.repo] = info
+        return info
 
     @property
     def default_branch(self):
@@ -85,28 +636,71 @@ class GitHubHandler:
     def _url_contents(self):
         return f'{HOST}/repos/{self.repo}/contents/'
 
+    def resolve_ref(self, ref):
+        """
+        Get the SHA of the commit a branch, tag or SHA points to.
+
+        Parameters
+        ----------
+        ref : `str`
+            The branch, tag or commit SHA.
+
+        Returns
+        -------
+        sha : `str`
+            The full SHA of the commit.
+        """
+        if SHA_PATTERN.match(ref):
+            return ref
+
+        sha = REF_CACHE.get((self.repo, ref))
+        if sha is None:
+            headers = self._headers
+            headers['Accept'] = 'application/vnd.github.sha'
+            response = self._session.get(f'{HOST}/repos/{self.repo}/commits/{ref}', headers=headers)
+            if response.status_code in (404, 422):
+                raise FileNotFoundError(f'{self.repo}@{ref}')
+            assert response.ok, response.content
+            sha = response.text.strip()
+            REF_CACHE[(self.repo, ref)] = sha
+        return sha
+
     def get_file_contents(self, path_to_file, branch=None):
+        """
+        Get the contents of a file.
+
+        Parameters
+        ----------
+        path_to_file : `str`
+            The path of the file in the repository.
+
+        branch : `str`, optional
+            The branch, tag or commit SHA to read the file from. Defaults to
+            the default branch of the repository.
+        """
         if branch is None:
             branch = self.default_branch
-        cache_key = f"{self.repo}:{path_to_file}@{branch}"
 
-        # It seems that this is the only safe way to do this with
-        # TTLOrderedDict
-        try:
-            return FILE_CACHE[cache_key]
-        except KeyError:
-            pass
-
-        url_file = self._url_contents + path_to_file
-        data = {'ref': branch}
-        response = requests.get(url_file, params=data, headers=self._headers)
-        if not response.ok and response.json()['message'] == 'Not Found':
-            raise FileNotFoundError(url_file)
-        assert response.ok, response.content
-        contents_base64 = response.json()['content']
-        contents = base64.b64decode(contents_base64).decode()
+        # File contents are cached by commit SHA, so that they never go stale
+        # and are never fetched twice for the same commit.
+        sha = self.resolve_ref(branch)
+        cache_key = (self.repo, path_to_file, sha)
+
+        if cache_key in FILE_CACHE:
+            contents = FILE_CACHE[cache_key]
+        else:
+            url_file = self._url_contents + path_to_file
+            response = self._session.get(url_file, params={'ref': sha}, headers=self._headers)
+            if not response.ok and response.json()['message'] == 'Not Found':
+                contents = None
+            else:
+                assert response.ok, response.content
+                contents = base64.b64decode(response.json()['content']).decode()
+            FILE_CACHE[cache_key] = contents
+
+        if contents is None:
+            raise FileNotFoundError(self._url_contents + path_to_file)
 
-        FILE_CACHE[cache_key] = contents
         return contents
 
     def get_repo_config(self, branch=None, path_to_file='pyproject.toml'):
@@ -130,9 +724,6 @@ class GitHubHandler:
 
         """
         branch = branch or self.default_branch
-        app_config = current_app.conf.copy()
-        fallback_config = Config()
-        repo_config = Config()
 
         try:
             file_content = self.get_file_contents(path_to_file, branch=branch)
@@ -140,25 +731,7 @@ class GitHubHandler:
             logger.debug(f"No config file found in {self.repo}@{branch}.")
             file_content = None
 
-        if file_content:
-            repo_config = loads(file_content, tool=current_app.bot_username) or {}
-            logger.trace(f"Got the following config from {self.repo}@{branch}: {repo_config}")
-            if len(repo_config) == 0:
-                logger.exception(
-                    f"Failed to load config in {self.repo} on branch {branch}, despite finding a pyproject.toml file.")
-
-            if getattr(current_app, "fall_back_config", None):
-                fallback_config = loads(file_content, tool=current_app.fall_back_config) or {}
-                if len(fallback_config) == 0:
-                    logger.trace(f"Didn't find a fallback config in {self.repo}@{branch}.")
-
-        # Priority is 1) repo_config 2) fallback_config 3) app_config
-        app_config.update_from_config(fallback_config)
-        app_config.update_from_config(repo_config)
-
-        logger.debug(f"Got this combined config from {self.repo}@{branch}: {app_config}")
-
-        return app_config
+        return _merge_repo_config(self.repo, branch, file_content)
 
     def get_config_value(self, cfg_key, cfg_default=None, branch=None):
         """
@@ -169,14 +742,7 @@ class GitHubHandler:
         does not exist either, the value is set to the ``cfg_default`` argument.
         """
         cfg = self.get_repo_config(branch=branch)
-
-        config = current_app.conf.get(cfg_key, {}).copy()
-        config.update(cfg.get(cfg_key, {}))
-
-        if len(config) > 0:
-            return config
-        else:
-            return cfg_default
+        return _config_value(cfg, cfg_key, cfg_default)
 
     def set_status(self, state, description, context, commit_hash, target_url=None):
         """
@@ -209,8 +775,8 @@ class GitHubHandler:
             data['target_url'] = target_url
 
         url = f'{HOST}/repos/{self.repo}/statuses/{commit_hash}'
-        response = requests.post(url, json=data,
-                                 headers=self._headers)
+        response = self._session.post(url, json=data,
+                                      headers=self._headers)
         assert response.ok, response.content
 
     def list_statuses(self, commit_hash):
@@ -224,7 +790,8 @@ class GitHubHandler:
         """
 
         url = f'{HOST}/repos/{self.repo}/commits/{commit_hash}/statuses'
-        results = paged_github_json_request(url, headers=self._headers)
+        results = paged_github_json_request(url, headers=self._headers,
+                                            session=self._session)
 
         statuses = {}
         for result in results:
@@ -235,7 +802,7 @@ class GitHubHandler:
 
         return statuses
 
-    def list_checks(self, commit_hash, only_ours=True):
+    def list_checks(self, commit_hash, only_ours=True, use_cache=True):
         """
         List check messages on a commit on GitHub.
 
@@ -246,33 +813,29 @@ class GitHubHandler:
 
         only_ours : `bool`, optional
             Only return status that this app has posted.
+
+        use_cache : `bool`, optional
+            Whether the checks posted by this app can be taken from
+            `CHECK_RUN_CACHE`. This is only up to date with the checks posted
+            by the current process, so set this to `False` when the result
+            must reflect checks posted by other workers. The checks are then
+            listed with a conditional request.
         """
+        if only_ours and use_cache:
+            checks = CHECK_RUN_CACHE.get((self.repo, commit_hash))
+            if checks is not None:
+                return copy.deepcopy(checks)
+
         url = f'{HOST}/repos/{self.repo}/commits/{commit_hash}/check-runs'
         headers = self._headers
         headers['Accept'] = 'application/vnd.github.antiope-preview+json'
-        results = paged_github_json_request(url, headers=headers)
-
-        checks = {}
-        for result in results.get('check_runs', []):
-
-            # Skip checks from other apps if specified.
-            if only_ours and result['app']['id'] != current_app.integration_id:
-                continue
-
-            context = result['external_id']
-            # These keys match the kwargs to set_check
-            checks[context] = {
-                'external_id': result['external_id'],
-                'title': result['output']['title'],
-                'summary': result['output']['summary'],
-                'name': result['name'],
-                'text': result['output'].get('text'),
-                'commit_hash': result['head_sha'],
-                'details_url': result.get('details_url'),
-                'status': result['status'],
-                'conclusion': result['conclusion'],
-                'check_id': result['id'],
-            }
+        # Only get the latest run of each check, and let GitHub filter by app
+        results = paged_github_json_request(url, headers=headers, session=self._session,
+                                            params=_check_run_params(only_ours))
+        checks = _checks_from_results(results, only_ours)
+
+        if only_ours:
+            CHECK_RUN_CACHE[(self.repo, commit_hash)] = copy.deepcopy(checks)
 
         return checks
 
@@ -288,7 +851,8 @@ class RepoHandler(GitHubHandler):
         return f'{HOST}/repos/{self.repo}/pulls'
 
     def open_pull_requests(self):
-        pull_requests = paged_github_json_request(self._url_pull_requests, headers=self._headers)
+        pull_requests = paged_github_json_request(self._url_pull_requests, headers=self._headers,
+                                                  session=self._session)
         return [pr['number'] for pr in pull_requests]
 
     def get_file_contents(self, path_to_file, branch=None):
@@ -319,8 +883,8 @@ class RepoHandler(GitHubHandler):
         """
         url = f'{HOST}/repos/{self.repo}/issues'
         kwargs = {'state': state, 'labels': labels}
-        r = requests.get(url, kwargs, headers=self._headers)
-        result = r.json()
+        result = paged_github_json_request(url, headers=self._headers,
+                                           session=self._session, params=kwargs)
         if exclude_pr:
             issue_list = [d['number'] for d in result
                           if 'pull_request' not in d]
@@ -329,10 +893,20 @@ class RepoHandler(GitHubHandler):
         return issue_list
 
     def get_all_labels(self):
-        """Get all label options for this repo"""
-        url = f'{HOST}/repos/{self.repo}/labels'
-        result = paged_github_json_request(url, headers=self._headers)
-        return [label['name'] for label in result]
+        """
+        Get all label options for this repo
+
+        These are cached for all handlers of the same repository, and kept up
+        to date by ``label`` events.
+        """
+        labels = LABEL_CACHE.get(self.repo)
+        if labels is None:
+            url = f'{HOST}/repos/{self.repo}/labels'
+            result = paged_github_json_request(url, headers=self._headers,
+                                               session=self._session)
+            labels = [label['name'] for label in result]
+            LABEL_CACHE[self.repo] = labels
+        return list(labels)
 
 
 class IssueHandler(GitHubHandler):
@@ -361,19 +935,75 @@ class IssueHandler(GitHubHandler):
     def _url_timeline(self):
         return f'{self._url_issue}/timeline'
 
+    # The projection of the JSON kept by the handler
+    _info_class = IssueInfo
+
+    def _get_json(self):
+        response = self._session.get(self._url_issue, headers=self._headers)
+        assert response.ok, response.content
+        return response.json()
+
     @property
     def json(self):
+        """
+        The JSON returned by GitHub for this issue.
+
+        This is only requested once for each handler, the first time it is
+        accessed. Baldrick itself only uses `info`, so the whole document is
+        only kept by handlers on which plugins access it.
+        """
         if 'json' not in self._cache:
-            response = requests.get(self._url_issue, headers=self._headers)
-            assert response.ok, response.content
-            self._cache['json'] = response.json()
+            self._cache['json'] = self._get_json()
         return self._cache['json']
 
+    @property
+    def info(self):
+        """
+        The fields of the JSON which are used by baldrick, as a
+        `~baldrick.github.projections.IssueInfo` (or
+        `~baldrick.github.projections.PullRequestInfo`).
+
+        This is only requested once for each handler.
+        """
+        if 'info' not in self._cache:
+            keep_json = 'json' in self._cache
+            self._cache['info'] = self._info_class.from_json(self.json)
+            # The whole document is only kept if it was asked for
+            if not keep_json:
+                self._cache.pop('json', None)
+        return self._cache['info']
+
+    def _read_timeline(self, update):
+        """
+        Give the timeline events which were not read before to a
+        `_TimelineUpdate`, and return whether it is complete.
+        """
+        headers = {**self._headers, 'Accept': 'application/vnd.github.mockingbird-preview'}
+        for d in iter_github_json(self._url_timeline, headers=headers, session=self._session,
+                                  params=update.params):
+            update.add(d)
+        return update.complete()
+
+    def _get_timeline(self):
+        if 'timeline' not in self._cache:
+            key = (self.repo, self.number)
+            update = _TimelineUpdate(TIMELINE_CACHE.get(key))
+            if not self._read_timeline(update):
+                update = _TimelineUpdate()
+                self._read_timeline(update)
+            TIMELINE_CACHE[key] = update.timeline
+            self._cache['timeline'] = update.timeline
+        return self._cache['timeline']
+
     def get_label_added_date(self, label):
         """
         Get last added date for a label.
         If label is re-added, the last time it was added is the one.
 
+        The label events are remembered for ``BALDRICK_TIMELINE_CACHE_TTL``
+        seconds (default one day), and only the events added to the timeline
+        since are requested when the issue is looked at again.
+
         Parameters
         ----------
         label : str
@@ -385,16 +1015,7 @@ class IssueHandler(GitHubHandler):
             Unix timestamp, if available.
 
         """
-        headers = {'Accept': 'application/vnd.github.mockingbird-preview'}
-        result = paged_github_json_request(self._url_timeline, headers=headers)
-        last_labeled = None
-
-        for d in result:
-            if 'label' in d and d['label']['name'] == label:
-                if d['event'] == 'labeled':
-                    last_labeled = d['created_at']
-                elif d['event'] == 'unlabeled':
-                    last_labeled = None
+        last_labeled = self._get_timeline()['labels'].get(label)
 
         if last_labeled is None:
             t = None
@@ -430,42 +1051,69 @@ class IssueHandler(GitHubHandler):
         else:
             url = f'{HOST}/repos/{self.repo}/issues/comments/{comment_id}'
 
-        response = requests.post(url, json=data, headers=self._headers)
+        response = self._session.post(url, json=data, headers=self._headers)
         assert response.ok, response.content
 
+        # Make the comment visible to later lookups by this handler. Other
+        # comments may have been made since we last looked, so this doesn't
+        # move the date from which comments are requested.
+        if 'comments' in self._cache:
+            _index_comments(self._cache['comments'], [response.json()], update_since=False)
+            COMMENT_CACHE[(self.repo, self.number)] = _copy_comments(self._cache['comments'])
+
         if return_url:
             comment_id = response.json()['url'].split('/')[-1]
             return f'{self._url_issue_nonapi}#issuecomment-{comment_id}'
 
+    def _get_comments(self):
+        """
+        Return the comments on this issue, indexed by the login of the author.
+
+        The comments are requested once per handler. Comments seen before
+        are remembered for ``BALDRICK_COMMENT_CACHE_TTL`` seconds (default
+        one day), and only comments created or edited since are requested.
+        """
+        if 'comments' not in self._cache:
+            key = (self.repo, self.number)
+            store = _copy_comments(COMMENT_CACHE.get(key))
+            comments = iter_github_json(self._url_issue_comment, headers=self._headers,
+                                        session=self._session, params=_comment_params(store))
+            _index_comments(store, comments)
+            COMMENT_CACHE[key] = store
+            self._cache['comments'] = store
+        return self._cache['comments']
+
     def _find_comments(self, login, filter_keep=None):
-        if filter_keep is None:
-            def filter_keep(message):
-                return True
-        comments = paged_github_json_request(self._url_issue_comment, headers=self._headers)
-        return [comment for comment in comments if filter_keep(comment['body'])]
+        comments = self._get_comments()['logins'].get(login, {}).values()
+        return [comment for comment in comments if filter_keep is None or filter_keep(comment['body'])]
 
     def find_comments(self, login, filter_keep=None):
         """
         Find comments by a given user.
         """
-        comments = self._find_comments(login, filter_keep=filter_keep)
-        return [comment['id'] for comment in comments if comment['user']['login'] == login]
+        return [comment['id'] for comment in self._find_comments(login, filter_keep=filter_keep)]
 
     def last_comment_date(self, login, filter_keep=None):
         """
         Find the last date on which a comment was made.
         """
-        comments = self._find_comments(login, filter_keep=filter_keep)
-        dates = [comment['created_at'] for comment in comments if comment['user']['login'] == login]
+        dates = [comment['created_at'] for comment in self._find_comments(login, filter_keep=filter_keep)]
         if len(dates) > 0:
-            return dateutil.parser.parse(sorted(dates)[-1]).timestamp()
+            return dateutil.parser.parse(max(dates)).timestamp()
 
     @property
     def labels(self):
-        """Get labels for this issue"""
-        response = requests.get(self._url_labels, headers=self._headers)
-        assert response.ok, response.content
-        return [label['name'] for label in response.json()]
+        """
+        Get labels for this issue
+
+        These are only requested once for each handler, and are updated when
+        labels are added with `set_labels`.
+        """
+        if 'labels' not in self._cache:
+            response = self._session.get(self._url_labels, headers=self._headers)
+            assert response.ok, response.content
+            self._cache['labels'] = [label['name'] for label in response.json()]
+        return list(self._cache['labels'])
 
     # We take this out of set_labels so we can test it without mock
     def _get_missing_labels(self, labels):
@@ -473,8 +1121,7 @@ class IssueHandler(GitHubHandler):
             labels = [labels]
 
         # If label already set, do nothing
-        missing_labels = set(labels).difference(self.labels)
-        if len(missing_labels) == 0:
+        if set(labels).issubset(self.labels):
             return
 
         # Need repo handler (default branch)
@@ -484,14 +1131,8 @@ class IssueHandler(GitHubHandler):
         else:
             repo = self._cache['repohandler']
 
-        # If label does not already exist in the repo, give a warning
-        repo_labels = repo.get_all_labels()
-        nonexistent_labels = missing_labels.difference(repo_labels)
-        if len(nonexistent_labels) > 0:
-            print(f'-> WARNING: Label does not exist: {missing_labels}')
-
         # Return labels to be set
-        missing_labels = missing_labels.intersection(repo_labels)
+        missing_labels = _missing_labels(labels, self.labels, set(repo.get_all_labels()))
         if len(missing_labels) > 0:
             return list(missing_labels)
         else:
@@ -504,27 +1145,88 @@ class IssueHandler(GitHubHandler):
         if missing_labels is None:
             return
 
-        response = requests.post(self._url_labels, headers=self._headers,
-                                 json=missing_labels)
+        response = self._session.post(self._url_labels, headers=self._headers,
+                                      json=missing_labels)
         assert response.ok, response.content
+        # GitHub returns all the labels now on the issue
+        self._cache['labels'] = [label['name'] for label in response.json()]
 
     def close(self):
         url = f'{HOST}/repos/{self.repo}/issues/{self.number}'
         parameters = {'state': 'closed'}
-        response = requests.patch(url, json=parameters, headers=self._headers)
+        response = self._session.patch(url, json=parameters, headers=self._headers)
         assert response.ok, response.content
 
     @property
     def is_closed(self):
         """Is the issue closed?"""
-        answer = False
-        if self.json['state'] == 'closed':
-            answer = True
-        return answer
+        return self.info.state == 'closed'
+
+
+PULL_REQUEST_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $appId: Int) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      number
+      state
+      isDraft
+      author { login }
+      baseRefName
+      baseRefOid
+      headRefName
+      headRefOid
+      headRepository { nameWithOwner }
+      milestone { title }
+      labels(first: 100) {
+        nodes { name }
+        pageInfo { hasNextPage }
+      }
+      files(first: 100) {
+        nodes { path }
+        pageInfo { hasNextPage endCursor }
+      }
+      commits(last: 1) {
+        nodes {
+          commit {
+            oid
+            checkSuites(first: 10, filterBy: {appId: $appId}) {
+              nodes {
+                checkRuns(first: 100) {
+                  nodes {
+                    databaseId externalId name status conclusion
+                    title summary text detailsUrl
+                  }
+                  pageInfo { hasNextPage }
+                }
+              }
+              pageInfo { hasNextPage }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+PULL_REQUEST_FILES_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      files(first: 100, after: $cursor) {
+        nodes { path }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+  }
+}
+"""
 
 
 class PullRequestHandler(IssueHandler):
 
+    _info_class = PullRequestInfo
+
     # https://developer.github.com/v3/checks/runs/#create-a-check-run
     def set_check(self, external_id, title, name=None, summary=None, text=None,
                   commit_hash='head', details_url=None, status=None,
@@ -592,45 +1294,19 @@ class PullRequestHandler(IssueHandler):
         elif commit_hash == "base":
             commit_hash = self.base_sha
 
-        if completed_at is True:
-            completed_at = datetime.now(timezone.utc)
-        if completed_at is not None:
-            completed_at = completed_at.isoformat(timespec='seconds') + 'Z'
-
-        # If name isn't specified revert to external_id
-        name = name or f"{current_app.bot_username}:{external_id}"
-
-        output = {'title': title, 'summary': summary or ''}
-        if text is not None:
-            output['text'] = text
-
-        parameters = {'external_id': external_id, 'name': name, 'head_sha':
-                      commit_hash, 'status': status, 'output': output}
-
-        if details_url is not None:
-            parameters['details_url'] = details_url
-
-        if status == "completed" and conclusion is None:
-            logger.warning(
-                "When a GitHub check status is completed, conclusion must be specified, setting it to 'neutral'")
-            conclusion = "neutral"
-
-        if conclusion is not None:
-            parameters['conclusion'] = conclusion
-            if completed_at is not None:
-                parameters['completed_at'] = completed_at
-            # The GitHub API does this automatically, but we do it explicitly
-            # here for consistency and for tests!
-            parameters['status'] = "completed"
+        parameters = _check_parameters(external_id, title, name, summary, text, commit_hash,
+                                       details_url, status, conclusion, completed_at)
 
         logger.trace(f"Sending GitHub check with {parameters}")
 
         if not check_id:
-            response = requests.post(url, headers=headers, json=parameters)
+            response = self._session.post(url, headers=headers, json=parameters)
         else:
-            response = requests.patch(url + f'/{check_id}', headers=headers, json=parameters)
+            response = self._session.patch(url + f'/{check_id}', headers=headers, json=parameters)
         assert response.ok, response.content
 
+        _update_check_run_index(self.repo, response.json())
+
     def set_status(self, state, description, context, commit_hash="head", target_url=None):
         """
         Set status message on a commit on GitHub.
@@ -675,7 +1351,7 @@ class PullRequestHandler(IssueHandler):
             commit_hash = self.base_sha
         return super().list_statuses(commit_hash)
 
-    def list_checks(self, commit_hash="head", only_ours=True):
+    def list_checks(self, commit_hash="head", only_ours=True, use_cache=True):
         """
         List checks on a commit on GitHub.
 
@@ -685,12 +1361,14 @@ class PullRequestHandler(IssueHandler):
             The commit hash to set the check on. Defaults to "head" can also be "base".
         only_ours : `bool`, optional
             Only return checks which were posted by this GitHub app.
+        use_cache : `bool`, optional
+            Whether the checks posted by this app can be taken from the cache.
         """
         if commit_hash == "head":
             commit_hash = self.head_sha
         elif commit_hash == "base":
             commit_hash = self.base_sha
-        return super().list_checks(commit_hash, only_ours=only_ours)
+        return super().list_checks(commit_hash, only_ours=only_ours, use_cache=use_cache)
 
     @property
     def _url_pull_request(self):
@@ -712,64 +1390,199 @@ class PullRequestHandler(IssueHandler):
     def _url_files(self):
         return f'{self._url_pull_request}/files'
 
-    @property
-    def json(self):
-        if 'json' not in self._cache:
-            response = requests.get(self._url_pull_request, headers=self._headers)
-            assert response.ok, response.content
-            self._cache['json'] = response.json()
-        return self._cache['json']
+    def _get_json(self):
+        response = self._session.get(self._url_pull_request, headers=self._headers)
+        assert response.ok, response.content
+        return response.json()
+
+    def _graphql(self, query, **variables):
+        response = self._session.post(GRAPHQL_URL, headers=self._headers,
+                                      json={'query': query, 'variables': variables})
+        assert response.ok, response.content
+        result = response.json()
+        if result.get('errors'):
+            raise ValueError(f"GraphQL query failed: {result['errors']}")
+        return result['data']
+
+    def load_from_graphql(self):
+        """
+        Load the state of this pull request with the GraphQL API.
+
+        This fetches the fields of the pull request used by the handler (see
+        `info`), the labels, the modified files and the checks posted by this app on the
+        head commit in one query (plus one per extra 100 modified files), and
+        stores them in the cache of the handler (and the index of check runs)
+        so that the corresponding properties and methods do not need any
+        further requests.
+
+        Returns
+        -------
+        loaded : `bool`
+            `False` if the query failed, in which case the REST API is used as
+            usual.
+        """
+        owner, name = self.repo.split('/')
+        number = int(self.number)
+
+        try:
+            data = self._graphql(PULL_REQUEST_QUERY, owner=owner, name=name, number=number,
+                                 appId=current_app.integration_id)
+            pull_request = data['repository']['pullRequest']
+            files = pull_request['files']
+            filenames = [node['path'] for node in files['nodes']]
+            while files['pageInfo']['hasNextPage']:
+                data = self._graphql(PULL_REQUEST_FILES_QUERY, owner=owner, name=name, number=number,
+                                     cursor=files['pageInfo']['endCursor'])
+                files = data['repository']['pullRequest']['files']
+                filenames.extend(node['path'] for node in files['nodes'])
+        except (AssertionError, ValueError, KeyError, TypeError) as exc:
+            logger.warning(f"Could not load {self.repo}#{self.number} with GraphQL: {exc}")
+            return False
+
+        head_repo = pull_request['headRepository']
+        milestone = pull_request['milestone']
+        author = pull_request['author']
+        labels = [node['name'] for node in pull_request['labels']['nodes']]
+
+        self._cache['info'] = PullRequestInfo(
+            number=pull_request['number'],
+            # GraphQL distinguishes merged pull requests, REST calls them closed
+            state='open' if pull_request['state'] == 'OPEN' else 'closed',
+            draft=pull_request['isDraft'],
+            user=author['login'] if author else 'ghost',
+            labels=tuple(labels),
+            milestone=milestone['title'] if milestone else None,
+            head_sha=pull_request['headRefOid'],
+            head_ref=pull_request['headRefName'],
+            head_repo=head_repo['nameWithOwner'] if head_repo else None,
+            base_sha=pull_request['baseRefOid'],
+            base_ref=pull_request['baseRefName'])
+
+        if not pull_request['labels']['pageInfo']['hasNextPage']:
+            self._cache['labels'] = labels
+
+        MODIFIED_FILES_CACHE[(self.repo, self.number, pull_request['headRefOid'],
+                              pull_request['baseRefName'])] = filenames
+        self._cache['modified_files'] = FileIndex(filenames)
+
+        commits = pull_request['commits']['nodes']
+        if commits and commits[0]['commit']['oid'] == pull_request['headRefOid']:
+            suites = commits[0]['commit']['checkSuites']
+            checks = {}
+            complete = not suites['pageInfo']['hasNextPage']
+            for suite in suites['nodes']:
+                complete &= not suite['checkRuns']['pageInfo']['hasNextPage']
+                for run in suite['checkRuns']['nodes']:
+                    checks[run['externalId']] = {
+                        'external_id': run['externalId'],
+                        'title': run['title'],
+                        'summary': run['summary'],
+                        'name': run['name'],
+                        'text': run['text'],
+                        'commit_hash': pull_request['headRefOid'],
+                        'details_url': run['detailsUrl'],
+                        'status': run['status'].lower(),
+                        'conclusion': run['conclusion'].lower() if run['conclusion'] else None,
+                        'check_id': run['databaseId'],
+                    }
+            if complete:
+                CHECK_RUN_CACHE[(self.repo, pull_request['headRefOid'])] = checks
+
+        return True
 
     @property
     def user(self):
-        return self.json['user']['login']
+        return self.info.user
 
     @property
     def head_repo_name(self):
-        return self.json['head']['repo']['full_name']
+        return self.info.head_repo
 
     @property
     def head_sha(self):
-        return self.json['head']['sha']
+        return self.info.head_sha
 
     @property
     def head_branch(self):
-        return self.json['head']['ref']
+        return self.info.head_ref
 
     @property
     def base_branch(self):
-        return self.json['base']['ref']
+        return self.info.base_ref
 
     @property
     def base_sha(self):
-        return self.json['base']['sha']
+        return self.info.base_sha
 
     @property
     def milestone(self):
-        milestone = self.json['milestone']
-        if milestone is None:
-            return ''
-        else:
-            return milestone['title']
+        return self.info.milestone or ''
 
     @property
     def draft(self):
-        return self.json['draft']
+        return self.info.draft
+
+    @property
+    def _modified_files_key(self):
+        return (self.repo, self.number, self.head_sha, self.base_branch)
+
+    def _cached_file_index(self):
+        if 'modified_files' not in self._cache:
+            paths = MODIFIED_FILES_CACHE.get(self._modified_files_key)
+            if paths is None:
+                return None
+            self._cache['modified_files'] = FileIndex(paths)
+        return self._cache['modified_files']
+
+    def get_modified_file_index(self):
+        """
+        Get a `~baldrick.github.file_index.FileIndex` of the files modified by
+        this PR.
+
+        The files are only requested once for each head commit, and only
+        their paths are kept.
+        """
+        index = self._cached_file_index()
+        if index is None:
+            files = paged_github_json_request(self._url_files,
+                                              headers=self._headers, session=self._session)
+            paths = [f['filename'] for f in files]
+            MODIFIED_FILES_CACHE[self._modified_files_key] = paths
+            index = self._cache['modified_files'] = FileIndex(paths)
+        return index
 
     def get_modified_files(self):
         """Get all the filenames of the files modified by this PR."""
-        files = paged_github_json_request(self._url_files,
-                                          headers=self._headers)
-        return [f['filename'] for f in files]
+        return self.get_modified_file_index().tolist()
+
+    def iter_modified_files(self):
+        """
+        Iterate over the filenames of the files modified by this PR.
+
+        Unlike `get_modified_files` the pages of files are only requested as
+        they are needed. Once all the files have been seen they are cached as
+        with `get_modified_file_index`.
+        """
+        index = self._cached_file_index()
+        if index is not None:
+            yield from index
+            return
+        key = self._modified_files_key
+        paths = []
+        for f in iter_github_json(self._url_files, headers=self._headers, session=self._session):
+            paths.append(f['filename'])
+            yield f['filename']
+        MODIFIED_FILES_CACHE[key] = paths
+        self._cache['modified_files'] = FileIndex(paths)
 
     def get_file_contents(self, path_to_file, branch=None):
         """
         Get the contents of a file.
 
-        This will get the file from the head branch of the PR by default.
+        This will get the file from the head commit of the PR by default.
         """
         if not branch:
-            branch = self.head_branch
+            branch = self.head_sha
         return super().get_file_contents(path_to_file, branch=branch)
 
     def get_repo_config(self, branch=None, path_to_file='pyproject.toml'):
@@ -798,15 +1611,12 @@ class PullRequestHandler(IssueHandler):
 
     def has_modified(self, filelist):
         """Check if PR has modified any of the given list of filename(s)."""
-        found = False
-        files = paged_github_json_request(self._url_files,
-                                          headers=self._headers)
-        for d in files:
-            if d['filename'] in filelist:
-                found = True
-                break
-
-        return found
+        if isinstance(filelist, str):
+            filelist = [filelist]
+        index = self._cached_file_index()
+        if index is not None:
+            return any(filename in index for filename in filelist)
+        return any(filename in filelist for filename in self.iter_modified_files())
 
     def submit_review(self, decision, body):
         """
@@ -825,12 +1635,13 @@ class PullRequestHandler(IssueHandler):
         data['body'] = body
         data['event'] = decision.upper()
 
-        response = requests.post(self._url_review_comment, json=data, headers=self._headers)
+        response = self._session.post(self._url_review_comment, json=data, headers=self._headers)
         assert response.ok, response.content
 
     @property
     def last_commit_date(self):
-        commits = paged_github_json_request(self._url_commits, headers=self._headers)
+        commits = paged_github_json_request(self._url_commits, headers=self._headers,
+                                            session=self._session)
         last_time = 0
         for commit in commits:
             date = commit['commit']['committer']['date']
@@ -0,0 +1,893 @@
+"""
+Asyncio versions of the GitHub handlers.
+
+`AsyncGitHubHandler`, `AsyncIssueHandler` and `AsyncPullRequestHandler`
+provide the same methods and properties as the handlers in
+`baldrick.github.github_api`, but make their requests with an asynchronous
+HTTP client so that a single process can have many events in flight and
+independent requests can be made concurrently::
+
+    pr = AsyncPullRequestHandler('astropy/astropy', 6606, installation=36238)
+    labels, files = await asyncio.gather(pr.labels, pr.get_modified_files())
+
+Methods are coroutines, and properties return awaitables, so e.g.
+``pr.head_sha`` becomes ``await pr.head_sha``.
+
+Requests go through the same rate limiter, retry policy and cache of
+conditional (ETag) requests as the synchronous handlers, and use the same
+caches of files, branch heads, repository metadata and configurations. When
+those caches are backed by SQLite (``BALDRICK_CACHE_DB``), the database is
+only read and written in a thread, so the event loop is never blocked.
+
+This module requires `httpx <https://www.python-httpx.org>`_, which can be
+installed with ``pip install baldrick[async]``.
+"""
+import asyncio
+import base64
+import copy
+import weakref
+
+import dateutil.parser
+from loguru import logger
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from baldrick import json_backend
+from baldrick.cache import TieredCache
+from baldrick.github.file_index import FileIndex
+from baldrick.github.github_api import (CHECK_RUN_CACHE, COMMENT_CACHE, FILE_CACHE, HOST, HOST_NONAPI, LABEL_CACHE,
+                                        MODIFIED_FILES_CACHE, PAGINATION_WORKERS, PER_PAGE, REF_CACHE,
+                                        REPO_INFO_CACHE, SHA_PATTERN, TIMELINE_CACHE, _TimelineUpdate,
+                                        _check_parameters, _check_run_params, _checks_from_results,
+                                        _comment_params, _config_value, _copy_comments, _index_comments,
+                                        _merge_pages, _merge_repo_config, _missing_labels, _parse_links,
+                                        _split_url, _update_check_run_index)
+from baldrick.github.github_auth import TOKEN_MANAGER, get_installation_token, token_request_headers
+from baldrick.github.projections import IssueInfo, PullRequestInfo
+from baldrick.github.github_rate_limit import RATE_LIMITER
+from baldrick.github.github_session import (_REFRESHED_HEADERS, CONDITIONAL_REQUESTS, KEEP_ALIVE, POOL_MAXSIZE,
+                                            RESPONSE_CACHE, RETRY_POLICY, TRUST_ENV, _cache_key, _CachedResponse)
+
+__all__ = ['AsyncGitHubClient', 'AsyncGitHubHandler', 'AsyncIssueHandler',
+           'AsyncPullRequestHandler', 'get_async_client', 'close_async_clients',
+           'paged_github_json_request_async', 'iter_github_json_async']
+
+
+class AsyncGitHubClient:
+    """
+    An asynchronous HTTP client for GitHub which respects the rate limits and
+    retries transient failures.
+
+    Parameters
+    ----------
+    installation : `int` or `None`
+        The installation this client makes requests for.
+
+    rate_limiter : `~baldrick.github.github_rate_limit.RateLimiter` or `None`
+        What to schedule requests with. Defaults to
+        `~baldrick.github.github_rate_limit.RATE_LIMITER`.
+
+    retry_policy : `~baldrick.github.github_session.RetryPolicy` or `None`
+        How to retry failed requests. Defaults to
+        `~baldrick.github.github_session.RETRY_POLICY`.
+
+    cache : `baldrick.cache.LRUCache` or `None`
+        Where to keep responses for conditional requests. Defaults to
+        `~baldrick.github.github_session.RESPONSE_CACHE`, which is shared
+        with the synchronous sessions.
+
+    transport : `httpx.AsyncBaseTransport`, optional
+        The transport to make requests with, mostly useful for tests.
+    """
+
+    def __init__(self, installation=None, rate_limiter=None, retry_policy=None, cache=None, transport=None):
+        if httpx is None:
+            raise ImportError("httpx is required for the asyncio handlers")
+        self.installation = installation
+        self.rate_limiter = RATE_LIMITER if rate_limiter is None else rate_limiter
+        self.retry_policy = RETRY_POLICY if retry_policy is None else retry_policy
+        self.cache = RESPONSE_CACHE if cache is None else cache
+        limits = httpx.Limits(max_connections=POOL_MAXSIZE,
+                              max_keepalive_connections=POOL_MAXSIZE if KEEP_ALIVE else 0)
+        self._client = httpx.AsyncClient(limits=limits, trust_env=TRUST_ENV, transport=transport)
+
+    async def request(self, method, url, params=None, headers=None, json=None):
+        """
+        Send a request, waiting for the rate limit and retrying transient
+        failures.
+
+        As with `~baldrick.github.github_session.GitHubSession`, ``GET``
+        requests for which a response is cached are sent as conditional
+        requests, and the cached response is returned if GitHub answers
+        ``304 Not Modified``.
+        """
+        if method.upper() != 'GET' or self.cache.maxsize == 0:
+            return await self._send(method, url, params=params, headers=headers, json=json)
+
+        key = _cache_key(self.installation, url, params,
+                         (headers or {}).get('Accept', self._client.headers.get('Accept')))
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            headers = {**(headers or {}), **cached.validators}
+
+        response = await self._send(method, url, params=params, headers=headers)
+        CONDITIONAL_REQUESTS.record(response, cached is not None)
+
+        if response.status_code == 304 and cached is not None:
+            return _cached_to_response(cached, response)
+
+        if response.status_code == 200 and ('ETag' in response.headers or
+                                            'Last-Modified' in response.headers):
+            self.cache[key] = _CachedResponse(response.status_code, response.headers, response.content,
+                                              encoding=response.encoding, reason=response.reason_phrase)
+        elif cached is not None:
+            self.cache.pop(key)
+
+        return response
+
+    async def _send(self, method, url, params=None, headers=None, json=None):
+        policy = self.retry_policy
+        start = policy._clock()
+        retry = 0
+        while True:
+            response = error = None
+            await self.rate_limiter.wait_async(self.installation, url)
+            try:
+                response = await self._client.request(method, url, params=params,
+                                                      headers=headers, json=json)
+            except httpx.TransportError as exc:
+                error = exc
+            else:
+                self.rate_limiter.update(self.installation, response)
+
+            delay = policy.next_delay(method, retry, policy._clock() - start,
+                                      response=response, error=error,
+                                      connect_errors=(httpx.ConnectError, httpx.ConnectTimeout),
+                                      transport_errors=(httpx.TransportError,))
+            if delay is None:
+                break
+
+            await asyncio.sleep(delay)
+            retry += 1
+
+        if error is not None:
+            raise error
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+# The body of cached responses is already decoded
+_UNCACHED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+def _cached_to_response(cached, not_modified):
+    """
+    Rebuild a cached response after GitHub answered ``304 Not Modified``.
+    """
+    headers = {name: value for name, value in cached.headers.items()
+               if name.lower() not in _UNCACHED_HEADERS}
+    for header in _REFRESHED_HEADERS:
+        if header in not_modified.headers:
+            headers[header] = not_modified.headers[header]
+    return httpx.Response(cached.status_code, headers=headers, content=cached.content,
+                          request=not_modified.request)
+
+
+async def _cache_get(cache, key, default=None):
+    """
+    Get an item from one of the caches shared with the synchronous handlers
+    without blocking the event loop.
+
+    Items in memory are returned directly, the SQLite tier of the cache (if
+    any) is only read in a thread.
+    """
+    if isinstance(cache, TieredCache):
+        value = cache.local.get(key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(cache.get, key, default)
+    return cache.get(key, default)
+
+
+async def _off_loop(cache, func, *args):
+    """
+    Call ``func``, which writes to ``cache``, in a thread if the cache is
+    backed by SQLite.
+    """
+    if isinstance(cache, TieredCache):
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def _cache_set(cache, key, value):
+    await _off_loop(cache, cache.set, key, value)
+
+
+# Clients can only be used from the event loop they were created in.
+_CLIENTS = weakref.WeakKeyDictionary()
+
+
+def get_async_client(installation=None):
+    """
+    Return the shared client for an installation in the running event loop.
+
+    Parameters
+    ----------
+    installation : `int` or `None`
+        The installation the requests will be made on behalf of.
+    """
+    clients = _CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    if installation not in clients:
+        clients[installation] = AsyncGitHubClient(installation)
+    return clients[installation]
+
+
+async def close_async_clients():
+    """
+    Close all the shared clients of the running event loop.
+    """
+    clients = _CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def _check_response(response):
+    assert response.is_success, response.content
+
+
+def _json(response):
+    return json_backend.loads(response.content)
+
+
+async def paged_github_json_request_async(url, headers=None, client=None, params=None,
+                                          max_workers=None):
+    """
+    Get all the pages of a paginated GitHub collection.
+
+    This is the asynchronous version of
+    `~baldrick.github.github_api.paged_github_json_request`.
+    """
+
+    if client is None:
+        client = get_async_client()
+
+    if max_workers is None:
+        max_workers = PAGINATION_WORKERS
+
+    base_url, query = _split_url(url, params)
+    query.setdefault('per_page', PER_PAGE)
+
+    response = await client.get(base_url, params=query, headers=headers)
+    _check_response(response)
+    results = _json(response)
+
+    links = _parse_links(response)
+
+    if 'last' in links:
+
+        last_page = int(_split_url(links['last'])[1].get('page', 1))
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def get_page(page):
+            async with semaphore:
+                response = await client.get(base_url, params={**query, 'page': page}, headers=headers)
+            _check_response(response)
+            return _json(response)
+
+        for page in await asyncio.gather(*(get_page(page) for page in range(2, last_page + 1))):
+            results = _merge_pages(results, page)
+
+    else:
+
+        while 'next' in links:
+            response = await client.get(links['next'], headers=headers)
+            _check_response(response)
+            results = _merge_pages(results, _json(response))
+            links = _parse_links(response)
+
+    return results
+
+
+async def iter_github_json_async(url, headers=None, client=None, params=None, key=None):
+    """
+    Iterate lazily over the items of a paginated GitHub collection.
+
+    This is the asynchronous version of
+    `~baldrick.github.github_api.iter_github_json`, the next page is
+    requested while the items of the current one are consumed.
+    """
+
+    if client is None:
+        client = get_async_client()
+
+    base_url, query = _split_url(url, params)
+    query.setdefault('per_page', PER_PAGE)
+
+    async def get_page(page_url, page_params=None):
+        response = await client.get(page_url, params=page_params, headers=headers)
+        _check_response(response)
+        return _json(response), _parse_links(response)
+
+    next_page = None
+    try:
+        page, links = await get_page(base_url, query)
+        while True:
+            if 'next' in links:
+                next_page = asyncio.ensure_future(get_page(links['next']))
+
+            for item in (page if key is None else page.get(key, [])):
+                yield item
+
+            if next_page is None:
+                return
+            page, links = await next_page
+            next_page = None
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+class AsyncGitHubHandler:
+    """
+    A base class for things that represent things the github app can operate
+    on, using asyncio.
+    """
+
+    def __init__(self, repo, installation=None):
+        self.repo = repo
+        self.installation = installation
+        self._cache = {}
+
+    def invalidate_cache(self):
+        self._cache.clear()
+
+    @property
+    def _client(self):
+        return get_async_client(self.installation)
+
+    async def _get_headers(self):
+        if self.installation is None:
+            return {}
+        token = TOKEN_MANAGER.get_cached_token(self.installation)
+        if token is None:
+            # Requesting a new token blocks, so it is done in a thread
+            token = await asyncio.to_thread(get_installation_token, self.installation)
+        return token_request_headers(token)
+
+    async def _memoize(self, key, load):
+        # Concurrent callers share a single request
+        if key not in self._cache:
+            self._cache[key] = asyncio.ensure_future(load())
+        try:
+            return await self._cache[key]
+        except Exception:
+            self._cache.pop(key, None)
+            raise
+
+    async def _get_repo_info(self):
+        info = await _cache_get(REPO_INFO_CACHE, self.repo)
+        if info is None:
+            response = await self._client.get(f"{HOST}/repos/{self.repo}",
+                                              headers=await self._get_headers())
+            if not response.is_success:
+                raise ValueError(f"Unable to fetch repo information {_json(response)}")
+            info = _json(response)
+            await _cache_set(REPO_INFO_CACHE, self.repo, info)
+        return info
+
+    @property
+    def repo_info(self):
+        """
+        The return of GET /repos/{org}/{repo}
+        """
+        return self._get_repo_info()
+
+    async def _get_default_branch(self):
+        return (await self._get_repo_info())["default_branch"]
+
+    @property
+    def default_branch(self):
+        return self._get_default_branch()
+
+    @property
+    def _url_contents(self):
+        return f'{HOST}/repos/{self.repo}/contents/'
+
+    async def resolve_ref(self, ref):
+        """
+        Get the SHA of the commit a branch, tag or SHA points to.
+        """
+        if SHA_PATTERN.match(ref):
+            return ref
+
+        sha = await _cache_get(REF_CACHE, (self.repo, ref))
+        if sha is None:
+            headers = await self._get_headers()
+            headers['Accept'] = 'application/vnd.github.sha'
+            response = await self._client.get(f'{HOST}/repos/{self.repo}/commits/{ref}', headers=headers)
+            if response.status_code in (404, 422):
+                raise FileNotFoundError(f'{self.repo}@{ref}')
+            _check_response(response)
+            sha = response.text.strip()
+            await _cache_set(REF_CACHE, (self.repo, ref), sha)
+        return sha
+
+    async def get_file_contents(self, path_to_file, branch=None):
+        """
+        Get the contents of a file.
+        """
+        if branch is None:
+            branch = await self.default_branch
+
+        sha = await self.resolve_ref(branch)
+        cache_key = (self.repo, path_to_file, sha)
+
+        # Missing files are cached as None
+        contents = await _cache_get(FILE_CACHE, cache_key, FileNotFoundError)
+        if contents is FileNotFoundError:
+            url_file = self._url_contents + path_to_file
+            response = await self._client.get(url_file, params={'ref': sha},
+                                              headers=await self._get_headers())
+            if not response.is_success and _json(response)['message'] == 'Not Found':
+                contents = None
+            else:
+                _check_response(response)
+                contents = base64.b64decode(_json(response)['content']).decode()
+            await _cache_set(FILE_CACHE, cache_key, contents)
+
+        if contents is None:
+            raise FileNotFoundError(self._url_contents + path_to_file)
+
+        return contents
+
+    async def get_repo_config(self, branch=None, path_to_file='pyproject.toml'):
+        """
+        Load configuration from the repository.
+        """
+        branch = branch or await self.default_branch
+
+        try:
+            file_content = await self.get_file_contents(path_to_file, branch=branch)
+        except FileNotFoundError:
+            logger.debug(f"No config file found in {self.repo}@{branch}.")
+            file_content = None
+
+        return _merge_repo_config(self.repo, branch, file_content)
+
+    async def get_config_value(self, cfg_key, cfg_default=None, branch=None):
+        """
+        Convenience method to extract user configuration values.
+        """
+        cfg = await self.get_repo_config(branch=branch)
+        return _config_value(cfg, cfg_key, cfg_default)
+
+    async def set_status(self, state, description, context, commit_hash, target_url=None):
+        """
+        Set status message on a commit on GitHub.
+        """
+        data = {'state': state, 'description': description, 'context': context}
+
+        if target_url is not None:
+            data['target_url'] = target_url
+
+        url = f'{HOST}/repos/{self.repo}/statuses/{commit_hash}'
+        response = await self._client.post(url, json=data, headers=await self._get_headers())
+        _check_response(response)
+
+    async def list_statuses(self, commit_hash):
+        """
+        List status messages on a commit on GitHub.
+        """
+        url = f'{HOST}/repos/{self.repo}/commits/{commit_hash}/statuses'
+        results = await paged_github_json_request_async(url, headers=await self._get_headers(),
+                                                        client=self._client)
+
+        return {result['context']: {'state': result['state'],
+                                    'description': result['description'],
+                                    'target_url': result.get('target_url')}
+                for result in results}
+
+    async def list_checks(self, commit_hash, only_ours=True, use_cache=True):
+        """
+        List check messages on a commit on GitHub.
+        """
+        if only_ours and use_cache:
+            checks = await _cache_get(CHECK_RUN_CACHE, (self.repo, commit_hash))
+            if checks is not None:
+                return copy.deepcopy(checks)
+
+        url = f'{HOST}/repos/{self.repo}/commits/{commit_hash}/check-runs'
+        headers = await self._get_headers()
+        headers['Accept'] = 'application/vnd.github.antiope-preview+json'
+        results = await paged_github_json_request_async(url, headers=headers, client=self._client,
+                                                        params=_check_run_params(only_ours))
+        checks = _checks_from_results(results, only_ours)
+
+        if only_ours:
+            await _cache_set(CHECK_RUN_CACHE, (self.repo, commit_hash), copy.deepcopy(checks))
+
+        return checks
+
+
+class AsyncIssueHandler(AsyncGitHubHandler):
+
+    def __init__(self, repo, number, installation=None):
+        self.number = number
+        super().__init__(repo, installation=installation)
+
+    @property
+    def _url_issue(self):
+        return f'{HOST}/repos/{self.repo}/issues/{self.number}'
+
+    @property
+    def _url_issue_nonapi(self):
+        return f'{HOST_NONAPI}/{self.repo}/issues/{self.number}'
+
+    @property
+    def _url_labels(self):
+        return f'{self._url_issue}/labels'
+
+    @property
+    def _url_issue_comment(self):
+        return f'{self._url_issue}/comments'
+
+    @property
+    def _url_timeline(self):
+        return f'{self._url_issue}/timeline'
+
+    async def _get_json(self):
+        response = await self._client.get(self._url_issue, headers=await self._get_headers())
+        _check_response(response)
+        return _json(response)
+
+    _info_class = IssueInfo
+
+    @property
+    def json(self):
+        """
+        The JSON returned by GitHub, only requested once.
+        """
+        return self._memoize('json', self._get_json)
+
+    async def _load_info(self):
+        json = await self._cache['json'] if 'json' in self._cache else await self._get_json()
+        return self._info_class.from_json(json)
+
+    @property
+    def info(self):
+        """
+        The fields of the JSON used by baldrick, only requested once.
+        """
+        return self._memoize('info', self._load_info)
+
+    async def _get_info_field(self, name):
+        return getattr(await self.info, name)
+
+    async def _read_timeline(self, update):
+        headers = {**await self._get_headers(), 'Accept': 'application/vnd.github.mockingbird-preview'}
+        async for d in iter_github_json_async(self._url_timeline, headers=headers, client=self._client,
+                                              params=update.params):
+            update.add(d)
+        return update.complete()
+
+    async def _get_timeline(self):
+        key = (self.repo, self.number)
+        update = _TimelineUpdate(await _cache_get(TIMELINE_CACHE, key))
+        if not await self._read_timeline(update):
+            update = _TimelineUpdate()
+            await self._read_timeline(update)
+        await _cache_set(TIMELINE_CACHE, key, update.timeline)
+        return update.timeline
+
+    async def get_label_added_date(self, label):
+        """
+        Get last added date for a label.
+        """
+        timeline = await self._memoize('timeline', self._get_timeline)
+        last_labeled = timeline['labels'].get(label)
+
+        if last_labeled is not None:
+            return dateutil.parser.parse(last_labeled).timestamp()
+
+    async def submit_comment(self, body, comment_id=None, return_url=False):
+        """
+        Submit a comment to the pull request
+        """
+        if comment_id is None:
+            url = self._url_issue_comment
+        else:
+            url = f'{HOST}/repos/{self.repo}/issues/comments/{comment_id}'
+
+        response = await self._client.post(url, json={'body': body}, headers=await self._get_headers())
+        _check_response(response)
+
+        if 'comments' in self._cache:
+            store = await self._memoize('comments', self._load_comments)
+            _index_comments(store, [_json(response)], update_since=False)
+            await _cache_set(COMMENT_CACHE, (self.repo, self.number), _copy_comments(store))
+
+        if return_url:
+            comment_id = _json(response)['url'].split('/')[-1]
+            return f'{self._url_issue_nonapi}#issuecomment-{comment_id}'
+
+    async def _load_comments(self):
+        key = (self.repo, self.number)
+        store = _copy_comments(await _cache_get(COMMENT_CACHE, key))
+        comments = [comment async for comment in iter_github_json_async(self._url_issue_comment,
+                                                                        headers=await self._get_headers(),
+                                                                        client=self._client,
+                                                                        params=_comment_params(store))]
+        _index_comments(store, comments)
+        await _cache_set(COMMENT_CACHE, key, store)
+        return store
+
+    async def _find_comments(self, login, filter_keep=None):
+        store = await self._memoize('comments', self._load_comments)
+        comments = store['logins'].get(login, {}).values()
+        return [comment for comment in comments if filter_keep is None or filter_keep(comment['body'])]
+
+    async def find_comments(self, login, filter_keep=None):
+        """
+        Find comments by a given user.
+        """
+        return [comment['id'] for comment in await self._find_comments(login, filter_keep=filter_keep)]
+
+    async def last_comment_date(self, login, filter_keep=None):
+        """
+        Find the last date on which a comment was made.
+        """
+        dates = [comment['created_at'] for comment in await self._find_comments(login, filter_keep=filter_keep)]
+        if len(dates) > 0:
+            return dateutil.parser.parse(max(dates)).timestamp()
+
+    async def _get_labels(self):
+        if 'labels' not in self._cache:
+            response = await self._client.get(self._url_labels, headers=await self._get_headers())
+            _check_response(response)
+            self._cache['labels'] = [label['name'] for label in _json(response)]
+        return list(self._cache['labels'])
+
+    @property
+    def labels(self):
+        """Get labels for this issue"""
+        return self._get_labels()
+
+    async def _get_repo_labels(self):
+        labels = await _cache_get(LABEL_CACHE, self.repo)
+        if labels is None:
+            url = f'{HOST}/repos/{self.repo}/labels'
+            result = await paged_github_json_request_async(url, headers=await self._get_headers(),
+                                                           client=self._client)
+            labels = [label['name'] for label in result]
+            await _cache_set(LABEL_CACHE, self.repo, labels)
+        return set(labels)
+
+    async def set_labels(self, labels):
+        """Set label(s) to issue"""
+        if not isinstance(labels, list):
+            labels = [labels]
+
+        issue_labels = await self.labels
+        if set(labels).issubset(issue_labels):
+            return
+
+        missing_labels = _missing_labels(labels, issue_labels, await self._get_repo_labels())
+        if len(missing_labels) == 0:
+            return
+
+        response = await self._client.post(self._url_labels, headers=await self._get_headers(),
+                                           json=sorted(missing_labels))
+        _check_response(response)
+        self._cache['labels'] = [label['name'] for label in _json(response)]
+
+    async def close(self):
+        response = await self._client.patch(self._url_issue, json={'state': 'closed'},
+                                            headers=await self._get_headers())
+        _check_response(response)
+
+    async def _get_is_closed(self):
+        return await self._get_info_field('state') == 'closed'
+
+    @property
+    def is_closed(self):
+        """Is the issue closed?"""
+        return self._get_is_closed()
+
+
+class AsyncPullRequestHandler(AsyncIssueHandler):
+
+    _info_class = PullRequestInfo
+
+    @property
+    def _url_pull_request(self):
+        return f'{HOST}/repos/{self.repo}/pulls/{self.number}'
+
+    @property
+    def _url_review_comment(self):
+        return f'{self._url_pull_request}/reviews'
+
+    @property
+    def _url_commits(self):
+        return f'{self._url_pull_request}/commits'
+
+    @property
+    def _url_files(self):
+        return f'{self._url_pull_request}/files'
+
+    async def _get_json(self):
+        response = await self._client.get(self._url_pull_request, headers=await self._get_headers())
+        _check_response(response)
+        return _json(response)
+
+    async def _resolve_commit(self, commit_hash):
+        if commit_hash == "head":
+            return await self.head_sha
+        elif commit_hash == "base":
+            return await self.base_sha
+        return commit_hash
+
+    async def set_check(self, external_id, title, name=None, summary=None, text=None,
+                        commit_hash='head', details_url=None, status=None,
+                        conclusion='neutral', check_id=None, completed_at=None):
+        """
+        Set check status, see
+        `baldrick.github.github_api.PullRequestHandler.set_check`.
+        """
+        url = f'{HOST}/repos/{self.repo}/check-runs'
+        headers = await self._get_headers()
+        headers['Accept'] = 'application/vnd.github.antiope-preview+json'
+
+        commit_hash = await self._resolve_commit(commit_hash)
+        parameters = _check_parameters(external_id, title, name, summary, text, commit_hash,
+                                       details_url, status, conclusion, completed_at)
+
+        logger.trace(f"Sending GitHub check with {parameters}")
+
+        if not check_id:
+            response = await self._client.post(url, headers=headers, json=parameters)
+        else:
+            response = await self._client.patch(url + f'/{check_id}', headers=headers, json=parameters)
+        _check_response(response)
+
+        await _off_loop(CHECK_RUN_CACHE, _update_check_run_index, self.repo, _json(response))
+
+    async def set_status(self, state, description, context, commit_hash="head", target_url=None):
+        commit_hash = await self._resolve_commit(commit_hash)
+        await super().set_status(state, description, context, commit_hash, target_url)
+
+    async def list_statuses(self, commit_hash="head"):
+        return await super().list_statuses(await self._resolve_commit(commit_hash))
+
+    async def list_checks(self, commit_hash="head", only_ours=True, use_cache=True):
+        return await super().list_checks(await self._resolve_commit(commit_hash), only_ours=only_ours,
+                                         use_cache=use_cache)
+
+    @property
+    def user(self):
+        return self._get_info_field('user')
+
+    @property
+    def head_repo_name(self):
+        return self._get_info_field('head_repo')
+
+    @property
+    def head_sha(self):
+        return self._get_info_field('head_sha')
+
+    @property
+    def head_branch(self):
+        return self._get_info_field('head_ref')
+
+    @property
+    def base_branch(self):
+        return self._get_info_field('base_ref')
+
+    @property
+    def base_sha(self):
+        return self._get_info_field('base_sha')
+
+    async def _get_milestone(self):
+        return await self._get_info_field('milestone') or ''
+
+    @property
+    def milestone(self):
+        return self._get_milestone()
+
+    @property
+    def draft(self):
+        return self._get_info_field('draft')
+
+    async def _modified_files_key(self):
+        head_sha, base_branch = await asyncio.gather(self.head_sha, self.base_branch)
+        return (self.repo, self.number, head_sha, base_branch)
+
+    async def _load_file_index(self):
+        key = await self._modified_files_key()
+        paths = await _cache_get(MODIFIED_FILES_CACHE, key)
+        if paths is None:
+            files = await paged_github_json_request_async(self._url_files, headers=await self._get_headers(),
+                                                          client=self._client)
+            paths = [f['filename'] for f in files]
+            await _cache_set(MODIFIED_FILES_CACHE, key, paths)
+        return FileIndex(paths)
+
+    async def get_modified_file_index(self):
+        """
+        Get a `~baldrick.github.file_index.FileIndex` of the files modified by
+        this PR.
+        """
+        return await self._memoize('modified_files', self._load_file_index)
+
+    async def get_modified_files(self):
+        """Get all the filenames of the files modified by this PR."""
+        return (await self.get_modified_file_index()).tolist()
+
+    async def iter_modified_files(self):
+        """
+        Iterate over the filenames of the files modified by this PR.
+        """
+        for filename in await self.get_modified_file_index():
+            yield filename
+
+    async def has_modified(self, filelist):
+        """Check if PR has modified any of the given list of filename(s)."""
+        if isinstance(filelist, str):
+            filelist = [filelist]
+        index = await self.get_modified_file_index()
+        return any(filename in index for filename in filelist)
+
+    async def get_file_contents(self, path_to_file, branch=None):
+        """
+        Get the contents of a file, from the head commit of the PR by default.
+        """
+        if not branch:
+            branch = await self.head_sha
+        return await super().get_file_contents(path_to_file, branch=branch)
+
+    async def get_repo_config(self, branch=None, path_to_file='pyproject.toml'):
+        """
+        Load configuration from the repository, from the base branch of the
+        PR by default.
+        """
+        if not branch:
+            branch = await self.base_branch
+        return await super().get_repo_config(branch=branch, path_to_file=path_to_file)
+
+    async def submit_review(self, decision, body):
+        """
+        Submit a review comment to the pull request
+        """
+        data = {'commit_id': await self.head_sha, 'body': body, 'event': decision.upper()}
+        response = await self._client.post(self._url_review_comment, json=data,
+                                           headers=await self._get_headers())
+        _check_response(response)
+
+    async def _get_last_commit_date(self):
+        commits = await paged_github_json_request_async(self._url_commits, headers=await self._get_headers(),
+                                                        client=self._client)
+        last_time = 0
+        for commit in commits:
+            date = commit['commit']['committer']['date']
+            last_time = max(dateutil.parser.parse(date).timestamp(), last_time)
+        if last_time == 0:
+            raise Exception(f'No commit found in {self._url_commits}')
+        return last_time
+
+    @property
+    def last_commit_date(self):
+        return self._get_last_commit_date()
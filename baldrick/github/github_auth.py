@@ -1,22 +1,82 @@
+"""
+Authentication as the GitHub app and as its installations.
+
+Installation tokens are kept by `TOKEN_MANAGER`, which can be shared by all
+the threads of a process:
+
+* Tokens are renewed in a background thread once they have less than
+  ``BALDRICK_TOKEN_REFRESH_MARGIN`` seconds (default 300) left, so that
+  requests don't have to wait for a new token. A token which has less than a
+  minute left is renewed before being returned. If a background renewal
+  fails, the next one is only attempted ``BALDRICK_TOKEN_REFRESH_RETRY``
+  seconds (default 60) later.
+* Concurrent requests for the token of an installation which needs to be
+  renewed share a single request to GitHub.
+* Tokens of installations which have not been used for
+  ``BALDRICK_TOKEN_IDLE_TIMEOUT`` seconds (default 3600) are forgotten.
+* If ``BALDRICK_TOKEN_STORE`` is set, tokens are shared with the other
+  processes on the machine through a `~baldrick.github.token_store.FileTokenStore`.
+
+The installation of each repository is found with a single request and kept
+in `REPO_INSTALLATION_CACHE`, and the mapping from all repositories to their
+installations is kept in `INSTALLATION_CACHE`, for
+``BALDRICK_INSTALLATION_CACHE_TTL`` seconds (default 3600). Both are kept up to
+date by ``installation`` and ``installation_repositories`` webhook events.
+Repositories the app is not installed on are remembered in
+`MISSING_INSTALLATION_CACHE` for ``BALDRICK_INSTALLATION_MISS_TTL`` seconds
+(default 60).
+"""
 import os
-import netrc
+import contextvars
 import datetime
-from collections import defaultdict
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import dateutil.parser
 from loguru import logger
 
 import jwt
 
-import requests
+from baldrick.cache import make_cache
+from baldrick.github.github_session import get_session
+from baldrick.github.token_store import make_token_store
+
+__all__ = ['TokenManager', 'TOKEN_MANAGER', 'INSTALLATION_CACHE', 'REPO_INSTALLATION_CACHE',
+           'MISSING_INSTALLATION_CACHE',
+           'get_json_web_token', 'get_installation_token', 'github_request_headers', 'token_request_headers',
+           'repo_to_installation_id_mapping', 'get_installation_id', 'repo_to_installation_id',
+           'update_installations_from_webhook', 'get_app_name']
 
 TEN_MIN = datetime.timedelta(minutes=9)
 ONE_MIN = datetime.timedelta(minutes=1)
 
-# TODO: need to change global variable to use redis
+TOKEN_REFRESH_MARGIN = float(os.environ.get('BALDRICK_TOKEN_REFRESH_MARGIN', 300))
+TOKEN_IDLE_TIMEOUT = float(os.environ.get('BALDRICK_TOKEN_IDLE_TIMEOUT', 3600))
+TOKEN_REFRESH_RETRY = float(os.environ.get('BALDRICK_TOKEN_REFRESH_RETRY', 60))
+
+# The mapping from repository names to installation IDs, under a single key.
+# Listing it costs one request per installation, so it is only requested
+# again when it expires or when an installation event could not be applied.
+INSTALLATION_CACHE = make_cache('installations', maxsize=1,
+                                ttl=float(os.environ.get('BALDRICK_INSTALLATION_CACHE_TTL', 3600)))
+
+# The installation IDs of single repositories, found with
+# ``GET /repos/{repo}/installation``.
+REPO_INSTALLATION_CACHE = make_cache('repo_installations',
+                                     maxsize=int(os.environ.get('BALDRICK_INSTALLATION_CACHE_SIZE', 1024)),
+                                     ttl=float(os.environ.get('BALDRICK_INSTALLATION_CACHE_TTL', 3600)))
+
+# Repositories the app is not installed on, so that webhooks for them (e.g.
+# from CircleCI) don't each need a request. These are only kept for a short
+# time since the app may be installed at any time.
+MISSING_INSTALLATION_CACHE = make_cache('missing_installations',
+                                        maxsize=int(os.environ.get('BALDRICK_INSTALLATION_CACHE_SIZE', 1024)),
+                                        ttl=float(os.environ.get('BALDRICK_INSTALLATION_MISS_TTL', 60)))
 
 json_web_token = None
 json_web_token_expiry = None
+_json_web_token_lock = threading.Lock()
 
 
 def get_json_web_token():
@@ -27,86 +87,311 @@ def get_json_web_token():
     global json_web_token
     global json_web_token_expiry
 
-    now = datetime.datetime.now()
-
-    # Include a one-minute buffer otherwise token might expire by the time we
-    # make the request with the token.
-    if json_web_token is None or json_web_token_expiry is None or now + ONE_MIN > json_web_token_expiry:
+    with _json_web_token_lock:
 
-        json_web_token_expiry = now + TEN_MIN
+        now = datetime.datetime.now()
 
-        payload = {}
+        # Include a one-minute buffer otherwise token might expire by the time we
+        # make the request with the token.
+        if json_web_token is None or json_web_token_expiry is None or now + ONE_MIN > json_web_token_expiry:
 
-        # Issued at time
-        payload['iat'] = int(now.timestamp())
+            json_web_token_expiry = now + TEN_MIN
 
-        # JWT expiration time (10 minute maximum)
-        payload['exp'] = int(json_web_token_expiry.timestamp())
+            payload = {}
 
-        # Integration's GitHub identifier
-        payload['iss'] = os.environ['GITHUB_APP_INTEGRATION_ID']
+            # Issued at time
+            payload['iat'] = int(now.timestamp())
 
-        json_web_token = jwt.encode(payload,
-                                    os.environ['GITHUB_APP_PRIVATE_KEY'],
-                                    algorithm='RS256')
+            # JWT expiration time (10 minute maximum)
+            payload['exp'] = int(json_web_token_expiry.timestamp())
 
-    return json_web_token
+            # Integration's GitHub identifier
+            payload['iss'] = os.environ['GITHUB_APP_INTEGRATION_ID']
 
+            json_web_token = jwt.encode(payload,
+                                        os.environ['GITHUB_APP_PRIVATE_KEY'],
+                                        algorithm='RS256')
 
-installation_token = defaultdict(lambda: None)
-installation_token_expiry = defaultdict(lambda: None)
+        return json_web_token
 
 
-def netrc_exists():
-    try:
-        my_netrc = netrc.netrc()
-    except FileNotFoundError:
-        return False
-    else:
-        return my_netrc.authenticators('api.github.com') is not None
+def request_installation_token(installation):
+    """
+    Request a new access token for an installation.
 
+    Returns
+    -------
+    token : `str`
+        The token.
 
-def get_installation_token(installation):
+    expires_at : `float`
+        When the token expires, as a Unix timestamp.
     """
-    Get access token for installation
+
+    headers = {}
+    headers['Authorization'] = 'Bearer {0}'.format(get_json_web_token())
+    headers['Accept'] = 'application/vnd.github+json'
+    headers['X-GitHub-Api-Version'] = "2022-11-28"
+
+    url = 'https://api.github.com/app/installations/{0}/access_tokens'.format(installation)
+
+    req = get_session().post(url, headers=headers)
+    resp = req.json()
+
+    if not req.ok:
+        if 'message' in resp:
+            raise Exception(f"{req.status_code} {resp['message']}")
+        else:
+            raise Exception("An error occurred when requesting token")
+
+    return resp['token'], dateutil.parser.parse(resp['expires_at']).timestamp()
+
+
+class _Token:
+
+    __slots__ = ('token', 'expires_at', 'issued_at', 'last_used')
+
+    def __init__(self, token, expires_at, issued_at):
+        self.token = token
+        self.expires_at = expires_at
+        self.issued_at = issued_at
+        self.last_used = issued_at
+
+
+class TokenManager:
     """
+    Keep the access tokens of installations and renew them ahead of expiry.
 
-    now = datetime.datetime.now().timestamp()
+    This is safe to use from several threads.
 
-    if installation_token_expiry[installation] is None or now + 60 > installation_token_expiry[installation]:
+    Parameters
+    ----------
+    refresh_margin : `float`
+        Tokens which expire in less than this number of seconds are renewed
+        in the background.
 
-        # FIXME: if .netrc file is present, Authorization header will get
-        # overwritten, so need to figure out how to ignore that file.
-        if netrc_exists():
-            raise Exception("Authentication does not work properly if a ~/.netrc "
-                            "file exists. Rename that file temporarily and try again.")
+    min_validity : `float`
+        Tokens which expire in less than this number of seconds are renewed
+        before being returned.
 
-        headers = {}
-        headers['Authorization'] = 'Bearer {0}'.format(get_json_web_token())
-        headers['Accept'] = 'application/vnd.github+json'
-        headers['X-GitHub-Api-Version'] = "2022-11-28"
+    idle_timeout : `float`
+        The tokens of installations which have not been used for this number
+        of seconds are forgotten.
 
-        url = 'https://api.github.com/app/installations/{0}/access_tokens'.format(installation)
+    retry_interval : `float`
+        After a token could not be renewed, no new background refresh is
+        started for this number of seconds.
 
-        req = requests.post(url, headers=headers)
-        resp = req.json()
+    request_token : callable, optional
+        The function used to request a token, which is given the installation
+        and returns the token and its expiry time. Defaults to
+        `request_installation_token`.
+
+    store : `~baldrick.github.token_store.TokenStore`, optional
+        A store shared with other processes. Before requesting a token, the
+        manager locks the installation in the store and uses the token in the
+        store if it was renewed by another process.
+    """
 
-        if not req.ok:
-            if 'message' in resp:
-                raise Exception(f"{req.status_code} {resp['message']}")
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN, min_validity=60,
+                 idle_timeout=TOKEN_IDLE_TIMEOUT, retry_interval=TOKEN_REFRESH_RETRY,
+                 request_token=None, store=None):
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+        self._request_token = request_token
+        self.store = store
+        self._tokens = {}
+        self._pending = {}
+        # The time of the last failed refresh of each installation
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.failures = 0
+        self.evictions = 0
+        self.store_hits = 0
+        self.refresh_time = 0.
+        self.last_refresh_time = None
+
+    # These are attributes so that tests can replace them
+    _clock = staticmethod(time.time)
+
+    @staticmethod
+    def _start_thread(target):
+        threading.Thread(target=target, name='baldrick-token-refresh', daemon=True).start()
+
+    def _valid_token(self, installation, now):
+        # Must be called with the lock held. Returns the token if it can be
+        # used, starting a background refresh if it expires soon.
+        entry = self._tokens.get(installation)
+        if entry is None or entry.expires_at - now <= self.min_validity:
+            return None
+        entry.last_used = now
+        failed = self._failed.get(installation)
+        if (entry.expires_at - now < self.refresh_margin and
+                (failed is None or now - failed >= self.retry_interval)):
+            future, leader = self._pending_refresh(installation)
+            if leader:
+                self._start_thread(lambda: self._refresh(installation, future, background=True))
+        return entry.token
+
+    def get_cached_token(self, installation):
+        """
+        Return the access token for an installation if a valid one is known,
+        or `None` if a new token has to be requested.
+
+        This never waits for a request to GitHub, so it can be called from an
+        event loop.
+        """
+        with self._lock:
+            return self._valid_token(installation, self._clock())
+
+    def get_token(self, installation):
+        """
+        Return a valid access token for an installation.
+        """
+        now = self._clock()
+
+        with self._lock:
+            token = self._valid_token(installation, now)
+            if token is not None:
+                return token
+            future, leader = self._pending_refresh(installation)
+
+        if leader:
+            self._refresh(installation, future)
+
+        return future.result()
+
+    def _pending_refresh(self, installation):
+        # Must be called with the lock held. Returns the future for the new
+        # token, which is shared by all the callers until the request
+        # completes, and whether the caller should make the request.
+        future = self._pending.get(installation)
+        if future is not None:
+            return future, False
+        future = self._pending[installation] = Future()
+        return future, True
+
+    def _request(self, installation):
+        # Returns the token, its expiry time, and whether it was taken from
+        # the store rather than requested.
+
+        request_token = self._request_token or request_installation_token
+
+        if self.store is None:
+            token, expires_at = request_token(installation)
+            return token, expires_at, False
+
+        with self.store.lock(installation):
+            stored = self.store.get(installation)
+            if stored is not None and stored[1] - self._clock() > self.refresh_margin:
+                return stored[0], stored[1], True
+            token, expires_at = request_token(installation)
+            self.store.set(installation, token, expires_at)
+            return token, expires_at, False
+
+    def _refresh(self, installation, future, background=False):
+
+        start = self._clock()
+        try:
+            token, expires_at, from_store = self._request(installation)
+        except Exception as exc:
+            with self._lock:
+                self.failures += 1
+                self._failed[installation] = self._clock()
+                del self._pending[installation]
+            if background:
+                logger.warning(f"Could not renew the token of installation {installation}: {exc}")
+            future.set_exception(exc)
+            return
+        end = self._clock()
+
+        with self._lock:
+            self._tokens[installation] = _Token(token, expires_at, end)
+            self._failed.pop(installation, None)
+            if from_store:
+                self.store_hits += 1
             else:
-                raise Exception("An error occurred when requesting token")
+                self.refreshes += 1
+                self.background_refreshes += background
+                self.refresh_time += end - start
+                self.last_refresh_time = end - start
+            del self._pending[installation]
+            self._evict(end)
+
+        future.set_result(token)
+
+    def _evict(self, now):
+        # Must be called with the lock held
+        for installation, entry in list(self._tokens.items()):
+            if now - entry.last_used > self.idle_timeout or entry.expires_at < now:
+                del self._tokens[installation]
+                self.evictions += 1
+
+    def invalidate(self, installation):
+        """
+        Forget the token of an installation, e.g. after it was revoked.
+        """
+        with self._lock:
+            self._tokens.pop(installation, None)
+        if self.store is not None:
+            self.store.delete(installation)
+
+    def clear(self):
+        """
+        Forget all the tokens and reset the counters.
+        """
+        with self._lock:
+            self._tokens.clear()
+            self._failed.clear()
+            self.refreshes = self.background_refreshes = self.failures = self.evictions = 0
+            self.store_hits = 0
+            self.refresh_time = 0.
+            self.last_refresh_time = None
+
+    def stats(self):
+        """
+        Return the age and remaining lifetime of each token, and how long it
+        took to request them.
+        """
+        now = self._clock()
+        with self._lock:
+            return {'refreshes': self.refreshes,
+                    'background_refreshes': self.background_refreshes,
+                    'failures': self.failures,
+                    'evictions': self.evictions,
+                    'store_hits': self.store_hits,
+                    'last_refresh_time': self.last_refresh_time,
+                    'mean_refresh_time': self.refresh_time / self.refreshes if self.refreshes else None,
+                    'tokens': {installation: {'age': now - entry.issued_at,
+                                              'expires_in': entry.expires_at - now,
+                                              'idle': now - entry.last_used}
+                               for installation, entry in self._tokens.items()}}
+
+
+TOKEN_MANAGER = TokenManager(store=make_token_store())
 
-        installation_token[installation] = resp['token']
-        installation_token_expiry[installation] = dateutil.parser.parse(resp['expires_at']).timestamp()
 
-    return installation_token[installation]
+def get_installation_token(installation):
+    """
+    Get access token for installation
+    """
+    return TOKEN_MANAGER.get_token(installation)
 
 
 def github_request_headers(installation):
 
-    token = get_installation_token(installation)
+    return token_request_headers(get_installation_token(installation))
 
+
+def token_request_headers(token):
+    """
+    Return the headers for a request authenticated with an installation
+    token.
+    """
     headers = {}
     headers['Authorization'] = 'token {0}'.format(token)
     headers['Accept'] = 'application/vnd.github.machine-man-preview+json'
@@ -114,43 +399,175 @@ def github_request_headers(installation):
     return headers
 
 
-def repo_to_installation_id_mapping():
-    """
-    Returns a dictionary mapping full repository name to installation id.
-    """
-    url = 'https://api.github.com/app/installations'
+def _app_request_headers():
     headers = {}
     headers['Authorization'] = 'Bearer {0}'.format(get_json_web_token())
     headers['Accept'] = 'application/vnd.github+json'
     headers['X-GitHub-Api-Version'] = "2022-11-28"
-    resp = requests.get(url, headers=headers)
-    payload = resp.json()
+    return headers
+
+
+def _installation_repositories(installation):
+    # Avoid a circular import, github_api uses the tokens from this module
+    from baldrick.github.github_api import paged_github_json_request
+    payload = paged_github_json_request('https://api.github.com/installation/repositories',
+                                        headers=github_request_headers(installation),
+                                        session=get_session(installation))
+    return [repo['full_name'] for repo in payload['repositories']]
+
+
+def repo_to_installation_id_mapping(use_cache=True, max_workers=None):
+    """
+    Returns a dictionary mapping full repository name to installation id.
+
+    This requests all the installations of the app, then the repositories of
+    each installation, several installations at a time. To find the
+    installation of a single repository, use `get_installation_id` instead.
+
+    Parameters
+    ----------
+    use_cache : `bool`
+        If `False`, the mapping is requested from GitHub even if it is in
+        `INSTALLATION_CACHE`.
+
+    max_workers : `int`, optional
+        The maximum number of installations to request at the same time.
+        Defaults to ``BALDRICK_PAGINATION_WORKERS`` or 4.
+    """
+    from baldrick.github.github_api import PAGINATION_WORKERS, paged_github_json_request
+
+    if use_cache:
+        repos = INSTALLATION_CACHE.get('mapping')
+        if repos is not None:
+            return dict(repos)
 
-    if resp.status_code != 200:
-        raise ValueError(f"{resp.status_code} {payload} in response from GitHub while getting installations")
+    installations = paged_github_json_request('https://api.github.com/app/installations',
+                                              headers=_app_request_headers())
+    ids = [installation['id'] for installation in installations]
 
-    ids = [p['id'] for p in payload]
+    # Run the requests in the context of the caller, so that e.g. the
+    # priority of the requests is kept.
+    context = contextvars.copy_context()
 
     repos = {}
-    for iid in ids:
-        headers = github_request_headers(iid)
-        resp = requests.get('https://api.github.com/installation/repositories', headers=headers)
-        payload = resp.json()
-        for repo in payload['repositories']:
-            repos[repo['full_name']] = iid
+    if ids:
+        workers = max(1, min(max_workers or PAGINATION_WORKERS, len(ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda iid: context.copy().run(_installation_repositories, iid), ids)
+            for iid, names in zip(ids, results):
+                for name in names:
+                    repos[name] = iid
 
-    return repos
+    INSTALLATION_CACHE['mapping'] = repos
+    for name, iid in repos.items():
+        REPO_INSTALLATION_CACHE[name] = iid
+
+    return dict(repos)
+
+
+def get_installation_id(repository):
+    """
+    Return the installation ID for a repository, or `None` if the app is not
+    installed on it.
+
+    The installation is found with a single request to GitHub, unless it is
+    already known from an earlier lookup, the cached mapping of all
+    repositories or an installation event. Repositories the app is not
+    installed on are only looked up again after
+    ``BALDRICK_INSTALLATION_MISS_TTL`` seconds.
+    """
+    iid = REPO_INSTALLATION_CACHE.get(repository)
+    if iid is not None:
+        return iid
+
+    repos = INSTALLATION_CACHE.get('mapping')
+    if repos is not None and repository in repos:
+        return repos[repository]
+
+    if repository in MISSING_INSTALLATION_CACHE:
+        return None
+
+    response = get_session().get(f'https://api.github.com/repos/{repository}/installation',
+                                 headers=_app_request_headers())
+    if response.status_code == 404:
+        MISSING_INSTALLATION_CACHE[repository] = True
+        return None
+    assert response.ok, response.content
+
+    iid = response.json()['id']
+    REPO_INSTALLATION_CACHE[repository] = iid
+    return iid
 
 
 def repo_to_installation_id(repository):
     """
     Return the installation ID for a repository.
     """
-    mapping = repo_to_installation_id_mapping()
-    if repository in mapping:
-        return mapping[repository]
+    iid = get_installation_id(repository)
+    if iid is not None:
+        return iid
+    # Listing the repositories of every installation is expensive, so they
+    # are only given in the error if the mapping is already known.
+    mapping = INSTALLATION_CACHE.get('mapping')
+    if mapping is None:
+        raise ValueError(f"Repository not recognized - the app is not installed on {repository}")
+    raise ValueError("Repository not recognized - should be one of:\n\n  - " + "\n  - ".join(mapping))
+
+
+def update_installations_from_webhook(event, payload):
+    """
+    Update the cached mapping of repositories to installations following an
+    ``installation`` or ``installation_repositories`` webhook event.
+    """
+
+    if event not in ('installation', 'installation_repositories') or 'installation' not in payload:
+        return
+
+    installation = payload['installation']['id']
+    action = payload.get('action')
+
+    if event == 'installation' and action in ('deleted', 'suspend'):
+        TOKEN_MANAGER.invalidate(installation)
+        # We don't know which repositories were looked up individually
+        REPO_INSTALLATION_CACHE.clear()
+    elif event == 'installation':
+        for repository in payload.get('repositories', []):
+            REPO_INSTALLATION_CACHE[repository['full_name']] = installation
+            MISSING_INSTALLATION_CACHE.pop(repository['full_name'])
+        if 'repositories' not in payload:
+            MISSING_INSTALLATION_CACHE.clear()
+    else:
+        for repository in payload.get('repositories_removed', []):
+            REPO_INSTALLATION_CACHE.pop(repository['full_name'])
+        for repository in payload.get('repositories_added', []):
+            REPO_INSTALLATION_CACHE[repository['full_name']] = installation
+            MISSING_INSTALLATION_CACHE.pop(repository['full_name'])
+
+    repos = INSTALLATION_CACHE.get('mapping')
+    if repos is None:
+        return
+
+    repos = dict(repos)
+
+    if event == 'installation':
+        if action in ('deleted', 'suspend'):
+            repos = {name: iid for name, iid in repos.items() if iid != installation}
+        elif action == 'created' and 'repositories' in payload:
+            for repository in payload['repositories']:
+                repos[repository['full_name']] = installation
+        else:
+            # e.g. unsuspend, for which the payload does not list the
+            # repositories, so the mapping is requested again when needed.
+            INSTALLATION_CACHE.pop('mapping')
+            return
     else:
-        raise ValueError("Repository not recognized - should be one of:\n\n  - " + "\n  - ".join(mapping))
+        for repository in payload.get('repositories_removed', []):
+            if repos.get(repository['full_name']) == installation:
+                del repos[repository['full_name']]
+        for repository in payload.get('repositories_added', []):
+            repos[repository['full_name']] = installation
+
+    INSTALLATION_CACHE['mapping'] = repos
 
 
 def get_app_name():
@@ -160,5 +577,5 @@ def get_app_name():
     headers = {}
     headers['Authorization'] = 'Bearer {0}'.format(get_json_web_token())
     headers['Accept'] = 'application/vnd.github.machine-man-preview+json'
-    response = requests.get('https://api.github.com/app', headers=headers).json()
+    response = get_session().get('https://api.github.com/app', headers=headers).json()
     return response['name']
@@ -0,0 +1,217 @@
+"""
+Scheduling of requests according to the GitHub rate limits.
+
+Every response from GitHub tells us how many requests are left in the
+current window (``X-RateLimit-Remaining``) and when it resets
+(``X-RateLimit-Reset``). `RATE_LIMITER` keeps track of these for each
+installation and each resource (the REST and GraphQL APIs have separate
+limits) and delays requests as the budget shrinks, rather than letting a
+burst of events use up the quota and fail on every request until it resets.
+
+* When less than ``BALDRICK_RATE_LIMIT_SLOW_DOWN`` (default 0.2) of the quota
+  is left, requests are spread out so that the remaining requests last until
+  the reset.
+* Work marked as low priority with `low_priority` (e.g. the stale issue and
+  pull request sweeps) waits for the reset once less than
+  ``BALDRICK_RATE_LIMIT_RESERVE`` (default 0.5) of the quota is left, leaving
+  the rest for webhooks.
+* After a secondary rate limit, GitHub sends a ``Retry-After`` header and no
+  request is made for that installation until it has passed.
+
+Normal priority requests never wait more than ``BALDRICK_RATE_LIMIT_MAX_WAIT``
+seconds (default 30), since webhooks need to be answered quickly. If a longer
+wait would be needed the request is made straight away.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+__all__ = ['RateLimiter', 'RATE_LIMITER', 'low_priority']
+
+SLOW_DOWN = float(os.environ.get('BALDRICK_RATE_LIMIT_SLOW_DOWN', 0.2))
+RESERVE = float(os.environ.get('BALDRICK_RATE_LIMIT_RESERVE', 0.5))
+MAX_WAIT = float(os.environ.get('BALDRICK_RATE_LIMIT_MAX_WAIT', 30))
+
+NORMAL = 'normal'
+LOW = 'low'
+
+_PRIORITY = ContextVar('baldrick_request_priority', default=NORMAL)
+
+
+@contextmanager
+def low_priority():
+    """
+    Mark the requests made within this context as low priority.
+
+    Low priority requests are held back when the quota is running low, so
+    that webhooks can still be handled.
+    """
+    token = _PRIORITY.set(LOW)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority():
+    return _PRIORITY.get()
+
+
+def _resource(url):
+    return 'graphql' if url.rstrip('/').endswith('/graphql') else 'core'
+
+
+class _Budget:
+
+    __slots__ = ('limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.retry_after = None
+
+
+class RateLimiter:
+    """
+    Track the rate limits reported by GitHub and delay requests accordingly.
+
+    Parameters
+    ----------
+    slow_down : `float`
+        The fraction of the quota below which requests are spread out.
+
+    reserve : `float`
+        The fraction of the quota below which low priority requests wait for
+        the reset.
+
+    max_wait : `float`
+        The longest time a normal priority request is delayed for, in seconds.
+    """
+
+    def __init__(self, slow_down=SLOW_DOWN, reserve=RESERVE, max_wait=MAX_WAIT):
+        self.slow_down = slow_down
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self.delayed = 0
+        self.waited = 0.
+
+    # These are attributes so that tests can replace them
+    _clock = staticmethod(time.time)
+    _sleep = staticmethod(time.sleep)
+
+    def delay(self, installation, url, priority=None):
+        """
+        Return how long to wait before making a request, in seconds.
+
+        This also counts the request against the remaining quota so that
+        concurrent requests see the budget going down.
+        """
+        priority = current_priority() if priority is None else priority
+        now = self._clock()
+
+        with self._lock:
+
+            budget = self._budgets.get((installation, _resource(url)))
+            if budget is None:
+                return 0.
+
+            delay = 0.
+
+            if budget.retry_after is not None:
+                if budget.retry_after > now:
+                    delay = budget.retry_after - now
+                else:
+                    budget.retry_after = None
+
+            if budget.reset is not None and budget.reset <= now:
+                # A new window has started, we don't know anything about it yet
+                budget.remaining = budget.limit = budget.reset = None
+
+            if budget.remaining is not None and budget.limit:
+                until_reset = budget.reset - now
+                fraction = budget.remaining / budget.limit
+                if budget.remaining <= 0 or (priority == LOW and fraction < self.reserve):
+                    delay = max(delay, until_reset)
+                elif fraction < self.slow_down:
+                    spread = until_reset / budget.remaining
+                    delay = max(delay, spread * (1 - fraction / self.slow_down))
+                budget.remaining -= 1
+
+        if priority != LOW and delay > self.max_wait:
+            return 0.
+
+        return delay
+
+    def _count(self, delay):
+        if delay > 0:
+            with self._lock:
+                self.delayed += 1
+                self.waited += delay
+        return delay
+
+    def wait(self, installation, url, priority=None):
+        """
+        Sleep until a request can be made.
+        """
+        delay = self._count(self.delay(installation, url, priority=priority))
+        if delay > 0:
+            self._sleep(delay)
+
+    async def wait_async(self, installation, url, priority=None):
+        """
+        Like `wait`, but without blocking the event loop.
+        """
+        delay = self._count(self.delay(installation, url, priority=priority))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, installation, response):
+        """
+        Update the budget of an installation from the headers of a response.
+        """
+        headers = response.headers
+        resource = headers.get('X-RateLimit-Resource') or _resource(str(response.url or ''))
+        now = self._clock()
+
+        with self._lock:
+
+            budget = self._budgets.setdefault((installation, resource), _Budget())
+
+            if 'X-RateLimit-Remaining' in headers and 'X-RateLimit-Reset' in headers:
+                budget.remaining = int(headers['X-RateLimit-Remaining'])
+                budget.reset = float(headers['X-RateLimit-Reset'])
+                budget.limit = int(headers.get('X-RateLimit-Limit', 0)) or budget.limit
+
+            if response.status_code in (403, 429):
+                if 'Retry-After' in headers:
+                    budget.retry_after = now + float(headers['Retry-After'])
+                elif budget.remaining == 0 and budget.reset is not None:
+                    budget.retry_after = budget.reset
+
+    def clear(self):
+        with self._lock:
+            self._budgets.clear()
+            self.delayed = 0
+            self.waited = 0.
+
+    def stats(self):
+        """
+        Return the known budgets and how often requests were delayed.
+        """
+        with self._lock:
+            return {'delayed': self.delayed,
+                    'waited': self.waited,
+                    'budgets': {key: {'limit': budget.limit,
+                                      'remaining': budget.remaining,
+                                      'reset': budget.reset,
+                                      'retry_after': budget.retry_after}
+                                for key, budget in self._budgets.items()}}
+
+
+RATE_LIMITER = RateLimiter()
@@ -0,0 +1,514 @@
+"""
+Shared, pooled HTTP sessions used for all traffic to GitHub.
+
+Creating a new connection for every API call means a fresh TCP and TLS
+handshake each time, so instead we keep one `requests.Session` per
+installation (and one for app-level calls) and re-use it from every thread.
+Each session keeps a pool of keep-alive connections for each host it talks to.
+
+The pool can be tuned with the following environment variables:
+
+* ``BALDRICK_HTTP_POOL_CONNECTIONS``: number of hosts to keep pools for
+  (default 10).
+* ``BALDRICK_HTTP_POOL_MAXSIZE``: maximum number of connections kept per host
+  (default 10).
+* ``BALDRICK_HTTP_KEEP_ALIVE``: set to ``false`` to close connections after
+  every request (default ``true``).
+* ``BALDRICK_HTTP_TRUST_ENV``: set to ``true`` to let ``requests`` read
+  ``~/.netrc`` and proxy settings from the environment (default ``false``,
+  because a ``.netrc`` entry for GitHub would override our ``Authorization``
+  header).
+
+GET responses which carry an ``ETag`` or ``Last-Modified`` header are kept in
+`RESPONSE_CACHE` and later requests for the same URL are made conditional.
+GitHub answers those with ``304 Not Modified``, which does not count against
+the rate limit, and we then return the cached response. The number of cached
+responses is set by ``BALDRICK_ETAG_CACHE_SIZE`` (default 1024, 0 disables the
+cache). `CONDITIONAL_REQUESTS` counts how many GET requests were answered with
+``304``, and how many needed a full response.
+
+All requests go through `~baldrick.github.github_rate_limit.RATE_LIMITER`,
+which delays them when the rate limit of the installation is running low.
+
+Requests which fail for transient reasons (server errors, connection errors
+and secondary rate limits) are retried by `RETRY_POLICY`, waiting a random
+time of up to ``BALDRICK_RETRY_BACKOFF * 2 ** retry`` seconds (default 0.5)
+between attempts, capped to ``BALDRICK_RETRY_BACKOFF_MAX`` (default 10). At
+most ``BALDRICK_RETRY_TOTAL`` retries are made (default 3), and no retry is
+started after ``BALDRICK_RETRY_DEADLINE`` seconds (default 30) since the first
+attempt, so requests rejected because the rate limit is exhausted are only
+retried if it is reset before then. Requests which are not idempotent
+(``POST``) are only retried if GitHub did not act on them, i.e. if the
+connection could not be made or the request was rejected by a rate limit.
+
+Responses are instances of `GitHubResponse`, which decode JSON with
+`baldrick.json_backend` (using ``orjson`` if it is installed).
+"""
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.models import PreparedRequest
+from requests.structures import CaseInsensitiveDict
+
+from baldrick import json_backend
+from baldrick.cache import LRUCache
+from baldrick.github.github_rate_limit import RATE_LIMITER
+
+__all__ = ['GitHubResponse', 'GitHubSession', 'RetryPolicy', 'get_session', 'close_sessions',
+           'RESPONSE_CACHE', 'CONDITIONAL_REQUESTS', 'RETRY_POLICY']
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+POOL_CONNECTIONS = int(os.environ.get('BALDRICK_HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('BALDRICK_HTTP_POOL_MAXSIZE', 10))
+KEEP_ALIVE = _env_flag('BALDRICK_HTTP_KEEP_ALIVE', True)
+TRUST_ENV = _env_flag('BALDRICK_HTTP_TRUST_ENV', False)
+
+ETAG_CACHE_SIZE = int(os.environ.get('BALDRICK_ETAG_CACHE_SIZE', 1024))
+ETAG_CACHE_BYTES = int(os.environ.get('BALDRICK_ETAG_CACHE_BYTES', 32 * 1024 * 1024))
+
+RETRY_TOTAL = int(os.environ.get('BALDRICK_RETRY_TOTAL', 3))
+RETRY_BACKOFF = float(os.environ.get('BALDRICK_RETRY_BACKOFF', 0.5))
+RETRY_BACKOFF_MAX = float(os.environ.get('BALDRICK_RETRY_BACKOFF_MAX', 10))
+RETRY_DEADLINE = float(os.environ.get('BALDRICK_RETRY_DEADLINE', 30))
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+# Headers of a 304 response which are more up to date than the cached ones
+_REFRESHED_HEADERS = ('ETag', 'Last-Modified', 'Date', 'X-RateLimit-Limit', 'X-RateLimit-Remaining',
+                      'X-RateLimit-Reset', 'X-RateLimit-Used', 'X-RateLimit-Resource')
+
+
+class GitHubResponse(requests.Response):
+    """
+    A `requests.Response` which decodes JSON with `baldrick.json_backend`.
+    """
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        try:
+            return json_backend.loads(self.content)
+        except ValueError:
+            # Let requests deal with other encodings, and raise its usual
+            # exception for bodies which aren't JSON.
+            return super().json()
+
+
+class _GitHubAdapter(HTTPAdapter):
+
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        # GitHubResponse only adds methods, so the response can be used as is
+        response.__class__ = GitHubResponse
+        return response
+
+
+class _CachedResponse:
+    """
+    The parts of a response we need to rebuild it after a ``304``.
+    """
+
+    __slots__ = ('status_code', 'headers', 'content', 'encoding', 'reason')
+
+    def __init__(self, status_code, headers, content, encoding=None, reason=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+        self.reason = reason
+
+    @classmethod
+    def from_response(cls, response):
+        return cls(response.status_code, response.headers, response.content,
+                   encoding=response.encoding, reason=response.reason)
+
+    @property
+    def validators(self):
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by the body and headers.
+        """
+        return len(self.content) + sum(len(name) + len(value) for name, value in self.headers.items())
+
+    def to_response(self, not_modified):
+        response = GitHubResponse()
+        response.status_code = self.status_code
+        response.reason = self.reason
+        response.headers = CaseInsensitiveDict(self.headers)
+        for header in _REFRESHED_HEADERS:
+            if header in not_modified.headers:
+                response.headers[header] = not_modified.headers[header]
+        response._content = self.content
+        response.encoding = self.encoding
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        response.from_cache = True
+        return response
+
+
+def _cache_key(installation, url, params, accept):
+    """
+    Return the key of a GET request in `RESPONSE_CACHE`.
+    """
+    prepared = PreparedRequest()
+    prepared.prepare_url(url, params)
+    return (installation, prepared.url, accept)
+
+
+class _ConditionalRequests:
+    """
+    Count the outcome of the GET requests which go through `RESPONSE_CACHE`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, response, conditional):
+        with self._lock:
+            if response.status_code == 304 and conditional:
+                self._counts['not_modified'] += 1
+            elif conditional:
+                self._counts['modified'] += 1
+            else:
+                self._counts['unconditional'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def stats(self):
+        """
+        Return the number of conditional requests answered with ``304 Not
+        Modified`` (which don't count against the rate limit), of conditional
+        requests which returned a new response, and of requests for which
+        nothing was cached.
+        """
+        with self._lock:
+            return {'not_modified': self._counts['not_modified'],
+                    'modified': self._counts['modified'],
+                    'unconditional': self._counts['unconditional']}
+
+
+CONDITIONAL_REQUESTS = _ConditionalRequests()
+
+
+# Responses are bounded by total size as well as by number, since pages of
+# modified files (with their patches) or of issues can be several MB each.
+RESPONSE_CACHE = LRUCache(maxsize=ETAG_CACHE_SIZE, maxbytes=ETAG_CACHE_BYTES,
+                          sizeof=lambda cached: cached.nbytes)
+
+
+class RetryPolicy:
+    """
+    Decide whether and when to retry failed requests.
+
+    Parameters
+    ----------
+    total : `int`
+        The maximum number of retries for each request.
+
+    backoff : `float`
+        The base of the exponential backoff, in seconds.
+
+    backoff_max : `float`
+        The longest time to wait between two attempts, in seconds.
+
+    deadline : `float`
+        No retry is made if it would start more than this many seconds after
+        the first attempt.
+    """
+
+    def __init__(self, total=RETRY_TOTAL, backoff=RETRY_BACKOFF,
+                 backoff_max=RETRY_BACKOFF_MAX, deadline=RETRY_DEADLINE):
+        self.total = total
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._retries = Counter()
+        self.failures = 0
+
+    # These are attributes so that tests can replace them
+    _clock = staticmethod(time.monotonic)
+    _time = staticmethod(time.time)
+    _sleep = staticmethod(time.sleep)
+    _uniform = staticmethod(random.uniform)
+
+    @staticmethod
+    def _rate_limited(response):
+        if response.status_code == 429:
+            return True
+        return response.status_code == 403 and ('Retry-After' in response.headers or
+                                                 response.headers.get('X-RateLimit-Remaining') == '0')
+
+    def reason(self, method, response=None, error=None,
+               connect_errors=(requests.ConnectTimeout,),
+               transport_errors=(requests.ConnectionError, requests.Timeout)):
+        """
+        Return why a request should be retried, or `None` if it shouldn't.
+
+        ``connect_errors`` are the exceptions raised when the connection could
+        not be made, and ``transport_errors`` all the exceptions due to the
+        network, for the HTTP client in use.
+        """
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        if error is not None:
+            if isinstance(error, connect_errors):
+                return 'connect'
+            if idempotent and isinstance(error, transport_errors):
+                return 'connection'
+            return None
+        if self._rate_limited(response):
+            return 'rate_limit'
+        if idempotent and response.status_code in RETRY_STATUSES:
+            return str(response.status_code)
+        return None
+
+    def delay(self, retry, response=None):
+        """
+        Return how long to wait before a retry (counting from 0).
+
+        When the primary rate limit is exhausted, this is at least the time
+        until it is reset, so that retries past the deadline are not made.
+        """
+        delay = self._uniform(0, min(self.backoff_max, self.backoff * 2 ** retry))
+        if response is not None:
+            if 'Retry-After' in response.headers:
+                delay = max(delay, float(response.headers['Retry-After']))
+            elif (response.headers.get('X-RateLimit-Remaining') == '0' and
+                    'X-RateLimit-Reset' in response.headers):
+                delay = max(delay, float(response.headers['X-RateLimit-Reset']) - self._time())
+        return delay
+
+    def next_delay(self, method, retry, elapsed, response=None, error=None, **errors):
+        """
+        Return how long to wait before retrying, or `None` to stop.
+
+        ``retry`` is the number of retries made so far and ``elapsed`` the
+        time since the first attempt. Other keyword arguments are passed to
+        `reason`.
+        """
+        reason = self.reason(method, response=response, error=error, **errors)
+        if reason is None:
+            return None
+
+        delay = self.delay(retry, response=response)
+        if retry >= self.total or elapsed + delay > self.deadline:
+            with self._lock:
+                self.failures += 1
+            return None
+
+        with self._lock:
+            self._retries[reason] += 1
+        return delay
+
+    def call(self, method, send):
+        """
+        Call ``send`` until it returns a response which should not be retried.
+
+        If the last attempt raised an exception, it is raised again.
+        """
+        start = self._clock()
+        retry = 0
+        while True:
+            response = error = None
+            try:
+                response = send()
+            except requests.RequestException as exc:
+                error = exc
+
+            delay = self.next_delay(method, retry, self._clock() - start,
+                                    response=response, error=error)
+            if delay is None:
+                break
+
+            self._sleep(delay)
+            retry += 1
+
+        if error is not None:
+            raise error
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._retries.clear()
+            self.failures = 0
+
+    def stats(self):
+        """
+        Return the number of retries for each reason and the number of
+        requests which still failed after retrying.
+        """
+        with self._lock:
+            return {'retries': sum(self._retries.values()),
+                    'reasons': dict(self._retries),
+                    'failures': self.failures}
+
+
+RETRY_POLICY = RetryPolicy()
+
+
+class GitHubSession(requests.Session):
+    """
+    A `requests.Session` which makes conditional GET requests, respects the
+    rate limits and retries transient failures.
+
+    Parameters
+    ----------
+    installation : `int` or `None`
+        The installation this session makes requests for. This is part of the
+        cache key so that responses are never shared between installations.
+
+    cache : `baldrick.cache.LRUCache` or `None`
+        Where to keep responses. Defaults to `RESPONSE_CACHE`.
+
+    rate_limiter : `~baldrick.github.github_rate_limit.RateLimiter` or `None`
+        What to schedule requests with. Defaults to
+        `~baldrick.github.github_rate_limit.RATE_LIMITER`.
+
+    retry_policy : `RetryPolicy` or `None`
+        How to retry failed requests. Defaults to `RETRY_POLICY`.
+    """
+
+    def __init__(self, installation=None, cache=None, rate_limiter=None, retry_policy=None):
+        super().__init__()
+        self.installation = installation
+        self.cache = RESPONSE_CACHE if cache is None else cache
+        self.rate_limiter = RATE_LIMITER if rate_limiter is None else rate_limiter
+        self.retry_policy = RETRY_POLICY if retry_policy is None else retry_policy
+
+    def _cache_key(self, url, params, headers):
+        return _cache_key(self.installation, url, params,
+                          (headers or {}).get('Accept', self.headers.get('Accept')))
+
+    def _send(self, method, url, params=None, headers=None, **kwargs):
+
+        def send():
+            self.rate_limiter.wait(self.installation, url)
+            response = super(GitHubSession, self).request(method, url, params=params,
+                                                          headers=headers, **kwargs)
+            self.rate_limiter.update(self.installation, response)
+            return response
+
+        return self.retry_policy.call(method, send)
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        """
+        Send a request, waiting for the rate limit and retrying transient
+        failures.
+
+        ``GET`` requests for which a response with an ``ETag`` or
+        ``Last-Modified`` header is in the cache are sent as conditional
+        requests, and the cached response is returned if GitHub answers
+        ``304 Not Modified``. The parameters are the same as for
+        `requests.Session.request`.
+        """
+
+        if method.upper() != 'GET' or kwargs.get('stream') or self.cache.maxsize == 0:
+            return self._send(method, url, params=params, headers=headers, **kwargs)
+
+        key = self._cache_key(url, params, headers)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            headers = {**(headers or {}), **cached.validators}
+
+        response = self._send(method, url, params=params, headers=headers, **kwargs)
+        CONDITIONAL_REQUESTS.record(response, cached is not None)
+
+        if response.status_code == 304 and cached is not None:
+            return cached.to_response(response)
+
+        if response.status_code == 200 and ('ETag' in response.headers or
+                                            'Last-Modified' in response.headers):
+            self.cache[key] = _CachedResponse.from_response(response)
+        elif cached is not None:
+            self.cache.pop(key)
+
+        return response
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def create_session(installation=None, pool_connections=None, pool_maxsize=None,
+                   keep_alive=None, trust_env=None):
+    """
+    Create a new `GitHubSession` configured for talking to GitHub.
+
+    Any parameter which is not given is taken from the module defaults, which
+    are themselves read from the environment.
+    """
+    pool_connections = POOL_CONNECTIONS if pool_connections is None else pool_connections
+    pool_maxsize = POOL_MAXSIZE if pool_maxsize is None else pool_maxsize
+    keep_alive = KEEP_ALIVE if keep_alive is None else keep_alive
+    trust_env = TRUST_ENV if trust_env is None else trust_env
+
+    session = GitHubSession(installation=installation)
+    session.trust_env = trust_env
+
+    adapter = _GitHubAdapter(pool_connections=pool_connections,
+                             pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def get_session(installation=None):
+    """
+    Return the shared session for an installation.
+
+    Parameters
+    ----------
+    installation : `int` or `None`
+        The installation the requests will be made on behalf of. `None`
+        returns the session used for app-level (JWT authenticated) and
+        anonymous requests.
+    """
+    try:
+        return _SESSIONS[installation]
+    except KeyError:
+        pass
+
+    with _SESSIONS_LOCK:
+        if installation not in _SESSIONS:
+            _SESSIONS[installation] = create_session(installation)
+        return _SESSIONS[installation]
+
+
+def close_sessions():
+    """
+    Close all the shared sessions and their connection pools.
+    """
+    with _SESSIONS_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
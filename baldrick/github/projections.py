@@ -0,0 +1,79 @@
+"""
+Compact projections of the GitHub objects used by the handlers.
+
+The JSON returned by GitHub for an issue or a pull request has dozens of
+fields, most of them URLs, nested user and repository objects. The handlers
+only keep the fields that baldrick reads, in slotted dataclasses, so that a
+handler (e.g. in a sweep over all the open issues of a repository) holds a
+few hundred bytes instead of the whole document.
+"""
+from dataclasses import dataclass
+
+__all__ = ['IssueInfo', 'PullRequestInfo']
+
+
+def _login(user):
+    return user['login'] if user else None
+
+
+def _issue_fields(data):
+    milestone = data.get('milestone')
+    return dict(number=data.get('number'),
+                state=data.get('state'),
+                user=_login(data.get('user')),
+                labels=tuple(label['name'] for label in data.get('labels') or ()),
+                milestone=milestone['title'] if milestone else None,
+                created_at=data.get('created_at'),
+                updated_at=data.get('updated_at'))
+
+
+@dataclass(frozen=True, slots=True)
+class IssueInfo:
+    """
+    The fields of an issue used by baldrick.
+    """
+
+    number: int = None
+    state: str = None
+    user: str = None
+    labels: tuple = ()
+    milestone: str = None
+    created_at: str = None
+    updated_at: str = None
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Keep the fields used by baldrick from the JSON returned by GitHub.
+        """
+        return cls(**_issue_fields(data))
+
+
+@dataclass(frozen=True, slots=True)
+class PullRequestInfo(IssueInfo):
+    """
+    The fields of a pull request used by baldrick.
+    """
+
+    draft: bool = False
+    head_sha: str = None
+    head_ref: str = None
+    head_repo: str = None
+    base_sha: str = None
+    base_ref: str = None
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Keep the fields used by baldrick from the JSON returned by GitHub.
+        """
+        head = data.get('head') or {}
+        base = data.get('base') or {}
+        head_repo = head.get('repo')
+        return cls(**_issue_fields(data),
+                   draft=data.get('draft', False),
+                   head_sha=head.get('sha'),
+                   head_ref=head.get('ref'),
+                   head_repo=head_repo['full_name'] if head_repo else None,
+                   base_sha=base.get('sha'),
+                   base_ref=base.get('ref'))
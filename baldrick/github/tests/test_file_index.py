@@ -0,0 +1,42 @@
+from baldrick.github.file_index import FileIndex
+
+PATHS = ['setup.py', 'docs/index.rst', 'astropy/io/fits/tests/test_core.py',
+         'astropy/io/fits/core.py', 'astropy/io/ascii/core.py', 'astropy/table/table.py']
+
+
+def test_order_and_membership():
+    index = FileIndex(PATHS)
+    assert list(index) == PATHS
+    assert index.tolist() == PATHS
+    assert len(index) == 6
+    assert 'astropy/io/fits/core.py' in index
+    assert 'astropy/io/fits' not in index
+    assert 'zzz' not in index
+    assert 'a' not in FileIndex()
+
+
+def test_prefix():
+    index = FileIndex(PATHS)
+    assert index.with_prefix('astropy/io/') == ['astropy/io/ascii/core.py', 'astropy/io/fits/core.py',
+                                               'astropy/io/fits/tests/test_core.py']
+    assert index.has_prefix('docs/')
+    assert not index.has_prefix('doc/')
+    assert not index.has_prefix('zzz')
+    assert index.with_prefix('') == sorted(PATHS)
+
+
+def test_match():
+    index = FileIndex(PATHS)
+    assert index.match('astropy/io/*/core.py') == ['astropy/io/ascii/core.py', 'astropy/io/fits/core.py']
+    assert index.match('*.rst') == ['docs/index.rst']
+    assert index.match('astropy/*/test_*.py') == ['astropy/io/fits/tests/test_core.py']
+    assert index.match('setup.py') == ['setup.py']
+    assert index.match('setup.cfg') == []
+
+
+def test_large():
+    paths = [f'package/module{i}/file{j}.py' for i in range(100) for j in range(50)]
+    index = FileIndex(reversed(paths))
+    assert 'package/module42/file7.py' in index
+    assert len(index.with_prefix('package/module4/')) == 50
+    assert len(index.match('package/module9?/file1.py')) == 10
@@ -5,18 +5,122 @@ from unittest.mock import patch, Mock, PropertyMock, MagicMock
 import pytest
 
 from baldrick.config import loads
-from baldrick.github.github_api import (FILE_CACHE, RepoHandler, IssueHandler,
-                                        PullRequestHandler)
+from baldrick.github.github_api import (CHECK_RUN_CACHE, COMMENT_CACHE, FILE_CACHE, LABEL_CACHE,
+                                        MODIFIED_FILES_CACHE, REF_CACHE, REPO_INFO_CACHE, TIMELINE_CACHE,
+                                        RepoHandler, IssueHandler, PullRequestHandler,
+                                        paged_github_json_request, iter_github_json,
+                                        update_caches_from_webhook)
+from baldrick.github.projections import PullRequestInfo
 
 
 # TODO: Add more tests to increase coverage.
 
+
+class FakePagedSession:
+    """
+    A fake session serving ``items`` in pages of ``per_page`` items.
+    """
+
+    def __init__(self, items, key=None, use_last=True):
+        self.items = items
+        self.key = key
+        self.use_last = use_last
+        self.calls = []
+
+    def get(self, url, params=None, headers=None):
+        if params is None:
+            url, _, query = url.partition('?')
+            params = dict(item.split('=') for item in query.split('&'))
+        self.calls.append((url, dict(params)))
+        per_page = int(params['per_page'])
+        page = int(params.get('page', 1))
+        last_page = (len(self.items) - 1) // per_page + 1
+        response = Mock()
+        response.ok = True
+        items = self.items[(page - 1) * per_page:page * per_page]
+        response.json.return_value = items if self.key is None else {self.key: items,
+                                                                     'total_count': len(self.items)}
+        links = []
+        if page < last_page:
+            links.append(f'<{url}?per_page={per_page}&page={page + 1}>; rel="next"')
+            if self.use_last:
+                links.append(f'<{url}?per_page={per_page}&page={last_page}>; rel="last"')
+        response.headers = {'Link': ', '.join(links)} if links else {}
+        return response
+
+
+class TestPagedRequest:
+
+    def test_single_page(self):
+        session = FakePagedSession(list(range(10)))
+        assert paged_github_json_request('https://api.github.com/things', session=session) == list(range(10))
+        assert session.calls == [('https://api.github.com/things', {'per_page': 100})]
+
+    def test_many_pages(self):
+        session = FakePagedSession(list(range(1050)))
+        results = paged_github_json_request('https://api.github.com/things', session=session)
+        assert results == list(range(1050))
+        assert len(session.calls) == 11
+
+    def test_existing_query_string(self):
+        session = FakePagedSession(list(range(250)))
+        results = paged_github_json_request('https://api.github.com/things?state=open',
+                                            session=session, params={'labels': 'Close?'})
+        assert results == list(range(250))
+        for url, params in session.calls:
+            assert url == 'https://api.github.com/things'
+            assert params['state'] == 'open'
+            assert params['labels'] == 'Close?'
+        assert sorted(int(params.get('page', 1)) for _, params in session.calls) == [1, 2, 3]
+
+    def test_dict_pages(self):
+        session = FakePagedSession(list(range(150)), key='check_runs')
+        results = paged_github_json_request('https://api.github.com/check-runs', session=session)
+        assert results['check_runs'] == list(range(150))
+        assert results['total_count'] == 150
+
+    def test_follow_next(self):
+        session = FakePagedSession(list(range(250)), use_last=False)
+        results = paged_github_json_request('https://api.github.com/things', session=session)
+        assert results == list(range(250))
+        assert len(session.calls) == 3
+
+
+class TestIterGitHubJSON:
+
+    @pytest.mark.parametrize('prefetch', [True, False])
+    def test_all_items(self, prefetch):
+        session = FakePagedSession(list(range(250)))
+        results = list(iter_github_json('https://api.github.com/things', session=session,
+                                        prefetch=prefetch))
+        assert results == list(range(250))
+        assert len(session.calls) == 3
+
+    def test_stop_early(self):
+        session = FakePagedSession(list(range(1000)))
+        for item in iter_github_json('https://api.github.com/things', session=session,
+                                     prefetch=False):
+            if item == 42:
+                break
+        assert len(session.calls) == 1
+
+    def test_key(self):
+        session = FakePagedSession(list(range(150)), key='check_runs')
+        results = list(iter_github_json('https://api.github.com/check-runs',
+                                        session=session, key='check_runs'))
+        assert results == list(range(150))
+
+
+SHA1 = 'a' * 40
+SHA2 = 'b' * 40
+
+
 class TestRepoHandler:
 
     def setup_class(self):
         self.repo = RepoHandler('fakerepo/doesnotexist', branch='awesomebot')
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_issues(self, mock_get):
         # http://engineroom.trackmaven.com/blog/real-life-mocking/
         mock_response = Mock()
@@ -24,13 +128,14 @@ class TestRepoHandler:
             {'number': 42, 'state': 'open'},
             {'number': 55, 'state': 'open',
              'pull_request': {'diff_url': 'blah'}}]
+        mock_response.headers = {}
         mock_get.return_value = mock_response
 
         assert self.repo.get_issues('open', 'Close?') == [42]
         assert self.repo.get_issues('open', 'Close?',
                                     exclude_pr=False) == [42, 55]
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_all_labels(self, mock_get):
         mock_response = Mock()
         mock_response.json.return_value = [
@@ -41,6 +146,142 @@ class TestRepoHandler:
 
         assert self.repo.get_all_labels() == ['io.fits', 'Documentation']
 
+    @patch('requests.Session.get')
+    def test_get_all_labels_cached(self, mock_get):
+        mock_get.return_value.json.return_value = [{'name': 'io.fits'}, {'name': 'Bug'}]
+        mock_get.return_value.headers = {}
+
+        assert self.repo.get_all_labels() == ['io.fits', 'Bug']
+        assert RepoHandler('fakerepo/doesnotexist').get_all_labels() == ['io.fits', 'Bug']
+        assert mock_get.call_count == 1
+
+        # Events for other repositories don't clear the cache
+        update_caches_from_webhook('label', {'action': 'created', 'label': {'name': 'Close?'},
+                                             'repository': {'full_name': 'fakerepo/other'}})
+        assert 'fakerepo/other' not in LABEL_CACHE
+        assert 'fakerepo/doesnotexist' in LABEL_CACHE
+
+        # The labels in the payload are not used, they are requested again
+        update_caches_from_webhook('label', {'action': 'created', 'label': {'name': 'Close?'},
+                                             'repository': {'full_name': 'fakerepo/doesnotexist'}})
+        assert 'fakerepo/doesnotexist' not in LABEL_CACHE
+        mock_get.return_value.json.return_value = [{'name': 'io.fits'}, {'name': 'Bug'}, {'name': 'Close?'}]
+        assert self.repo.get_all_labels() == ['io.fits', 'Bug', 'Close?']
+        assert mock_get.call_count == 2
+
+    @patch('requests.Session.get')
+    def test_repo_info_cached(self, mock_get):
+        mock_get.return_value.ok = True
+        mock_get.return_value.json.return_value = {'default_branch': 'main'}
+
+        assert self.repo.default_branch == 'main'
+        assert RepoHandler('fakerepo/doesnotexist').default_branch == 'main'
+        assert mock_get.call_count == 1
+
+        # Unrelated events don't clear the cache
+        update_caches_from_webhook('repository', {'repository': {'full_name': 'fakerepo/other',
+                                                                 'owner': {'login': 'fakerepo'}}})
+        assert self.repo.default_branch == 'main'
+        assert mock_get.call_count == 1
+
+        mock_get.return_value.json.return_value = {'default_branch': 'develop'}
+        update_caches_from_webhook('repository', {'repository': {'full_name': 'fakerepo/doesnotexist',
+                                                                 'owner': {'login': 'fakerepo'}}})
+        assert self.repo.default_branch == 'develop'
+        assert mock_get.call_count == 2
+
+    def test_repo_info_invalidation(self):
+        REPO_INFO_CACHE['fakerepo/old'] = {}
+        REPO_INFO_CACHE['fakerepo/new'] = {}
+        update_caches_from_webhook('repository', {'repository': {'full_name': 'fakerepo/new',
+                                                                 'owner': {'login': 'fakerepo'}},
+                                                  'changes': {'repository': {'name': {'from': 'old'}}}})
+        assert len(REPO_INFO_CACHE) == 0
+
+        REPO_INFO_CACHE['fakerepo/added'] = {}
+        REPO_INFO_CACHE['fakerepo/removed'] = {}
+        REPO_INFO_CACHE['fakerepo/other'] = {}
+        update_caches_from_webhook('installation_repositories',
+                                   {'repositories_added': [{'full_name': 'fakerepo/added'}],
+                                    'repositories_removed': [{'full_name': 'fakerepo/removed'}]})
+        assert REPO_INFO_CACHE.keys() == ['fakerepo/other']
+
+    def _contents_get(self, url, params=None, headers=None):
+        response = Mock()
+        response.ok = True
+        if url.endswith('/commits/awesomebot'):
+            assert headers['Accept'] == 'application/vnd.github.sha'
+            response.text = SHA1
+        elif url.endswith('/contents/setup.cfg'):
+            response.ok = False
+            response.json.return_value = {'message': 'Not Found'}
+        else:
+            assert url == 'https://api.github.com/repos/fakerepo/doesnotexist/contents/README.rst'
+            response.json.return_value = {'content': base64.b64encode(params['ref'].encode()).decode()}
+        return response
+
+    def test_get_file_contents(self):
+        with patch('requests.Session.get', side_effect=self._contents_get) as mock_get:
+            assert self.repo.get_file_contents('README.rst') == SHA1
+            assert self.repo.get_file_contents('README.rst', branch=SHA1) == SHA1
+            assert self.repo.get_file_contents('README.rst', branch=SHA2) == SHA2
+            assert mock_get.call_count == 3
+
+            # A push makes us look the branch up again, but the SHA in the
+            # payload is not trusted
+            update_caches_from_webhook('push', {'ref': 'refs/heads/awesomebot', 'after': SHA2,
+                                                'repository': {'full_name': 'fakerepo/doesnotexist'}})
+            assert self.repo.get_file_contents('README.rst') == SHA1
+            assert mock_get.call_count == 4
+
+            # Missing files are remembered too
+            for i in range(2):
+                with pytest.raises(FileNotFoundError):
+                    self.repo.get_file_contents('setup.cfg')
+            assert mock_get.call_count == 5
+
+    def test_resolve_ref_deleted_branch(self):
+        REF_CACHE[('fakerepo/doesnotexist', 'awesomebot')] = SHA2
+        update_caches_from_webhook('push', {'ref': 'refs/heads/awesomebot', 'after': '0' * 40,
+                                            'deleted': True,
+                                            'repository': {'full_name': 'fakerepo/doesnotexist'}})
+        with patch('requests.Session.get', side_effect=self._contents_get):
+            assert self.repo.resolve_ref('awesomebot') == SHA1
+
+    def test_resolve_ref_pull_request(self):
+        REF_CACHE[('contributor/doesnotexist', 'feature')] = SHA1
+        update_caches_from_webhook('pull_request', {'pull_request': {'head': {
+            'repo': {'full_name': 'contributor/doesnotexist'}, 'ref': 'feature', 'sha': SHA2}}})
+        assert ('contributor/doesnotexist', 'feature') not in REF_CACHE
+
+    def test_get_repo_config_cached(self, app):
+        with app.app_context():
+            with patch.object(RepoHandler, 'get_file_contents') as mock_get, \
+                 patch('baldrick.github.github_api.loads', wraps=loads) as mock_loads:
+                mock_get.return_value = TEST_CONFIG
+
+                config = self.repo.get_repo_config(branch='awesomebot')
+                assert config == {'pr': {'setting1': 2, 'setting2': 3}}
+
+                # Modifying the returned config doesn't affect later calls
+                config['pr']['setting1'] = 100
+
+                other = RepoHandler('fakerepo/doesnotexist', branch='awesomebot')
+                assert other.get_repo_config(branch='awesomebot') == {'pr': {'setting1': 2, 'setting2': 3}}
+                assert mock_loads.call_count == 1
+
+                # Changing the app config gives a new merged config
+                app.conf = loads(TEST_GLOBAL_CONFIG, tool='testbot')
+                assert self.repo.get_config_value('pr', branch='awesomebot') == {'setting1': 2, 'setting2': 3,
+                                                                                 'setting3': 6}
+                assert mock_loads.call_count == 2
+                assert app.conf['pr'] == {'setting1': 1, 'setting2': 5, 'setting3': 6}
+
+                # As does changing the file
+                mock_get.return_value = TEST_CONFIG.replace('setting2 = 3', 'setting2 = 4')
+                assert self.repo.get_config_value('pr', branch='awesomebot') == {'setting1': 2, 'setting2': 4,
+                                                                                 'setting3': 6}
+
     def test_urls(self):
         assert self.repo._url_contents == 'https://api.github.com/repos/fakerepo/doesnotexist/contents/'
         assert self.repo._url_pull_requests == 'https://api.github.com/repos/fakerepo/doesnotexist/pulls'
@@ -79,6 +320,7 @@ class TestRealRepoHandler:
 
     def setup_method(self, method):
         FILE_CACHE.clear()
+        REF_CACHE.clear()
 
     def setup_class(self):
         self.repo = RepoHandler('OpenAstronomy/baldrick')
@@ -163,7 +405,19 @@ class TestIssueHandler:
     def test_is_closed(self, state, answer):
         with patch('baldrick.github.github_api.IssueHandler.json', new_callable=PropertyMock) as mock_json:  # noqa
             mock_json.return_value = {'state': state}
-            assert self.issue.is_closed is answer
+            assert IssueHandler('fakerepo/doesnotexist', 1234).is_closed is answer
+
+    def test_json(self):
+        issue = IssueHandler('fakerepo/doesnotexist', 1234)
+        with patch('requests.Session.get') as get:
+            get.return_value.json.return_value = {'number': 1234, 'state': 'open'}
+            # Only the projection is kept when the JSON is not asked for
+            assert issue.info.state == 'open'
+            assert 'json' not in issue._cache
+            # The JSON is requested once when it is asked for
+            assert issue.json['state'] == 'open'
+            assert issue.json['state'] == 'open'
+        assert get.call_count == 2
 
     def test_missing_labels(self):
         with patch('baldrick.github.github_api.IssueHandler.labels', new_callable=PropertyMock) as mock_issue_labels:  # noqa
@@ -189,6 +443,146 @@ class TestIssueHandler:
                     ['io.fits', 'closed-by-bot', 'foo'])
                 assert missing_labels == ['closed-by-bot']
 
+    def test_set_labels(self):
+        issue = IssueHandler('fakerepo/doesnotexist', 1234)
+        LABEL_CACHE['fakerepo/doesnotexist'] = ['io.fits', 'closed-by-bot']
+        with patch('requests.Session.get') as get, patch('requests.Session.post') as post:
+            get.return_value.json.return_value = [{'name': 'io.fits'}]
+            post.return_value.json.return_value = [{'name': 'io.fits'}, {'name': 'closed-by-bot'}]
+            issue.set_labels(['closed-by-bot'])
+            post.assert_called_once_with(issue._url_labels, headers={}, json=['closed-by-bot'])
+            assert issue.labels == ['io.fits', 'closed-by-bot']
+            # Setting the same label again doesn't need any requests
+            issue.set_labels('closed-by-bot')
+        assert get.call_count == 1
+        assert post.call_count == 1
+
+
+def timeline_event(event, label='Close?', date='2018-01-01T00:00:00Z', event_id=None):
+    if event in ('labeled', 'unlabeled'):
+        result = {'event': event, 'label': {'name': label}, 'created_at': date}
+    else:
+        result = {'event': event, 'created_at': date}
+    if event_id is not None:
+        result['id'] = event_id
+    return result
+
+
+class TestLabelTimeline:
+
+    def get_label_added_date(self, session, label='Close?'):
+        with patch.object(IssueHandler, '_session', new_callable=PropertyMock) as mock_session:
+            mock_session.return_value = session
+            return IssueHandler('fakerepo/doesnotexist', 1234).get_label_added_date(label)
+
+    def test_incremental(self):
+        events = [timeline_event('commented')] * 150 + [timeline_event('labeled')]
+        session = FakePagedSession(events)
+        assert self.get_label_added_date(session) == 1514764800.0
+        assert len(session.calls) == 2
+        assert self.get_label_added_date(session, 'other') is None
+        assert TIMELINE_CACHE[('fakerepo/doesnotexist', 1234)]['count'] == 151
+
+        # Only the last page is requested from now on
+        events += [timeline_event('unlabeled', date='2018-01-02T00:00:00Z'),
+                   timeline_event('labeled', date='2018-01-03T00:00:00Z')]
+        session.calls.clear()
+        assert self.get_label_added_date(session) == 1514937600.0
+        assert [params.get('page') for url, params in session.calls] == [2]
+
+        events.append(timeline_event('unlabeled', date='2018-01-04T00:00:00Z'))
+        assert self.get_label_added_date(session) is None
+
+    def test_timeline_shrunk(self):
+        session = FakePagedSession([timeline_event('commented')] * 120)
+        assert self.get_label_added_date(session) is None
+        session.items = [timeline_event('labeled')] + [timeline_event('commented')] * 10
+        assert self.get_label_added_date(session) == 1514764800.0
+        assert TIMELINE_CACHE[('fakerepo/doesnotexist', 1234)]['count'] == 11
+
+    def test_timeline_replaced(self):
+        # Two events are removed and three added: the number of events alone
+        # would make us skip the label event
+        events = [timeline_event('commented', event_id=i) for i in range(1, 121)]
+        session = FakePagedSession(events)
+        assert self.get_label_added_date(session) is None
+        session.items = (events[:4] + events[6:] +
+                         [timeline_event('labeled', date='2018-01-02T00:00:00Z', event_id=121),
+                          timeline_event('commented', event_id=122),
+                          timeline_event('commented', event_id=123)])
+        session.calls.clear()
+        assert self.get_label_added_date(session) == 1514851200.0
+        # The last event read before is checked on page 2, then the timeline
+        # is read again from the start
+        assert [int(params['page']) for url, params in session.calls] == [2, 1, 2]
+        assert TIMELINE_CACHE[('fakerepo/doesnotexist', 1234)]['count'] == 121
+        assert TIMELINE_CACHE[('fakerepo/doesnotexist', 1234)]['last'] == 123
+
+    def test_deleted_comment(self):
+        TIMELINE_CACHE[('fakerepo/doesnotexist', 1234)] = {'count': 3, 'labels': {}}
+        update_caches_from_webhook('issue_comment', {'action': 'deleted',
+                                                     'repository': {'full_name': 'fakerepo/doesnotexist'},
+                                                     'issue': {'number': 1234},
+                                                     'comment': {'id': 1, 'user': {'login': 'bot'}}})
+        assert ('fakerepo/doesnotexist', 1234) not in TIMELINE_CACHE
+
+
+def comment(comment_id, login='testbot[bot]', body='warning', date='2018-01-01T00:00:00Z'):
+    return {'id': comment_id, 'user': {'login': login}, 'body': body,
+            'created_at': date, 'updated_at': date}
+
+
+class TestCommentStore:
+
+    @pytest.fixture(autouse=True)
+    def mock_session(self):
+        with patch.object(IssueHandler, '_session', new_callable=PropertyMock) as mock_session:
+            self.mock_session = mock_session
+            yield
+
+    def get_issue(self, session):
+        self.mock_session.return_value = session
+        return IssueHandler('fakerepo/doesnotexist', 1234)
+
+    def test_incremental(self):
+        session = FakePagedSession([comment(1), comment(2, login='pluto'),
+                                    comment(3, body='epilogue', date='2018-01-02T00:00:00Z')])
+        issue = self.get_issue(session)
+        assert issue.last_comment_date('testbot[bot]', lambda body: body == 'warning') == 1514764800.0
+        assert issue.find_comments('testbot[bot]', lambda body: body == 'epilogue') == [3]
+        assert issue.find_comments('testbot[bot]') == [1, 3]
+        assert issue.find_comments('nobody') == []
+        assert len(session.calls) == 1
+        assert 'since' not in session.calls[0][1]
+
+        # Later lookups only request comments updated since the last one seen
+        session.items = [comment(1, body='edited', date='2018-01-03T00:00:00Z')]
+        issue = self.get_issue(session)
+        assert issue.find_comments('testbot[bot]', lambda body: body == 'warning') == []
+        assert issue.find_comments('testbot[bot]', lambda body: body == 'edited') == [1]
+        assert session.calls[1][1]['since'] == '2018-01-02T00:00:00Z'
+
+    def test_deleted_comment(self):
+        session = FakePagedSession([comment(1), comment(2)])
+        assert self.get_issue(session).find_comments('testbot[bot]') == [1, 2]
+        update_caches_from_webhook('issue_comment', {'action': 'deleted',
+                                                     'repository': {'full_name': 'fakerepo/doesnotexist'},
+                                                     'issue': {'number': 1234},
+                                                     'comment': comment(1)})
+        session.items = []
+        assert self.get_issue(session).find_comments('testbot[bot]') == [2]
+
+    def test_submit_comment(self):
+        session = FakePagedSession([comment(1)])
+        session.post = Mock()
+        session.post.return_value.json.return_value = comment(2, date='2018-01-05T00:00:00Z')
+        issue = self.get_issue(session)
+        assert issue.find_comments('testbot[bot]') == [1]
+        issue.submit_comment('warning')
+        assert issue.find_comments('testbot[bot]') == [1, 2]
+        # The date from which comments are requested isn't moved
+        assert COMMENT_CACHE[('fakerepo/doesnotexist', 1234)]['since'] == '2018-01-01T00:00:00Z'
+
 
 class TestPullRequestHandler:
     def setup_class(self):
@@ -213,16 +607,31 @@ class TestPullRequestHandler:
             "contents_url": "https://api.github.com/repos/blah/blah/contents/file1.txt?ref=hash",
             "patch": "@@ -132,7 +132,7 @@ module Test @@ -1000,7 +1000,7 @@ module Test"
         }])
-        with patch('baldrick.github.github_api.paged_github_json_request', mock):  # noqa
-            assert self.pr.has_modified(['file1.txt'])
-            assert self.pr.has_modified(['file1.txt', 'notthis.txt'])
-            assert not self.pr.has_modified(['notthis.txt'])
+        pr = PullRequestHandler('fakerepo/doesnotexist', 1234)
+        pr._cache['info'] = PullRequestInfo(head_sha=SHA2, base_ref='main')
+        with patch('baldrick.github.github_api.iter_github_json', mock):  # noqa
+            assert pr.has_modified(['file1.txt'])
+            assert pr.has_modified(['file1.txt', 'notthis.txt'])
+            assert not pr.has_modified(['notthis.txt'])
+
+    def test_modified_files_cached(self):
+        files = [{'filename': 'docs/index.rst', 'patch': '...'}, {'filename': 'setup.py', 'patch': '...'}]
+        with patch('baldrick.github.github_api.paged_github_json_request', return_value=files) as mock:
+            for _ in range(2):
+                pr = PullRequestHandler('fakerepo/doesnotexist', 1234)
+                pr._cache['info'] = PullRequestInfo(head_sha=SHA2, base_ref='main')
+                assert pr.get_modified_files() == ['docs/index.rst', 'setup.py']
+                assert list(pr.iter_modified_files()) == ['docs/index.rst', 'setup.py']
+                assert pr.has_modified('setup.py')
+                assert pr.get_modified_file_index().match('docs/*.rst') == ['docs/index.rst']
+        assert mock.call_count == 1
+        assert MODIFIED_FILES_CACHE[('fakerepo/doesnotexist', 1234, SHA2, 'main')] == ['docs/index.rst', 'setup.py']
 
     def test_set_check(self, app):
         with patch("baldrick.github.github_api.PullRequestHandler.json", new_callable=PropertyMock) as json:
             json.return_value = {'head': {'sha': 987654321},
                                  'base': {'sha': 123456789}}
-            with patch('requests.post') as post:
+            with patch('requests.Session.post') as post:
                 self.pr.set_check("baldrick-1", "hello", name="test")
                 expected_json = {'external_id': 'baldrick-1',
                                  'name': 'test',
@@ -276,3 +685,156 @@ class TestPullRequestHandler:
                 post.assert_called_once_with('https://api.github.com/repos/fakerepo/doesnotexist/check-runs',
                                              headers={'Accept': 'application/vnd.github.antiope-preview+json'},
                                              json=expected_json)
+
+
+def graphql_pull_request(files_next_page=False):
+    return {'data': {'repository': {'pullRequest': {
+        'number': 1234,
+        'state': 'MERGED',
+        'isDraft': False,
+        'author': {'login': 'pluto'},
+        'baseRefName': 'main',
+        'baseRefOid': SHA1,
+        'headRefName': 'feature',
+        'headRefOid': SHA2,
+        'headRepository': {'nameWithOwner': 'pluto/doesnotexist'},
+        'milestone': None,
+        'labels': {'nodes': [{'name': 'Bug'}], 'pageInfo': {'hasNextPage': False}},
+        'files': {'nodes': [{'path': 'file1.txt'}],
+                  'pageInfo': {'hasNextPage': files_next_page, 'endCursor': 'abc'}},
+        'commits': {'nodes': [{'commit': {'oid': SHA2, 'checkSuites': {
+            'nodes': [{'checkRuns': {
+                'nodes': [{'databaseId': 42, 'externalId': 'baldrick-1', 'name': 'test',
+                           'status': 'COMPLETED', 'conclusion': 'SUCCESS', 'title': 'hello',
+                           'summary': '', 'text': None, 'detailsUrl': None}],
+                'pageInfo': {'hasNextPage': False}}}],
+            'pageInfo': {'hasNextPage': False}}}}]},
+    }}}}
+
+
+def check_run_json(external_id, conclusion='success', app_id=1234, check_id=42, head_sha=SHA2):
+    return {'external_id': external_id, 'name': 'test', 'head_sha': head_sha, 'id': check_id,
+            'status': 'completed', 'conclusion': conclusion, 'app': {'id': app_id},
+            'details_url': None, 'output': {'title': 'hello', 'summary': ''}}
+
+
+class TestCheckRunIndex:
+
+    def setup_method(self, method):
+        self.repo = RepoHandler('fakerepo/doesnotexist')
+
+    def test_list_checks(self, app):
+        with app.app_context(), patch('requests.Session.get') as get:
+            get.return_value.json.return_value = {'total_count': 2, 'check_runs': [
+                check_run_json('baldrick-1', app_id=app.integration_id),
+                check_run_json('other', app_id=1)]}
+            get.return_value.headers = {}
+
+            checks = self.repo.list_checks(SHA2)
+            assert list(checks) == ['baldrick-1']
+            assert checks['baldrick-1']['conclusion'] == 'success'
+
+            # The checks are cached, and copies are returned
+            checks['baldrick-1']['conclusion'] = 'failure'
+            assert self.repo.list_checks(SHA2)['baldrick-1']['conclusion'] == 'success'
+            assert get.call_count == 1
+            assert get.call_args[1]['params'] == {'filter': 'latest', 'app_id': app.integration_id,
+                                                  'per_page': 100}
+
+            # Checks from all apps are not cached
+            assert sorted(self.repo.list_checks(SHA2, only_ours=False)) == ['baldrick-1', 'other']
+            assert get.call_args[1]['params'] == {'filter': 'latest', 'per_page': 100}
+
+    def test_update_from_webhook(self, app):
+        CHECK_RUN_CACHE[('fakerepo/doesnotexist', SHA2)] = {}
+        repository = {'full_name': 'fakerepo/doesnotexist'}
+        with app.app_context():
+            # Check runs from other apps are ignored
+            update_caches_from_webhook('check_run', {
+                'action': 'created', 'repository': repository,
+                'check_run': check_run_json('other', app_id=1)})
+            assert ('fakerepo/doesnotexist', SHA2) in CHECK_RUN_CACHE
+
+            # Our check runs are not copied from the payload, the commit is
+            # listed again instead
+            update_caches_from_webhook('check_run', {
+                'action': 'created', 'repository': repository,
+                'check_run': check_run_json('baldrick-1', app_id=app.integration_id)})
+            assert ('fakerepo/doesnotexist', SHA2) not in CHECK_RUN_CACHE
+
+            # Commits we don't know about are ignored
+            update_caches_from_webhook('check_run', {
+                'action': 'created', 'repository': repository,
+                'check_run': check_run_json('baldrick-1', app_id=app.integration_id, head_sha=SHA1)})
+        assert ('fakerepo/doesnotexist', SHA1) not in CHECK_RUN_CACHE
+
+    def test_set_check(self, app):
+        CHECK_RUN_CACHE[('fakerepo/doesnotexist', SHA2)] = {
+            'baldrick-1': {'external_id': 'baldrick-1', 'conclusion': 'success', 'check_id': 42}}
+        pr = PullRequestHandler('fakerepo/doesnotexist', 1234)
+        with app.app_context(), patch('requests.Session.patch') as patch_request:
+            patch_request.return_value.json.return_value = check_run_json('baldrick-1', conclusion='failure')
+            pr.set_check('baldrick-1', 'hello', name='test', commit_hash=SHA2,
+                         conclusion='failure', check_id=42)
+            assert pr.list_checks(SHA2)['baldrick-1']['conclusion'] == 'failure'
+
+
+class TestPullRequestGraphQL:
+
+    def setup_method(self, method):
+        self.pr = PullRequestHandler('fakerepo/doesnotexist', 1234)
+
+    def test_load(self, app):
+        responses = [graphql_pull_request(files_next_page=True),
+                     {'data': {'repository': {'pullRequest': {'files': {
+                         'nodes': [{'path': 'file2.txt'}],
+                         'pageInfo': {'hasNextPage': False, 'endCursor': None}}}}}}]
+        with app.app_context(), patch('requests.Session.post') as post, patch('requests.Session.get') as get:
+            post.return_value.ok = True
+            post.return_value.json.side_effect = responses
+            assert self.pr.load_from_graphql()
+
+            assert post.call_count == 2
+            assert post.call_args_list[0][0][0] == 'https://api.github.com/graphql'
+            variables = post.call_args_list[0][1]['json']['variables']
+            assert variables == {'owner': 'fakerepo', 'name': 'doesnotexist',
+                                 'number': 1234, 'appId': app.integration_id}
+            assert post.call_args_list[1][1]['json']['variables']['cursor'] == 'abc'
+
+            assert self.pr.is_closed
+            assert self.pr.user == 'pluto'
+            assert self.pr.head_repo_name == 'pluto/doesnotexist'
+            assert self.pr.head_sha == SHA2
+            assert self.pr.base_branch == 'main'
+            assert self.pr.milestone == ''
+            assert not self.pr.draft
+            assert self.pr.labels == ['Bug']
+            assert self.pr.get_modified_files() == ['file1.txt', 'file2.txt']
+            assert self.pr.has_modified(['file2.txt'])
+            assert self.pr.list_checks() == {'baldrick-1': {
+                'external_id': 'baldrick-1', 'title': 'hello', 'summary': '', 'name': 'test',
+                'text': None, 'commit_hash': SHA2, 'details_url': None, 'status': 'completed',
+                'conclusion': 'success', 'check_id': 42}}
+
+            get.assert_not_called()
+
+    def test_missing_json_key(self, app):
+        with app.app_context(), patch('requests.Session.post') as post, patch('requests.Session.get') as get:
+            post.return_value.ok = True
+            post.return_value.json.return_value = graphql_pull_request()
+            assert self.pr.load_from_graphql()
+
+            get.return_value.ok = True
+            get.return_value.json.return_value = {'body': 'Fixes #1', 'state': 'closed'}
+            assert self.pr.json['body'] == 'Fixes #1'
+            assert self.pr.head_sha == SHA2
+            get.assert_called_once()
+
+    def test_query_errors(self, app):
+        with app.app_context(), patch('requests.Session.post') as post:
+            post.return_value.ok = True
+            post.return_value.json.return_value = {'errors': [{'message': 'Bad credentials'}]}
+            assert not self.pr.load_from_graphql()
+
+        assert 'json' not in self.pr._cache
+        assert 'labels' not in self.pr._cache
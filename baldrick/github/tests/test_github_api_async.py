@@ -0,0 +1,282 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from baldrick.cache import LRUCache, SQLiteCache, TieredCache  # noqa: E402
+from baldrick.github.github_api_async import (_CLIENTS, AsyncGitHubClient,  # noqa: E402
+                                              AsyncIssueHandler, AsyncPullRequestHandler,
+                                              _cache_get, _cache_set, close_async_clients,
+                                              iter_github_json_async, paged_github_json_request_async)
+from baldrick.github.github_auth import TOKEN_MANAGER  # noqa: E402
+from baldrick.github.github_rate_limit import RateLimiter  # noqa: E402
+from baldrick.github.github_session import RetryPolicy  # noqa: E402
+
+SHA1 = 'a' * 40
+SHA2 = 'b' * 40
+
+PULL_REQUEST = {'number': 1234, 'state': 'open', 'draft': False,
+                'user': {'login': 'pluto'}, 'milestone': {'title': 'v1.0'},
+                'head': {'ref': 'feature', 'sha': SHA2, 'repo': {'full_name': 'pluto/test'}},
+                'base': {'ref': 'main', 'sha': SHA1}}
+
+
+class FakeGitHub:
+    """
+    Answer requests from a dictionary of ``(method, path)`` to JSON bodies and
+    record the requests made.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        body = self.routes[(request.method, request.url.path)]
+        if callable(body):
+            return body(request)
+        return httpx.Response(200, json=body)
+
+    def paths(self, method='GET'):
+        return [request.url.path for request in self.requests if request.method == method]
+
+
+def run(routes, func):
+    """
+    Run ``func(fake)`` in a new event loop, with the shared client answered
+    by a `FakeGitHub`.
+    """
+    fake = FakeGitHub(routes)
+
+    async def main():
+        _CLIENTS[asyncio.get_running_loop()] = {
+            None: AsyncGitHubClient(transport=httpx.MockTransport(fake), rate_limiter=RateLimiter(),
+                                    retry_policy=RetryPolicy())}
+        try:
+            return await func(fake)
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(main())
+
+
+def test_paged_request():
+
+    def pages(request):
+        page = int(request.url.params.get('page', 1))
+        headers = {}
+        if page == 1:
+            headers['Link'] = ('<https://api.github.com/items?page=2>; rel="next", '
+                               '<https://api.github.com/items?page=3>; rel="last"')
+        return httpx.Response(200, json=[page], headers=headers)
+
+    async def check(fake):
+        assert await paged_github_json_request_async('https://api.github.com/items') == [1, 2, 3]
+        assert [item async for item in iter_github_json_async('https://api.github.com/items')] == [1, 2]
+        return fake
+
+    fake = run({('GET', '/items'): pages}, check)
+    assert fake.requests[0].url.params['per_page'] == '100'
+
+
+def test_pull_request_json():
+
+    async def check(fake):
+        pr = AsyncPullRequestHandler('test/test', 1234)
+        user, head_sha, base_branch, milestone, draft, closed = await asyncio.gather(
+            pr.user, pr.head_sha, pr.base_branch, pr.milestone, pr.draft, pr.is_closed)
+        assert user == 'pluto'
+        assert head_sha == SHA2
+        assert base_branch == 'main'
+        assert milestone == 'v1.0'
+        assert not draft
+        assert not closed
+        # The concurrent lookups share one request
+        assert fake.paths() == ['/repos/test/test/pulls/1234']
+
+    run({('GET', '/repos/test/test/pulls/1234'): PULL_REQUEST}, check)
+
+
+def test_modified_files_and_contents():
+    routes = {('GET', '/repos/test/test/pulls/1234'): PULL_REQUEST,
+              ('GET', '/repos/test/test/pulls/1234/files'): [{'filename': 'CHANGES.rst'},
+                                                             {'filename': 'setup.py'}],
+              ('GET', '/repos/test/test/contents/setup.py'): {
+                  'content': base64.b64encode(b'print("hello")').decode()}}
+
+    async def check(fake):
+        pr = AsyncPullRequestHandler('test/test', 1234)
+        assert await pr.get_modified_files() == ['CHANGES.rst', 'setup.py']
+        assert await pr.has_modified(['setup.py'])
+        assert not await pr.has_modified(['README.rst'])
+        assert await pr.get_file_contents('setup.py') == 'print("hello")'
+        assert await pr.get_file_contents('setup.py') == 'print("hello")'
+        assert fake.paths().count('/repos/test/test/contents/setup.py') == 1
+        request = [r for r in fake.requests if r.url.path.endswith('setup.py')][0]
+        assert request.url.params['ref'] == SHA2
+
+    run(routes, check)
+
+
+def test_labels_and_comments():
+    routes = {('GET', '/repos/test/test/issues/1/labels'): [{'name': 'Bug'}],
+              ('GET', '/repos/test/test/labels'): [{'name': 'Bug'}, {'name': 'Close?'}],
+              ('POST', '/repos/test/test/issues/1/labels'): [{'name': 'Bug'}, {'name': 'Close?'}],
+              ('GET', '/repos/test/test/issues/1/comments'): [
+                  {'id': 1, 'user': {'login': 'bot'}, 'body': 'hello', 'created_at': '2018-01-01T00:00:00Z',
+                   'updated_at': '2018-01-01T00:00:00Z'},
+                  {'id': 2, 'user': {'login': 'pluto'}, 'body': 'hi', 'created_at': '2018-01-02T00:00:00Z',
+                   'updated_at': '2018-01-02T00:00:00Z'}],
+              ('POST', '/repos/test/test/issues/1/comments'): {
+                  'id': 3, 'url': 'https://api.github.com/repos/test/test/issues/comments/3',
+                  'user': {'login': 'bot'}, 'body': 'hello again', 'created_at': '2018-01-03T00:00:00Z',
+                  'updated_at': '2018-01-03T00:00:00Z'}}
+
+    async def check(fake):
+        issue = AsyncIssueHandler('test/test', 1)
+        assert await issue.labels == ['Bug']
+        await issue.set_labels(['Bug', 'Close?', 'Nope'])
+        assert await issue.find_comments('bot') == [1]
+        assert await issue.last_comment_date('pluto') == 1514851200.0
+        url = await issue.submit_comment('hello again', return_url=True)
+        assert url == 'https://github.com/test/test/issues/1#issuecomment-3'
+        assert await issue.find_comments('bot') == [1, 3]
+        assert fake.paths().count('/repos/test/test/issues/1/comments') == 1
+        assert await issue.labels == ['Bug', 'Close?']
+        assert fake.paths().count('/repos/test/test/issues/1/labels') == 1
+        posts = [r for r in fake.requests if r.method == 'POST']
+        assert json.loads(posts[0].content) == ['Close?']
+        assert json.loads(posts[1].content) == {'body': 'hello again'}
+
+    run(routes, check)
+
+
+def test_label_added_date():
+    events = [{'event': 'labeled', 'label': {'name': 'Close?'}, 'created_at': '2018-01-01T00:00:00Z'}]
+
+    async def check(fake):
+        assert await AsyncIssueHandler('test/test', 1).get_label_added_date('Close?') == 1514764800.0
+        events.append({'event': 'unlabeled', 'label': {'name': 'Close?'}, 'created_at': '2018-01-02T00:00:00Z'})
+        assert await AsyncIssueHandler('test/test', 1).get_label_added_date('Close?') is None
+        # The second lookup skips the event it already read
+        assert [r.url.params['page'] for r in fake.requests] == ['1', '1']
+
+    run({('GET', '/repos/test/test/issues/1/timeline'): lambda request: httpx.Response(200, json=events)}, check)
+
+
+def test_checks(app):
+    routes = {('GET', '/repos/test/test/pulls/1234'): PULL_REQUEST,
+              ('GET', f'/repos/test/test/commits/{SHA2}/check-runs'): {'check_runs': [
+                  {'external_id': 'baldrick-1', 'name': 'test', 'head_sha': SHA2, 'id': 42,
+                   'status': 'completed', 'conclusion': 'success', 'app': {'id': app.integration_id},
+                   'output': {'title': 'hello', 'summary': ''}},
+                  {'external_id': 'other', 'name': 'other', 'head_sha': SHA2, 'id': 43,
+                   'status': 'completed', 'conclusion': 'success', 'app': {'id': 1},
+                   'output': {'title': 'hello', 'summary': ''}}]},
+              ('POST', '/repos/test/test/check-runs'): {
+                  'external_id': 'baldrick-2', 'name': 'test', 'head_sha': SHA2, 'id': 44,
+                  'status': 'completed', 'conclusion': 'neutral', 'app': {'id': app.integration_id},
+                  'output': {'title': 'hello', 'summary': ''}},
+              ('PATCH', '/repos/test/test/check-runs/42'): {
+                  'external_id': 'baldrick-1', 'name': 'test', 'head_sha': SHA2, 'id': 42,
+                  'status': 'completed', 'conclusion': 'failure', 'app': {'id': app.integration_id},
+                  'output': {'title': 'hello', 'summary': ''}}}
+
+    async def check(fake):
+        pr = AsyncPullRequestHandler('test/test', 1234)
+        checks = await pr.list_checks()
+        assert list(checks) == ['baldrick-1']
+        assert checks['baldrick-1']['check_id'] == 42
+        await pr.set_check('baldrick-2', 'hello', name='test')
+        await pr.set_check('baldrick-1', 'hello', name='test', check_id=42, conclusion='failure')
+        body = json.loads([r for r in fake.requests if r.method == 'POST'][0].content)
+        assert body == {'external_id': 'baldrick-2', 'name': 'test', 'head_sha': SHA2,
+                        'status': 'completed', 'output': {'title': 'hello', 'summary': ''},
+                        'conclusion': 'neutral'}
+        assert fake.paths('PATCH') == ['/repos/test/test/check-runs/42']
+
+        # The index of check runs was updated with the responses
+        checks = await pr.list_checks()
+        assert sorted(checks) == ['baldrick-1', 'baldrick-2']
+        assert checks['baldrick-1']['conclusion'] == 'failure'
+        assert fake.paths().count(f'/repos/test/test/commits/{SHA2}/check-runs') == 1
+        request = [r for r in fake.requests if r.url.path.endswith('check-runs')][0]
+        assert request.url.params['app_id'] == str(app.integration_id)
+
+    with app.app_context():
+        run(routes, check)
+
+
+def test_retry():
+    responses = [httpx.Response(502), httpx.Response(200, json={'state': 'open'})]
+
+    async def check(fake):
+        fake.routes[('GET', '/repos/test/test/issues/1')] = lambda request: responses.pop(0)
+        client = AsyncGitHubClient(transport=httpx.MockTransport(fake), rate_limiter=RateLimiter(),
+                                   retry_policy=RetryPolicy(backoff=0))
+        try:
+            response = await client.get('https://api.github.com/repos/test/test/issues/1')
+        finally:
+            await client.aclose()
+        assert response.status_code == 200
+        assert len(fake.requests) == 2
+
+    run({}, check)
+
+
+def test_conditional_requests():
+
+    def issue(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            return httpx.Response(304, headers={'ETag': '"v1"'})
+        return httpx.Response(200, json={'state': 'open'}, headers={'ETag': '"v1"'})
+
+    async def check(fake):
+        client = AsyncGitHubClient(transport=httpx.MockTransport(fake), rate_limiter=RateLimiter(),
+                                   retry_policy=RetryPolicy(), cache=LRUCache(10))
+        try:
+            for i in range(2):
+                response = await client.get('https://api.github.com/repos/test/test/issues/1')
+                assert response.status_code == 200
+                assert response.json() == {'state': 'open'}
+        finally:
+            await client.aclose()
+        assert 'If-None-Match' not in fake.requests[0].headers
+        assert fake.requests[1].headers['If-None-Match'] == '"v1"'
+
+    run({('GET', '/repos/test/test/issues/1'): issue}, check)
+
+
+def test_cached_token_headers(monkeypatch):
+    # Known tokens are used without starting a thread
+    monkeypatch.setattr(TOKEN_MANAGER, 'get_cached_token', lambda installation: 'abc')
+
+    def to_thread(*args):
+        raise AssertionError('to_thread should not be called')
+
+    async def check(fake):
+        monkeypatch.setattr(asyncio, 'to_thread', to_thread)
+        headers = await AsyncIssueHandler('test/test', 1, installation=123)._get_headers()
+        assert headers['Authorization'] == 'token abc'
+
+    run({}, check)
+
+
+def test_tiered_cache(tmp_path):
+    # Items missing from memory are read from SQLite in a thread
+    cache = TieredCache(LRUCache(10), SQLiteCache(str(tmp_path / 'cache.db'), 'test'))
+    cache['a'] = 1
+    cache.local.clear()
+
+    async def check(fake):
+        assert await _cache_get(cache, 'a') == 1
+        assert await _cache_get(cache, 'b', 2) == 2
+        await _cache_set(cache, 'b', 3)
+        assert cache.shared.get('b') == 3
+        cache.close()
+
+    run({}, check)
@@ -1,9 +1,13 @@
+import threading
+
 import pytest
 from unittest.mock import patch, MagicMock
 
-from baldrick.github.github_auth import (get_json_web_token, get_installation_token,
+from baldrick.github.github_auth import (INSTALLATION_CACHE, MISSING_INSTALLATION_CACHE, REPO_INSTALLATION_CACHE,
+                                         TOKEN_MANAGER, TokenManager, get_json_web_token, get_installation_token,
                                          github_request_headers, repo_to_installation_id_mapping,
-                                         repo_to_installation_id, get_app_name)
+                                         repo_to_installation_id, get_installation_id,
+                                         update_installations_from_webhook, get_app_name)
 
 
 def test_get_json_web_token(app):
@@ -24,7 +28,7 @@ TOKEN_RESPONSE_VALID = {"token": "v1.1f699f1069f60xxx", "expires_at": "2016-07-1
 
 def test_get_installation_token_valid():
 
-    with patch('requests.post') as post:
+    with patch('requests.Session.post') as post:
         post.return_value.ok = True
         post.return_value.json.return_value = TOKEN_RESPONSE_VALID
         token = get_installation_token(12345)
@@ -38,7 +42,7 @@ TOKEN_RESPONSE_INVALID_WITH_MESSAGE = {"message": "This is the error message",
 
 def test_get_installation_token_invalid_with_message():
 
-    with patch('requests.post') as post:
+    with patch('requests.Session.post') as post:
         post.return_value.ok = False
         post.return_value.status_code = 400
         post.return_value.json.return_value = TOKEN_RESPONSE_INVALID_WITH_MESSAGE
@@ -52,7 +56,7 @@ TOKEN_RESPONSE_INVALID_WITHOUT_MESSAGE = {}
 
 def test_get_installation_token_invalid_without_message():
 
-    with patch('requests.post') as post:
+    with patch('requests.Session.post') as post:
         post.return_value.ok = False
         post.return_value.json.return_value = TOKEN_RESPONSE_INVALID_WITHOUT_MESSAGE
         with pytest.raises(Exception) as exc:
@@ -62,7 +66,7 @@ def test_get_installation_token_invalid_without_message():
 
 def test_github_request_headers():
 
-    with patch('requests.post') as post:
+    with patch('requests.Session.post') as post:
         post.return_value.ok = True
         post.return_value.json.return_value = TOKEN_RESPONSE_VALID
         headers = github_request_headers(12345)
@@ -70,24 +74,31 @@ def test_github_request_headers():
     assert headers['Authorization'] == 'token v1.1f699f1069f60xxx'
 
 
-def requests_patch(url, headers=None):
+def requests_patch(url, params=None, headers=None):
     req = MagicMock()
     req.status_code = 200
+    req.headers = {}
     if url == 'https://api.github.com/app/installations':
         req.json.return_value = [{'id': 3331}]
     elif url == 'https://api.github.com/installation/repositories':
         req.json.return_value = {'repositories': [{'full_name': 'test1'},
                                                   {'full_name': 'test2'}]}
+    elif url in ('https://api.github.com/repos/test1/installation',
+                 'https://api.github.com/repos/test2/installation'):
+        req.json.return_value = {'id': 3331}
+    else:
+        req.ok = False
+        req.status_code = 404
     return req
 
 
 def test_repo_to_installation_id_mapping(app):
 
     with app.app_context():
-        with patch('requests.post') as post:
+        with patch('requests.Session.post') as post:
             post.return_value.ok = True
             post.return_value.json.return_value = TOKEN_RESPONSE_VALID
-            with patch('requests.get', requests_patch):
+            with patch('requests.Session.get', side_effect=requests_patch):
                 mapping = repo_to_installation_id_mapping()
 
     assert mapping == {'test1': 3331, 'test2': 3331}
@@ -96,24 +107,251 @@ def test_repo_to_installation_id_mapping(app):
 def test_repo_to_installation_id(app):
 
     with app.app_context():
-        with patch('requests.post') as post:
+        with patch('requests.Session.post') as post:
             post.return_value.ok = True
             post.return_value.json.return_value = TOKEN_RESPONSE_VALID
-            with patch('requests.get', requests_patch):
+            with patch('requests.Session.get', side_effect=requests_patch) as get:
 
                 assert repo_to_installation_id('test1') == 3331
 
+                # The installations are not listed to report an unknown repository
+                with pytest.raises(ValueError) as exc:
+                    repo_to_installation_id('test3')
+                assert exc.value.args[0] == 'Repository not recognized - the app is not installed on test3'
+                assert get.call_count == 2
+
+                # But the known repositories are given if they are cached
+                repo_to_installation_id_mapping()
                 with pytest.raises(ValueError) as exc:
                     repo_to_installation_id('test3')
                 assert exc.value.args[0] == 'Repository not recognized - should be one of:\n\n  - test1\n  - test2'
 
 
+def test_repo_to_installation_id_mapping_cached(app):
+
+    with app.app_context():
+        with patch('requests.Session.post') as post:
+            post.return_value.ok = True
+            post.return_value.json.return_value = TOKEN_RESPONSE_VALID
+            with patch('requests.Session.get', side_effect=requests_patch) as get:
+                mapping = repo_to_installation_id_mapping()
+                assert get.call_count == 2
+                # Changing the returned mapping doesn't change the cache
+                mapping['test3'] = 1
+                assert repo_to_installation_id_mapping() == {'test1': 3331, 'test2': 3331}
+                assert get.call_count == 2
+                repo_to_installation_id_mapping(use_cache=False)
+                assert get.call_count == 4
+
+
+def test_get_installation_id(app):
+
+    # Single repositories are looked up directly, and the result is cached
+    with app.app_context():
+        with patch('requests.Session.get', side_effect=requests_patch) as get:
+            assert get_installation_id('test2') == 3331
+            assert get.call_args[0][0] == 'https://api.github.com/repos/test2/installation'
+            assert get_installation_id('test2') == 3331
+            assert get.call_count == 1
+            assert get_installation_id('test3') is None
+            assert get.call_count == 2
+            # Repositories the app is not installed on are also remembered
+            assert get_installation_id('test3') is None
+            assert get.call_count == 2
+
+    # Until the app is installed on them
+    update_installations_from_webhook('installation_repositories', {
+        'action': 'added', 'installation': {'id': 3332},
+        'repositories_added': [{'full_name': 'test3'}], 'repositories_removed': []})
+    assert 'test3' not in MISSING_INSTALLATION_CACHE
+    assert get_installation_id('test3') == 3332
+
+    # Repositories in the cached mapping don't need a request
+    INSTALLATION_CACHE['mapping'] = {'test4': 1}
+    with patch('requests.Session.get', side_effect=requests_patch) as get:
+        assert get_installation_id('test4') == 1
+        assert get.call_count == 0
+
+
+def test_repo_to_installation_id_mapping_paginated(app):
+
+    # Installations and their repositories are requested page by page, the
+    # repositories of each installation in parallel.
+
+    def paginated_get(url, params=None, headers=None):
+        req = MagicMock()
+        req.ok = True
+        page = int((params or {}).get('page', 1))
+        if url == 'https://api.github.com/app/installations':
+            req.headers = {'Link': f'<{url}?page=2>; rel="last"'}
+            req.json.return_value = [{'id': 2 * page - 1}, {'id': 2 * page}]
+        else:
+            assert url == 'https://api.github.com/installation/repositories'
+            assert params['per_page'] == 100
+            iid = int(headers['Authorization'].split('-')[-1])
+            req.headers = {'Link': f'<{url}?page=3>; rel="last"'}
+            req.json.return_value = {'total_count': 3,
+                                     'repositories': [{'full_name': f'org{iid}/repo{page}'}]}
+        return req
+
+    with app.app_context():
+        with patch('baldrick.github.github_auth.get_installation_token', side_effect=lambda iid: f'token-{iid}'):
+            with patch('requests.Session.get', side_effect=paginated_get) as get:
+                mapping = repo_to_installation_id_mapping(max_workers=3)
+
+    assert get.call_count == 2 + 4 * 3
+    assert mapping == {f'org{iid}/repo{page}': iid for iid in range(1, 5) for page in range(1, 4)}
+    assert get_installation_id('org3/repo2') == 3
+
+
+def test_update_installations_from_webhook():
+
+    # Nothing is done until the mapping is cached
+    update_installations_from_webhook('installation_repositories',
+                                      {'action': 'added', 'installation': {'id': 1},
+                                       'repositories_added': [{'full_name': 'a/new'}]})
+    assert 'mapping' not in INSTALLATION_CACHE
+
+    INSTALLATION_CACHE['mapping'] = {'a/one': 1, 'a/two': 1, 'b/one': 2}
+
+    update_installations_from_webhook('installation_repositories',
+                                      {'action': 'added', 'installation': {'id': 1},
+                                       'repositories_added': [{'full_name': 'a/new'}],
+                                       'repositories_removed': [{'full_name': 'a/two'}]})
+    assert INSTALLATION_CACHE['mapping'] == {'a/one': 1, 'a/new': 1, 'b/one': 2}
+
+    update_installations_from_webhook('installation',
+                                      {'action': 'created', 'installation': {'id': 3},
+                                       'repositories': [{'full_name': 'c/one'}]})
+    assert INSTALLATION_CACHE['mapping'] == {'a/one': 1, 'a/new': 1, 'b/one': 2, 'c/one': 3}
+    assert REPO_INSTALLATION_CACHE['c/one'] == 3
+    assert REPO_INSTALLATION_CACHE['a/new'] == 1
+
+    TOKEN_MANAGER._tokens[1] = 'token'
+    update_installations_from_webhook('installation', {'action': 'deleted', 'installation': {'id': 1}})
+    assert INSTALLATION_CACHE['mapping'] == {'b/one': 2, 'c/one': 3}
+    assert 1 not in TOKEN_MANAGER._tokens
+    assert len(REPO_INSTALLATION_CACHE) == 0
+
+    update_installations_from_webhook('installation', {'action': 'unsuspend', 'installation': {'id': 1}})
+    assert 'mapping' not in INSTALLATION_CACHE
+
+
 def test_get_app_name(app):
 
     with app.app_context():
-        with patch('requests.get') as post:
+        with patch('requests.Session.get') as post:
             post.return_value.ok = True
             post.return_value.json.return_value = {'name': 'testbot'}
             name = get_app_name()
 
     assert name == 'testbot'
+
+
+class FakeTokens:
+    """
+    Hand out tokens ``token-1``, ``token-2``... which are valid for an hour.
+    """
+
+    def __init__(self, clock, fail=False):
+        self.clock = clock
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, installation):
+        self.calls.append(installation)
+        if self.fail:
+            raise Exception("500 Server Error")
+        return f'token-{len(self.calls)}', self.clock() + 3600
+
+
+class TestTokenManager:
+
+    def setup_method(self, method):
+        self.now = 1000.
+        self.tokens = FakeTokens(lambda: self.now)
+        self.manager = TokenManager(refresh_margin=300, min_validity=60, idle_timeout=7200,
+                                    retry_interval=60, request_token=self.tokens)
+        self.manager._clock = lambda: self.now
+        self.threads = []
+        self.manager._start_thread = self.threads.append
+
+    def test_reuse(self):
+        assert self.manager.get_token(1) == 'token-1'
+        self.now += 3000
+        assert self.manager.get_token(1) == 'token-1'
+        assert self.manager.get_token(2) == 'token-2'
+        assert self.tokens.calls == [1, 2]
+
+    def test_background_refresh(self):
+        assert self.manager.get_token(1) == 'token-1'
+        self.now += 3400
+        # The current token is still returned, and a single refresh is started
+        assert self.manager.get_token(1) == 'token-1'
+        assert self.manager.get_token(1) == 'token-1'
+        assert len(self.threads) == 1
+        self.threads[0]()
+        assert self.manager.get_token(1) == 'token-2'
+        stats = self.manager.stats()
+        assert stats['refreshes'] == 2
+        assert stats['background_refreshes'] == 1
+        assert stats['tokens'][1]['age'] == 0
+        assert stats['tokens'][1]['expires_in'] == 3600
+
+    def test_background_refresh_failure(self):
+        assert self.manager.get_token(1) == 'token-1'
+        self.now += 3400
+        self.tokens.fail = True
+        assert self.manager.get_token(1) == 'token-1'
+        self.threads[0]()
+        assert self.manager.stats()['failures'] == 1
+        # The old token is used until it is about to expire, and the refresh
+        # is only attempted again after a while
+        assert self.manager.get_token(1) == 'token-1'
+        assert len(self.threads) == 1
+        self.now += 60
+        assert self.manager.get_token(1) == 'token-1'
+        assert len(self.threads) == 2
+        self.threads[1]()
+        assert self.manager.get_token(1) == 'token-1'
+        assert len(self.threads) == 2
+        self.now += 120
+        with pytest.raises(Exception, match='500 Server Error'):
+            self.manager.get_token(1)
+
+    def test_expired(self):
+        assert self.manager.get_token(1) == 'token-1'
+        self.now += 3550
+        assert self.manager.get_token(1) == 'token-2'
+        assert self.threads == []
+
+    def test_singleflight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_tokens(installation):
+            started.set()
+            release.wait(5)
+            return self.tokens(installation)
+
+        self.manager._request_token = slow_tokens
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.manager.get_token(1)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        assert results == ['token-1'] * 8
+        assert self.tokens.calls == [1]
+
+    def test_evict_idle(self):
+        assert self.manager.get_token(1) == 'token-1'
+        self.now += 3000
+        assert self.manager.get_token(2) == 'token-2'
+        self.now += 5000
+        assert self.manager.get_token(3) == 'token-3'
+        assert set(self.manager.stats()['tokens']) == {3}
+        assert self.manager.stats()['evictions'] == 2
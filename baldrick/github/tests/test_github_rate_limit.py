@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from baldrick.cache import LRUCache
+from baldrick.github.github_rate_limit import RateLimiter, low_priority, current_priority
+from baldrick.github.github_session import GitHubSession
+
+URL = 'https://api.github.com/repos/test/test'
+NOW = 1_000_000.
+
+
+def make_response(status_code=200, remaining=5000, limit=5000, reset=NOW + 3600,
+                  headers=None, url=URL):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers.update({'X-RateLimit-Limit': str(limit),
+                             'X-RateLimit-Remaining': str(remaining),
+                             'X-RateLimit-Reset': str(int(reset))})
+    response.headers.update(headers or {})
+    return response
+
+
+class TestRateLimiter:
+
+    def setup_method(self, method):
+        self.limiter = RateLimiter(slow_down=0.2, reserve=0.5, max_wait=30)
+        self.limiter._clock = lambda: NOW
+        self.limiter._sleep = MagicMock()
+
+    def test_unknown(self):
+        assert self.limiter.delay(1234, URL) == 0
+
+    def test_plenty_left(self):
+        self.limiter.update(1234, make_response(remaining=4000))
+        assert self.limiter.delay(1234, URL) == 0
+        assert self.limiter.delay(1234, URL, priority='low') == 0
+
+    def test_slow_down(self):
+        self.limiter.update(1234, make_response(remaining=100, reset=NOW + 100))
+        delay = self.limiter.delay(1234, URL)
+        assert 0 < delay < 1
+        # The quota of other installations is separate
+        assert self.limiter.delay(5678, URL) == 0
+        # And so is the GraphQL quota
+        assert self.limiter.delay(1234, 'https://api.github.com/graphql') == 0
+
+    def test_counts_requests(self):
+        self.limiter.update(1234, make_response(remaining=10))
+        for _ in range(10):
+            self.limiter.delay(1234, URL)
+        assert self.limiter.stats()['budgets'][(1234, 'core')]['remaining'] == 0
+
+    def test_exhausted(self):
+        self.limiter.update(1234, make_response(remaining=0, reset=NOW + 10))
+        assert self.limiter.delay(1234, URL) == 10
+        # Normal priority requests don't wait for too long
+        self.limiter.update(1234, make_response(remaining=0, reset=NOW + 1000))
+        assert self.limiter.delay(1234, URL) == 0
+        assert self.limiter.delay(1234, URL, priority='low') == 1000
+
+    def test_reset_passed(self):
+        self.limiter.update(1234, make_response(remaining=0, reset=NOW - 1))
+        assert self.limiter.delay(1234, URL) == 0
+
+    def test_low_priority(self):
+        self.limiter.update(1234, make_response(remaining=2000, reset=NOW + 600))
+        assert self.limiter.delay(1234, URL) == 0
+        with low_priority():
+            assert current_priority() == 'low'
+            assert self.limiter.delay(1234, URL) == 600
+        assert current_priority() == 'normal'
+
+    def test_retry_after(self):
+        self.limiter.update(1234, make_response(status_code=403, remaining=4000,
+                                                headers={'Retry-After': '20'}))
+        assert self.limiter.delay(1234, URL) == 20
+        self.limiter._clock = lambda: NOW + 30
+        assert self.limiter.delay(1234, URL) == 0
+
+    def test_wait(self):
+        self.limiter.update(1234, make_response(remaining=0, reset=NOW + 5))
+        self.limiter.wait(1234, URL)
+        self.limiter._sleep.assert_called_once_with(5)
+        stats = self.limiter.stats()
+        assert stats['delayed'] == 1
+        assert stats['waited'] == 5
+
+
+def test_session_uses_rate_limiter():
+    limiter = RateLimiter()
+    limiter._clock = lambda: NOW
+    limiter._sleep = MagicMock()
+    session = GitHubSession(installation=1234, cache=LRUCache(), rate_limiter=limiter)
+    with patch('requests.Session.request') as request:
+        request.return_value = make_response(remaining=0, reset=NOW + 5)
+        session.get(URL)
+        limiter._sleep.assert_not_called()
+        session.post(URL)
+        limiter._sleep.assert_called_once_with(5)
@@ -0,0 +1,240 @@
+import importlib
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from baldrick.cache import LRUCache
+from baldrick.github.github_rate_limit import RateLimiter
+from baldrick.github.github_session import (CONDITIONAL_REQUESTS, RESPONSE_CACHE, GitHubSession, RetryPolicy,
+                                            create_session, get_session, close_sessions)
+
+
+def teardown_function(function):
+    close_sessions()
+
+
+def test_get_session_shared():
+    assert get_session(1234) is get_session(1234)
+    assert get_session() is get_session(None)
+    assert get_session(1234) is not get_session(5678)
+    assert get_session(1234) is not get_session()
+
+
+@pytest.mark.parametrize('module', ['baldrick.github.github_api', 'baldrick.github.github_auth'])
+def test_get_session_not_exported(module):
+    # Modules using the sessions must define __all__, otherwise the API docs
+    # pick up get_session as part of their API.
+    module = importlib.import_module(module)
+    assert 'get_session' not in module.__all__
+
+
+def test_close_sessions():
+    session = get_session(1234)
+    with patch.object(session, 'close') as close:
+        close_sessions()
+    close.assert_called_once_with()
+    assert get_session(1234) is not session
+
+
+def test_create_session_defaults():
+    session = create_session()
+    assert session.trust_env is False
+    assert session.headers['Connection'] == 'keep-alive'
+    adapter = session.get_adapter('https://api.github.com')
+    assert adapter._pool_connections == 10
+    assert adapter._pool_maxsize == 10
+
+
+def test_create_session_options():
+    session = create_session(pool_connections=2, pool_maxsize=20,
+                             keep_alive=False, trust_env=True)
+    assert session.trust_env is True
+    assert session.headers['Connection'] == 'close'
+    adapter = session.get_adapter('https://api.github.com')
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 20
+
+
+def make_response(status_code, content=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    response.url = 'https://api.github.com/repos/test/test'
+    return response
+
+
+class TestConditionalRequests:
+
+    def setup_method(self, method):
+        self.cache = LRUCache()
+        self.session = GitHubSession(installation=1234, cache=self.cache)
+
+    def test_etag(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(200, b'{"a": 1}', {'ETag': '"abc"',
+                                                                   'X-RateLimit-Remaining': '10'})
+            response = self.session.get('https://api.github.com/repos/test/test',
+                                        headers={'Authorization': 'token 1'})
+            assert response.json() == {'a': 1}
+            assert request.call_args[1]['headers'] == {'Authorization': 'token 1'}
+
+            request.return_value = make_response(304, headers={'ETag': '"abc"',
+                                                               'X-RateLimit-Remaining': '9'})
+            response = self.session.get('https://api.github.com/repos/test/test',
+                                        headers={'Authorization': 'token 2'})
+            assert request.call_args[1]['headers'] == {'Authorization': 'token 2',
+                                                       'If-None-Match': '"abc"'}
+            assert response.status_code == 200
+            assert response.ok
+            assert response.from_cache
+            assert response.json() == {'a': 1}
+            assert response.headers['X-RateLimit-Remaining'] == '9'
+
+        assert CONDITIONAL_REQUESTS.stats() == {'not_modified': 1, 'modified': 0, 'unconditional': 1}
+
+    def test_last_modified(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(200, b'[]', {'Last-Modified': 'yesterday'})
+            self.session.get('https://api.github.com/repos/test/test', params={'page': 2})
+            request.return_value = make_response(304)
+            response = self.session.get('https://api.github.com/repos/test/test?page=2')
+            assert request.call_args[1]['headers'] == {'If-Modified-Since': 'yesterday'}
+            assert response.json() == []
+
+    def test_changed(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(200, b'1', {'ETag': '"abc"'})
+            self.session.get('https://api.github.com/repos/test/test')
+            request.return_value = make_response(200, b'2', {'ETag': '"def"'})
+            assert self.session.get('https://api.github.com/repos/test/test').json() == 2
+            request.return_value = make_response(304)
+            self.session.get('https://api.github.com/repos/test/test')
+            assert request.call_args[1]['headers'] == {'If-None-Match': '"def"'}
+
+        # A conditional request which returns a new body is not a revalidation
+        assert CONDITIONAL_REQUESTS.stats() == {'not_modified': 1, 'modified': 1, 'unconditional': 1}
+
+    def test_not_cached(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(200, b'1')
+            self.session.get('https://api.github.com/repos/test/test')
+            request.return_value = make_response(201, b'1', {'ETag': '"abc"'})
+            self.session.post('https://api.github.com/repos/test/test')
+        assert len(self.cache) == 0
+
+    def test_response_cache_bytes(self):
+        # The shared cache is bounded by the size of the bodies
+        assert RESPONSE_CACHE.maxbytes > 0
+        cache = LRUCache(maxsize=100, maxbytes=2000, sizeof=lambda cached: cached.nbytes)
+        session = GitHubSession(installation=1234, cache=cache)
+        with patch('requests.Session.request') as request:
+            for page in range(3):
+                request.return_value = make_response(200, b'x' * 900, {'ETag': f'"{page}"'})
+                session.get('https://api.github.com/repos/test/test/pulls/1/files', params={'page': page})
+        assert len(cache) == 2
+        assert cache.nbytes <= 2000
+
+    def test_separate_installations(self):
+        other = GitHubSession(installation=5678, cache=self.cache)
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(200, b'1', {'ETag': '"abc"'})
+            self.session.get('https://api.github.com/repos/test/test')
+            request.return_value = make_response(200, b'2', {'ETag': '"def"'})
+            other.get('https://api.github.com/repos/test/test')
+            assert request.call_args[1]['headers'] is None
+        assert len(self.cache) == 2
+
+
+class TestRetryPolicy:
+
+    def setup_method(self, method):
+        self.policy = RetryPolicy(total=3, backoff=0.5, backoff_max=10, deadline=30)
+        self.policy._sleep = MagicMock()
+        self.policy._uniform = lambda low, high: high
+        self.limiter = RateLimiter()
+        self.limiter._sleep = MagicMock()
+        self.session = GitHubSession(installation=1234, cache=LRUCache(), rate_limiter=self.limiter,
+                                     retry_policy=self.policy)
+
+    def test_server_error(self):
+        with patch('requests.Session.request') as request:
+            request.side_effect = [make_response(502), make_response(503), make_response(200, b'{}')]
+            response = self.session.get('https://api.github.com/repos/test/test')
+        assert response.status_code == 200
+        assert request.call_count == 3
+        assert [c[0][0] for c in self.policy._sleep.call_args_list] == [0.5, 1.0]
+        assert self.policy.stats() == {'retries': 2, 'reasons': {'502': 1, '503': 1}, 'failures': 0}
+
+    def test_give_up(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(500)
+            response = self.session.patch('https://api.github.com/repos/test/test')
+        assert response.status_code == 500
+        assert request.call_count == 4
+        assert self.policy.stats()['failures'] == 1
+
+    def test_deadline(self):
+        self.policy.deadline = 1
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(500)
+            self.session.get('https://api.github.com/repos/test/test')
+        # The second retry would wait 1 second, which takes us past the deadline
+        assert request.call_count == 2
+
+    def test_no_retry(self):
+        with patch('requests.Session.request') as request:
+            request.return_value = make_response(404)
+            self.session.get('https://api.github.com/repos/test/test')
+            request.return_value = make_response(403)
+            self.session.get('https://api.github.com/repos/test/test')
+            # Server errors on POST may have created something
+            request.return_value = make_response(502)
+            self.session.post('https://api.github.com/repos/test/test')
+        assert request.call_count == 3
+        self.policy._sleep.assert_not_called()
+
+    def test_secondary_rate_limit(self):
+        with patch('requests.Session.request') as request:
+            request.side_effect = [make_response(403, headers={'Retry-After': '3'}),
+                                   make_response(201)]
+            response = self.session.post('https://api.github.com/repos/test/test')
+        assert response.status_code == 201
+        self.policy._sleep.assert_called_once_with(3.0)
+        # The rate limiter also knows it should wait before the next request
+        self.limiter._sleep.assert_called_once()
+        assert self.policy.stats()['reasons'] == {'rate_limit': 1}
+
+    def test_primary_rate_limit(self):
+        self.policy._time = lambda: 1000.
+        with patch('requests.Session.request') as request:
+            # The rate limit is reset after the deadline, so we don't retry
+            request.return_value = make_response(403, headers={'X-RateLimit-Remaining': '0',
+                                                               'X-RateLimit-Reset': '4600'})
+            response = self.session.get('https://api.github.com/repos/test/test')
+            assert response.status_code == 403
+            assert request.call_count == 1
+            self.policy._sleep.assert_not_called()
+            assert self.policy.stats()['failures'] == 1
+
+            # Otherwise we wait until it is reset
+            request.reset_mock()
+            request.return_value = None
+            request.side_effect = [make_response(403, headers={'X-RateLimit-Remaining': '0',
+                                                               'X-RateLimit-Reset': '1005'}),
+                                   make_response(200)]
+            assert self.session.get('https://api.github.com/repos/test/test').status_code == 200
+            self.policy._sleep.assert_called_once_with(5.0)
+
+    def test_connection_errors(self):
+        with patch('requests.Session.request') as request:
+            request.side_effect = [requests.ConnectionError(), make_response(200)]
+            assert self.session.get('https://api.github.com/repos/test/test').status_code == 200
+
+            request.side_effect = [requests.ConnectTimeout(), make_response(201)]
+            assert self.session.post('https://api.github.com/repos/test/test').status_code == 201
+
+            request.side_effect = [requests.ReadTimeout()]
+            with pytest.raises(requests.ReadTimeout):
+                self.session.post('https://api.github.com/repos/test/test')
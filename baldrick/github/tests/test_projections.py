@@ -0,0 +1,50 @@
+import dataclasses
+
+import pytest
+
+from baldrick.github.projections import IssueInfo, PullRequestInfo
+
+USER = {'login': 'pluto', 'id': 1, 'url': 'https://api.github.com/users/pluto'}
+
+PULL_REQUEST = {
+    'number': 1234, 'state': 'open', 'draft': True, 'user': USER,
+    'labels': [{'name': 'Bug', 'color': 'ededed'}, {'name': 'Close?', 'color': 'ededed'}],
+    'milestone': {'title': 'v1.0', 'creator': USER},
+    'created_at': '2018-01-01T00:00:00Z', 'updated_at': '2018-01-02T00:00:00Z',
+    'head': {'ref': 'feature', 'sha': 'b' * 40, 'user': USER,
+             'repo': {'full_name': 'pluto/test', 'owner': USER}},
+    'base': {'ref': 'main', 'sha': 'a' * 40, 'user': USER,
+             'repo': {'full_name': 'test/test', 'owner': USER}},
+    'body': 'Fixes #1',
+}
+
+
+def test_pull_request_info():
+    info = PullRequestInfo.from_json(PULL_REQUEST)
+    assert info == PullRequestInfo(number=1234, state='open', user='pluto', labels=('Bug', 'Close?'),
+                                   milestone='v1.0', created_at='2018-01-01T00:00:00Z',
+                                   updated_at='2018-01-02T00:00:00Z', draft=True,
+                                   head_sha='b' * 40, head_ref='feature', head_repo='pluto/test',
+                                   base_sha='a' * 40, base_ref='main')
+
+
+def test_issue_info():
+    info = IssueInfo.from_json({**PULL_REQUEST, 'milestone': None, 'user': None, 'state': 'closed'})
+    assert info.number == 1234
+    assert info.state == 'closed'
+    assert info.user is None
+    assert info.milestone is None
+    assert info.labels == ('Bug', 'Close?')
+
+
+def test_deleted_fork():
+    info = PullRequestInfo.from_json({**PULL_REQUEST, 'head': {**PULL_REQUEST['head'], 'repo': None}})
+    assert info.head_repo is None
+    assert info.head_sha == 'b' * 40
+
+
+def test_compact():
+    info = PullRequestInfo.from_json(PULL_REQUEST)
+    assert not hasattr(info, '__dict__')
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        info.state = 'closed'
@@ -0,0 +1,112 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from baldrick.github.github_auth import TokenManager
+from baldrick.github.token_store import FileTokenStore, TokenStore, make_token_store
+
+
+def test_file_token_store(tmp_path):
+    store = FileTokenStore(str(tmp_path / 'tokens'))
+
+    assert store.get(123) is None
+    store.set(123, 'token-1', 5000.)
+    assert store.get(123) == ('token-1', 5000.)
+    assert stat.S_IMODE(os.stat(tmp_path / 'tokens' / '123.json').st_mode) == 0o600
+
+    # Another store on the same directory sees the same tokens
+    assert FileTokenStore(str(tmp_path / 'tokens')).get(123) == ('token-1', 5000.)
+
+    store.set(123, 'token-2', 6000.)
+    assert store.get(123) == ('token-2', 6000.)
+
+    store.delete(123)
+    store.delete(123)
+    assert store.get(123) is None
+    assert os.listdir(tmp_path / 'tokens') == []
+
+
+def test_file_token_store_lock(tmp_path):
+    store = FileTokenStore(str(tmp_path))
+    events = []
+
+    def work(name):
+        with store.lock(123):
+            events.append(f'{name} start')
+            time.sleep(0.05)
+            events.append(f'{name} end')
+
+    threads = [threading.Thread(target=work, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The lock is held by one thread at a time
+    assert events[0][0] == events[1][0]
+    assert events[2][0] == events[3][0]
+
+    # Locks on different installations are independent
+    with store.lock(1):
+        with store.lock(2):
+            pass
+
+
+def test_token_store_interface():
+    # Stores must implement all the methods of the interface
+
+    class IncompleteStore(TokenStore):
+        def get(self, installation):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteStore()
+
+
+def test_make_token_store(tmp_path, monkeypatch):
+    monkeypatch.delenv('BALDRICK_TOKEN_STORE', raising=False)
+    assert make_token_store() is None
+    monkeypatch.setenv('BALDRICK_TOKEN_STORE', str(tmp_path))
+    assert make_token_store().path == str(tmp_path)
+
+
+def test_shared_tokens(tmp_path):
+    # Several workers sharing a store only request a single token
+    calls = []
+
+    def request_token(installation):
+        calls.append(installation)
+        time.sleep(0.05)
+        return f'token-{len(calls)}', time.time() + 3600
+
+    managers = [TokenManager(request_token=request_token, store=FileTokenStore(str(tmp_path)))
+                for i in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda m=manager: results.append(m.get_token(123)))
+               for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [123]
+    assert results == ['token-1'] * 4
+    assert sum(manager.stats()['store_hits'] for manager in managers) == 3
+    assert sum(manager.stats()['refreshes'] for manager in managers) == 1
+
+
+def test_shared_tokens_expiring(tmp_path):
+    # A token in the store which is about to expire is renewed
+    store = FileTokenStore(str(tmp_path))
+    store.set(123, 'old', time.time() + 100)
+
+    manager = TokenManager(refresh_margin=300, request_token=lambda installation: ('new', time.time() + 3600),
+                           store=store)
+    assert manager.get_token(123) == 'new'
+    assert store.get(123)[0] == 'new'
+
+    manager.invalidate(123)
+    assert store.get(123) is None
@@ -0,0 +1,127 @@
+"""
+Stores for installation tokens shared between processes.
+
+When baldrick runs in several worker processes (e.g. with gunicorn), each
+process would otherwise request its own token for every installation. If
+``BALDRICK_TOKEN_STORE`` is set to the path of a directory, the tokens are
+kept in that directory instead: the first worker which needs a token requests
+it while holding a lock on the installation, and the other workers read it.
+"""
+import abc
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ['TokenStore', 'FileTokenStore', 'make_token_store']
+
+
+class TokenStore(abc.ABC):
+    """
+    The interface of token stores.
+
+    Stores hold the access token of each installation and its expiry time,
+    and provide a lock for each installation which is held while a new token
+    is requested, so that only one process requests it.
+    """
+
+    @abc.abstractmethod
+    def get(self, installation):
+        """
+        Return the token of an installation and its expiry time as a Unix
+        timestamp, or `None` if the store does not have one.
+        """
+
+    @abc.abstractmethod
+    def set(self, installation, token, expires_at):
+        """
+        Store the token of an installation.
+        """
+
+    @abc.abstractmethod
+    def delete(self, installation):
+        """
+        Remove the token of an installation, if any.
+        """
+
+    @abc.abstractmethod
+    def lock(self, installation):
+        """
+        Return a context manager which holds a lock on the token of an
+        installation, shared with all the processes using the store.
+        """
+
+
+class FileTokenStore(TokenStore):
+    """
+    A token store in a local directory, locked with ``fcntl``.
+
+    The token of each installation is kept in its own file, which is replaced
+    atomically so that it can be read without a lock. Requests for a new
+    token are serialized by an exclusive lock on a separate lock file for
+    each installation, so that workers renewing tokens of different
+    installations don't wait for each other.
+
+    Parameters
+    ----------
+    path : `str`
+        The directory in which to keep the tokens. It is created if needed,
+        and files in it are only readable by the current user.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError("FileTokenStore requires fcntl, which is not available on this platform")
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _filename(self, installation, extension):
+        return os.path.join(self.path, f'{installation}.{extension}')
+
+    def get(self, installation):
+        try:
+            with open(self._filename(installation, 'json')) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data['token'], data['expires_at']
+
+    def set(self, installation, token, expires_at):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=f'.{installation}.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'token': token, 'expires_at': expires_at}, f)
+            os.replace(tmp, self._filename(installation, 'json'))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def delete(self, installation):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._filename(installation, 'json'))
+
+    @contextlib.contextmanager
+    def lock(self, installation):
+        fd = os.open(self._filename(installation, 'lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+
+def make_token_store():
+    """
+    Create the token store given by ``BALDRICK_TOKEN_STORE``, or return
+    `None` if it is not set.
+    """
+    path = os.environ.get('BALDRICK_TOKEN_STORE')
+    if not path:
+        return None
+    return FileTokenStore(path)
@@ -0,0 +1,62 @@
+"""
+Decoding of JSON for GitHub responses and webhook payloads.
+
+Webhook payloads and pages of GitHub results are often hundreds of kB, so
+they are decoded with `orjson <https://github.com/ijl/orjson>`_ when it is
+installed (``pip install baldrick[fast]``), which is two to three times faster
+than the standard library. Otherwise, or if ``BALDRICK_JSON_BACKEND`` is set
+to ``json``, the standard library is used. Both give the same Python objects.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = ['loads', 'get_backend', 'set_backend']
+
+
+_BACKENDS = {'json': json.loads}
+if orjson is not None:
+    _BACKENDS['orjson'] = orjson.loads
+
+_backend = None
+_loads = None
+
+
+def set_backend(name):
+    """
+    Select the library used to decode JSON.
+
+    Parameters
+    ----------
+    name : `str`
+        ``'orjson'``, ``'json'``, or ``'auto'`` to use ``orjson`` if it is
+        installed and the standard library otherwise.
+    """
+    global _backend, _loads
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in _BACKENDS else 'json'
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown or unavailable JSON backend: {name}")
+    _backend = name
+    _loads = _BACKENDS[name]
+
+
+def get_backend():
+    """
+    Return the name of the library used to decode JSON.
+    """
+    return _backend
+
+
+def loads(data):
+    """
+    Decode a JSON document given as `bytes` or `str`.
+    """
+    return _loads(data)
+
+
+set_backend(os.environ.get('BALDRICK_JSON_BACKEND', 'auto'))
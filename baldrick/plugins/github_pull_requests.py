@@ -1,4 +1,6 @@
 import copy
+import os
+from collections import Counter
 
 from flask import current_app
 from loguru import logger
@@ -11,6 +13,17 @@ __all__ = ['pull_request_handler']
 
 PULL_REQUEST_CHECKS = dict()
 
+# Load the pull request state with a single GraphQL query rather than one REST
+# request per property.
+USE_GRAPHQL = os.environ.get('BALDRICK_GRAPHQL', 'false').lower() == 'true'
+
+# The number of check updates which were sent, or skipped because they would
+# not have changed anything.
+CHECK_WRITES = Counter()
+
+# The parts of a check which are shown on GitHub
+CHECK_FIELDS = ('name', 'title', 'summary', 'text', 'details_url', 'status', 'conclusion')
+
 
 def pull_request_handler(actions=None):
     """
@@ -99,6 +112,68 @@ def handle_pull_requests(repo_handler, payload, headers):
         action=payload['action'], is_new=is_new)
 
 
+def _check_state(check):
+    # Normalize a check the same way set_check does
+    state = {key: check.get(key) for key in CHECK_FIELDS}
+    state['summary'] = state['summary'] or ''
+    if state['conclusion'] is not None:
+        state['status'] = 'completed'
+    return state
+
+
+def check_needs_update(existing, check):
+    """
+    Whether sending ``check`` with ``set_check`` would change ``existing``.
+
+    Parameters
+    ----------
+    existing : `dict`
+        The check as returned by ``list_checks``.
+
+    check : `dict`
+        The arguments which would be passed to ``set_check``.
+    """
+    old = _check_state(existing)
+    new = _check_state(check)
+    # Optional fields which are not sent are left as they are by GitHub
+    for key in ('text', 'details_url'):
+        if new[key] is None:
+            new[key] = old[key]
+    return new != old
+
+
+def _plan_check_updates(existing_checks, results):
+    """
+    Work out which existing checks need to be updated with ``results``.
+
+    Returns the checks to send with ``set_check``, the number of existing
+    checks which are already up to date, and the results which are not
+    existing checks yet.
+    """
+    new_results = copy.copy(results)
+    updates = []
+    unchanged = 0
+    for external_id, existing in existing_checks.items():
+        check = copy.copy(existing)
+        if external_id in results.keys():
+            details = dict(new_results.pop(external_id))
+            # Remove skip key.
+            details.pop("skip_if_missing", False)
+            # Update the previous check with the new check (this includes the check_id to update)
+            check.update(details)
+        else:
+            # If check is in existing_checks but not results mark it as skipped.
+            check.update({
+                'title': 'This check has been skipped.',
+                'status': 'completed',
+                'conclusion': 'neutral'})
+        if check_needs_update(existing, check):
+            updates.append(check)
+        else:
+            unchanged += 1
+    return updates, unchanged, new_results
+
+
 def process_pull_request(repository, number, installation, action,
                          is_new=False):
 
@@ -106,6 +181,9 @@ def process_pull_request(repository, number, installation, action,
     # certain events.
     pr_handler = PullRequestHandler(repository, number, installation)
 
+    if USE_GRAPHQL:
+        pr_handler.load_from_graphql()
+
     pr_config = pr_handler.get_config_value("pull_requests", {})
     if not pr_config.get("enabled", False):
         msg = "Skipping PR checks, disabled in config."
@@ -165,23 +243,23 @@ def process_pull_request(repository, number, installation, action,
     # Get existing checks from our app, for the 'head' commit
     existing_checks = pr_handler.list_checks(only_ours=True)
     # For each existing check, see if it needs updating or skipping
-    new_results = copy.copy(results)
-    for external_id, check in existing_checks.items():
-        if external_id in results.keys():
-            details = new_results.pop(external_id)
-            # Remove skip key.
-            details.pop("skip_if_missing", False)
-            # Update the previous check with the new check (this includes the check_id to update)
-            check.update(details)
-            # Send the check to be updated
-            pr_handler.set_check(**check)
-        else:
-            # If check is in existing_checks but not results mark it as skipped.
-            check.update({
-                'title': 'This check has been skipped.',
-                'status': 'completed',
-                'conclusion': 'neutral'})
-            pr_handler.set_check(**check)
+    updates, skipped_writes, new_results = _plan_check_updates(existing_checks, results)
+
+    # The cached checks only know about the checks posted by this process
+    # (unless BALDRICK_CACHE_DB is set), so before skipping an update we make
+    # sure the check is also up to date on GitHub.
+    if skipped_writes:
+        existing_checks = pr_handler.list_checks(only_ours=True, use_cache=False)
+        updates, skipped_writes, new_results = _plan_check_updates(existing_checks, results)
+
+    for check in updates:
+        CHECK_WRITES['sent'] += 1
+        pr_handler.set_check(**check)
+
+    if skipped_writes:
+        CHECK_WRITES['skipped'] += skipped_writes
+        logger.debug(f"Skipped {skipped_writes} check updates on {repository}#{number} which "
+                     "would not have changed anything")
 
     # Any keys left in results are new checks we haven't sent on this commit yet.
     for external_id, details in sorted(new_results.items()):
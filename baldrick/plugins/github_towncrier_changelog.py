@@ -1,6 +1,7 @@
 import tomllib
 import os
 import re
+from functools import lru_cache
 from pathlib import Path
 
 from loguru import logger
@@ -33,15 +34,19 @@ def check_sections(filenames, sections):
     """
     Check that a file matches ``<section><issue number>``. Otherwise the root
     dir matches when it shouldn't.
+
+    ``filenames`` can be any iterable, it is only consumed until the first
+    matching file is found.
     """
+    patterns = []
     for section in sections:
         # Make sure the path ends with a /
         if not section.endswith("/"):
             section += "/"
-        pattern = section.replace("/", r"\/") + r"\d+.*"
-        for fname in filenames:
-            match = re.match(pattern, fname)
-            if match is not None:
+        patterns.append(re.compile(section.replace("/", r"\/") + r"\d+.*"))
+    for fname in filenames:
+        for pattern in patterns:
+            if pattern.match(fname) is not None:
                 return fname
     return False
 
@@ -58,12 +63,17 @@ def verify_pr_number(pr_number, matching_file):
     return str(pr_number) in matching_file
 
 
-def load_towncrier_config(pr_handler):
-    file_content = pr_handler.get_file_contents("pyproject.toml", branch=pr_handler.base_branch)
+@lru_cache(maxsize=32)
+def _parse_towncrier_config(file_content):
     config = tomllib.loads(file_content)
     return parse_toml(".", config)
 
 
+def load_towncrier_config(pr_handler):
+    file_content = pr_handler.get_file_contents("pyproject.toml", branch=pr_handler.base_branch)
+    return _parse_towncrier_config(file_content)
+
+
 CHANGELOG_EXISTS = "Changelog file was added in the correct directories."
 CHANGELOG_MISSING = "No changelog file was added in the correct directories."
 
@@ -94,7 +104,7 @@ def process_towncrier_changelog(pr_handler, repo_handler):
     section_dirs = calculate_fragment_paths(config)
     types = config.types.keys()
 
-    modified_files = pr_handler.get_modified_files()
+    modified_files = pr_handler.iter_modified_files()
 
     matching_file = check_sections(modified_files, section_dirs)
 
@@ -36,7 +36,7 @@ CONFIG_TEMPLATE_ARTIFACT_2 = """
 
 class TestArtifactPlugin:
     def setup_method(self, method):
-        self.requests_get_mock = patch('requests.get')
+        self.requests_get_mock = patch('requests.Session.get')
         self.requests_get = self.requests_get_mock.start()
         self.requests_get.return_value.ok = True
         self.requests_get.return_value.json.return_value = {'default_branch': 'main'}
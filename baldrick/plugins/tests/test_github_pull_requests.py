@@ -2,9 +2,9 @@ import json
 from copy import copy
 from unittest.mock import MagicMock, patch, PropertyMock
 
-from baldrick.github.github_api import FILE_CACHE
-from baldrick.plugins.github_pull_requests import (pull_request_handler,
-                                                   PULL_REQUEST_CHECKS)
+from baldrick.github.github_api import CHECK_RUN_CACHE, FILE_CACHE
+from baldrick.plugins.github_pull_requests import (pull_request_handler, check_needs_update,
+                                                   CHECK_WRITES, PULL_REQUEST_CHECKS)
 
 mock_hook = MagicMock()
 
@@ -35,10 +35,11 @@ class TestPullRequestHandler:
         self.pr_comments = []
         self.existing_checks = {}
         self.pr_open = True
+        self.get_urls = []
 
-        self.requests_get_mock = patch('requests.get', self._requests_get)
-        self.requests_post_mock = patch('requests.post')
-        self.requests_patch_mock = patch('requests.patch')
+        self.requests_get_mock = patch('requests.Session.get', self._requests_get)
+        self.requests_post_mock = patch('requests.Session.post')
+        self.requests_patch_mock = patch('requests.Session.patch')
         self.get_file_contents_mock = patch('baldrick.github.github_api.GitHubHandler.get_file_contents')
         self.get_installation_token_mock = patch('baldrick.github.github_auth.get_installation_token')
         self.labels_mock = patch('baldrick.github.github_api.PullRequestHandler.labels',
@@ -59,11 +60,13 @@ class TestPullRequestHandler:
     def teardown_method(self, method):
         self.requests_get_mock.stop()
         self.requests_post_mock.stop()
+        self.requests_patch_mock.stop()
         self.get_file_contents_mock.stop()
         self.get_installation_token_mock.stop()
         self.labels = self.labels_mock.stop()
 
-    def _requests_get(self, url, headers=None):
+    def _requests_get(self, url, params=None, headers=None):
+        self.get_urls.append(url)
         req = MagicMock()
         req.ok = True
         if url == 'https://api.github.com/repos/test-repo/pulls/1234':
@@ -320,3 +323,114 @@ class TestPullRequestHandler:
         mock_hook.return_value = None
         self.send_event(client)
         assert self.requests_post.call_count == 0
+
+    def test_skip_unchanged_checks(self, app, client):
+
+        # Checks which are already up to date are not sent again
+
+        mock_hook.return_value = {
+            'test1': {'title': 'Problems here', 'conclusion': 'failure'}}
+
+        self.get_file_contents.return_value = CONFIG_TEMPLATE
+
+        self.existing_checks = {
+            'total_count': 2,
+            'check_runs': [{'name': 'testbot:test1',
+                            'status': 'completed',
+                            'conclusion': 'failure',
+                            'output': {'title': 'Problems here',
+                                       'summary': ''},
+                            'head_sha': 'abc464aa',
+                            'external_id': 'test1',
+                            'id': 1,
+                            'app': {'id': app.integration_id}},
+                           {'name': 'testbot:test2',
+                            'status': 'completed',
+                            'conclusion': 'neutral',
+                            'output': {'title': 'This check has been skipped.',
+                                       'summary': ''},
+                            'head_sha': 'abc464aa',
+                            'external_id': 'test2',
+                            'id': 2,
+                            'app': {'id': app.integration_id}}]}
+
+        CHECK_WRITES.clear()
+
+        self.send_event(client)
+
+        assert self.requests_post.call_count == 0
+        assert self.requests_patch.call_count == 0
+        assert CHECK_WRITES == {'skipped': 2}
+
+    def test_stale_check_cache(self, app, client):
+
+        # The cache of this worker says the check is up to date, but another
+        # worker has since changed it on GitHub, so it has to be sent again
+
+        mock_hook.return_value = {
+            'test1': {'title': 'Problems here', 'conclusion': 'failure'}}
+
+        self.get_file_contents.return_value = CONFIG_TEMPLATE
+
+        CHECK_RUN_CACHE[('test-repo', 'abc464aa')] = {
+            'test1': {'external_id': 'test1', 'name': 'testbot:test1', 'title': 'Problems here',
+                      'summary': '', 'text': None, 'details_url': None, 'commit_hash': 'abc464aa',
+                      'status': 'completed', 'conclusion': 'failure', 'check_id': 1}}
+
+        self.existing_checks = {
+            'total_count': 1,
+            'check_runs': [{'name': 'testbot:test1',
+                            'status': 'completed',
+                            'conclusion': 'success',
+                            'output': {'title': 'All good',
+                                       'summary': ''},
+                            'head_sha': 'abc464aa',
+                            'external_id': 'test1',
+                            'id': 1,
+                            'app': {'id': app.integration_id}}]}
+
+        CHECK_WRITES.clear()
+
+        self.send_event(client)
+
+        assert self.requests_patch.call_count == 1
+        assert self.requests_patch.call_args[1]['json']['conclusion'] == 'failure'
+        assert CHECK_WRITES == {'sent': 1}
+
+    def test_cached_checks(self, app, client):
+
+        # Checks which need to be updated according to the cache are sent
+        # without listing the checks again
+
+        mock_hook.return_value = {
+            'test1': {'title': 'All good', 'conclusion': 'success'}}
+
+        self.get_file_contents.return_value = CONFIG_TEMPLATE
+
+        CHECK_RUN_CACHE[('test-repo', 'abc464aa')] = {
+            'test1': {'external_id': 'test1', 'name': 'testbot:test1', 'title': 'Problems here',
+                      'summary': '', 'text': None, 'details_url': None, 'commit_hash': 'abc464aa',
+                      'status': 'completed', 'conclusion': 'failure', 'check_id': 1}}
+
+        CHECK_WRITES.clear()
+
+        self.send_event(client)
+
+        assert self.requests_patch.call_count == 1
+        assert CHECK_WRITES == {'sent': 1}
+        assert not any(url.endswith('/check-runs') for url in self.get_urls)
+
+
+def test_check_needs_update():
+    existing = {'external_id': 'test1', 'name': 'testbot:test1', 'title': 'Problems here',
+                'summary': '', 'text': 'Some details', 'details_url': 'https://example.com',
+                'status': 'completed', 'conclusion': 'failure', 'check_id': 1,
+                'commit_hash': 'abc464aa'}
+
+    assert not check_needs_update(existing, dict(existing))
+    # Optional fields which are not given are not changed
+    assert not check_needs_update(existing, {**existing, 'text': None, 'details_url': None})
+    assert not check_needs_update(existing, {**existing, 'summary': None})
+    assert check_needs_update(existing, {**existing, 'text': 'Other details'})
+    assert check_needs_update(existing, {**existing, 'title': 'All good', 'conclusion': 'success'})
+    assert check_needs_update({**existing, 'status': 'in_progress', 'conclusion': None}, existing)
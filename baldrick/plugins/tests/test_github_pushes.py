@@ -30,7 +30,7 @@ class TestPushHandler:
 
         mock_handler.reset_mock()
 
-        self.requests_get_mock = patch('requests.get')
+        self.requests_get_mock = patch('requests.Session.get')
         self.requests_get = self.requests_get_mock.start()
         self.requests_get.return_value.ok = True
         self.requests_get.return_value.json.return_value = {'default_branch': 'main'}
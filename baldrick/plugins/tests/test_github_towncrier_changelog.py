@@ -47,7 +47,7 @@ class TestTowncrierPlugin:
         self.get_base_branch_mock = patch('baldrick.github.github_api.PullRequestHandler.base_branch')
         a = self.get_base_branch_mock.start()
         a.return_value = "master"
-        self.modified_files_mock = patch('baldrick.github.github_api.PullRequestHandler.get_modified_files')
+        self.modified_files_mock = patch('baldrick.github.github_api.PullRequestHandler.iter_modified_files')
 
         self.repo_handler = RepoHandler("nota/repo", "1234")
         self.pr_handler = PullRequestHandler("nota/repo", "1234")
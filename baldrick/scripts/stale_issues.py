@@ -6,6 +6,7 @@ from humanize import naturaltime, naturaldelta
 from baldrick.utils import unwrap
 from baldrick.github.github_auth import repo_to_installation_id, get_app_name
 from baldrick.github.github_api import IssueHandler, RepoHandler
+from baldrick.github.github_rate_limit import low_priority
 
 ISSUE_CLOSE_WARNING = unwrap("""
 Hi humans :wave: - this issue was labeled as **Close?** approximately
@@ -116,5 +117,7 @@ def main(argv=None):
 
     installation = repo_to_installation_id(args.repository)
 
-    process_issues(args.repository, installation,
-                   warn_seconds=args.warn_seconds, close_seconds=args.close_seconds)
+    # Leave the rate limit for webhooks if it is running low
+    with low_priority():
+        process_issues(args.repository, installation,
+                       warn_seconds=args.warn_seconds, close_seconds=args.close_seconds)
@@ -6,6 +6,7 @@ from humanize import naturaldelta
 from baldrick.utils import unwrap
 from baldrick.github.github_auth import repo_to_installation_id, get_app_name
 from baldrick.github.github_api import PullRequestHandler, RepoHandler
+from baldrick.github.github_rate_limit import low_priority
 
 PULL_REQUESTS_CLOSE_WARNING = unwrap("""
 Hi humans :wave: - this pull request hasn't had any new commits for
@@ -125,5 +126,7 @@ def main(argv=None):
 
     installation = repo_to_installation_id(args.repository)
 
-    process_pull_requests(args.repository, installation,
-                          warn_seconds=args.warn_seconds, close_seconds=args.close_seconds)
+    # Leave the rate limit for webhooks if it is running low
+    with low_priority():
+        process_pull_requests(args.repository, installation,
+                              warn_seconds=args.warn_seconds, close_seconds=args.close_seconds)
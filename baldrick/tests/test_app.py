@@ -0,0 +1,44 @@
+import threading
+from unittest.mock import patch
+
+from baldrick import create_app
+
+
+def test_background_discovery(app, monkeypatch):
+    # The app is returned while the installations are still being listed
+    monkeypatch.setenv('BALDRICK_INSTALLATION_DISCOVERY', 'background')
+    release = threading.Event()
+
+    def mapping():
+        release.wait(10)
+        return {'test/test-repo': 123}
+
+    with patch('baldrick.github.github_auth.repo_to_installation_id_mapping', side_effect=mapping) as mock_mapping:
+        app = create_app('testbot')
+        client = app.test_client()
+        # The app is ready before the installations have been listed
+        response = client.get('/ready')
+        assert response.status_code == 200
+        assert response.get_json() == {'ready': True, 'installations_discovered': False}
+        release.set()
+        assert app.installations_discovered.wait(10)
+
+    assert mock_mapping.call_count == 1
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.get_json() == {'ready': True, 'installations_discovered': True}
+
+
+def test_discovery_failure(app, monkeypatch):
+    monkeypatch.setenv('BALDRICK_INSTALLATION_DISCOVERY', 'background')
+    with patch('baldrick.github.github_auth.repo_to_installation_id_mapping', side_effect=ValueError('401')):
+        app = create_app('testbot')
+        assert app.installations_discovered.wait(10)
+
+
+def test_no_discovery(app, monkeypatch):
+    monkeypatch.setenv('BALDRICK_INSTALLATION_DISCOVERY', 'off')
+    with patch('baldrick.github.github_auth.repo_to_installation_id_mapping') as mock_mapping:
+        app = create_app('testbot')
+    assert mock_mapping.call_count == 0
+    assert app.installations_discovered.is_set()
@@ -0,0 +1,198 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from baldrick.cache import LRUCache, SQLiteCache, TieredCache, make_cache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'evictions': 1, 'size': 2, 'maxsize': 2}
+
+
+def test_lru_maxbytes():
+    cache = LRUCache(maxsize=10, maxbytes=10, sizeof=len)
+    cache['a'] = 'xxxx'
+    cache['b'] = 'xxxx'
+    assert cache.nbytes == 8
+    cache['c'] = 'xxxx'
+    assert 'a' not in cache
+    assert cache.nbytes == 8
+    # Replacing an item only counts its new size
+    cache['b'] = 'x'
+    assert cache.nbytes == 5
+    # Items larger than maxbytes are not stored
+    cache['d'] = 'x' * 11
+    assert 'd' not in cache
+    assert cache.pop('c') == 'xxxx'
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'evictions': 1, 'size': 1, 'maxsize': 10,
+                             'nbytes': 1, 'maxbytes': 10}
+    cache.clear()
+    assert cache.nbytes == 0
+
+
+def test_get_missing():
+    cache = LRUCache()
+    assert cache.get('a') is None
+    assert cache.get('a', 5) == 5
+    with pytest.raises(KeyError):
+        cache['a']
+    assert cache.misses == 3
+
+
+def test_ttl():
+    cache = LRUCache(ttl=10)
+    with patch('time.monotonic', return_value=100):
+        cache['a'] = 1
+        cache.set('b', 2, ttl=None)
+    with patch('time.monotonic', return_value=105):
+        assert cache['a'] == 1
+    with patch('time.monotonic', return_value=111):
+        assert 'a' not in cache
+        assert cache['b'] == 2
+
+
+def test_pop_and_clear():
+    cache = LRUCache()
+    cache['a'] = 1
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    cache['b'] = 2
+    del cache['b']
+    with pytest.raises(KeyError):
+        del cache['b']
+    cache['c'] = 3
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 0
+
+
+def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SQLiteCache(path, namespace='files', maxsize=2)
+    other = SQLiteCache(path, namespace='refs')
+
+    cache[('repo', 'path', 'sha')] = 'contents'
+    assert cache[('repo', 'path', 'sha')] == 'contents'
+    assert ('repo', 'path', 'sha') in cache
+    assert ('repo', 'path', 'sha') not in other
+    assert cache.get('missing') is None
+
+    # A second connection to the same file sees the same items
+    reopened = SQLiteCache(path, namespace='files')
+    assert reopened[('repo', 'path', 'sha')] == 'contents'
+    reopened.close()
+
+    cache['b'] = {'default_branch': 'main'}
+    cache['c'] = None
+    assert len(cache) == 2
+    assert 'c' in cache
+    assert cache.pop('c', 1) is None
+    assert cache.pop('c', 1) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+
+    cache.close()
+    other.close()
+
+
+def test_sqlite_cache_ttl(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), ttl=10)
+    with patch('time.time', return_value=100):
+        cache['a'] = 1
+    with patch('time.time', return_value=105):
+        assert cache['a'] == 1
+    with patch('time.time', return_value=111):
+        assert 'a' not in cache
+        assert cache.get('a') is None
+    cache.close()
+
+
+def test_sqlite_cache_touch_interval(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), touch_interval=60)
+
+    def accessed():
+        return cache._connection.execute('SELECT accessed FROM cache').fetchone()[0]
+
+    with patch('time.time', return_value=100):
+        cache['a'] = 1
+    # Reads only update the access time once it is old enough
+    with patch('time.time', return_value=150):
+        assert cache['a'] == 1
+    assert accessed() == 100
+    with patch('time.time', return_value=200):
+        assert cache['a'] == 1
+    assert accessed() == 200
+    cache.close()
+
+
+def test_sqlite_cache_threads(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), maxsize=1000)
+
+    def work(i):
+        cache[i] = i
+        return cache[i]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(work, range(100))) == list(range(100))
+    assert len(cache) == 100
+    assert cache.stats()['hits'] == 100
+    cache.close()
+
+
+def test_tiered_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache1 = TieredCache(LRUCache(), SQLiteCache(path))
+    cache2 = TieredCache(LRUCache(), SQLiteCache(path))
+
+    cache1['a'] = 'b'
+    assert 'a' in cache1.local
+    assert 'a' not in cache2.local
+    assert cache2['a'] == 'b'
+    assert 'a' in cache2.local
+
+    assert cache2.pop('a') == 'b'
+    assert 'a' not in cache2
+    assert cache1.shared.get('a') is None
+
+    cache1.close()
+    cache2.close()
+
+
+def test_tiered_cache_ttl(tmp_path):
+    cache = TieredCache(LRUCache(ttl=100), SQLiteCache(str(tmp_path / 'cache.db')))
+
+    # A shorter TTL also applies to the copy in memory
+    cache.set('a', 1, ttl=10)
+    assert cache.local._data['a'][0] - time.monotonic() <= 10
+
+    # But a longer one doesn't extend it
+    cache.set('b', 1, ttl=1000)
+    assert cache.local._data['b'][0] - time.monotonic() <= 100
+
+    cache.close()
+
+
+def test_make_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('BALDRICK_CACHE_DB', raising=False)
+    assert isinstance(make_cache('test'), LRUCache)
+
+    monkeypatch.setenv('BALDRICK_CACHE_DB', str(tmp_path / 'cache.db'))
+    cache = make_cache('test', maxsize=10, ttl=60)
+    assert isinstance(cache, TieredCache)
+    assert cache.local.ttl == 5
+    assert cache.shared.ttl == 60
+    assert cache.shared.namespace == 'test'
+
+    cache = make_cache('test', ttl=None, immutable=True)
+    assert cache.local.ttl is None
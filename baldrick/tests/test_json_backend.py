@@ -0,0 +1,48 @@
+import pytest
+
+from baldrick import json_backend
+from baldrick.github.github_session import GitHubResponse
+
+PAYLOAD = b'{"action": "opened", "number": 1, "labels": [{"name": "\\u00e9t\\u00e9"}], "draft": false}'
+
+
+@pytest.fixture
+def backend():
+    original = json_backend.get_backend()
+    yield
+    json_backend.set_backend(original)
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson'])
+def test_backends(backend, name):
+    if name == 'orjson':
+        pytest.importorskip('orjson')
+    json_backend.set_backend(name)
+    assert json_backend.get_backend() == name
+    expected = {'action': 'opened', 'number': 1, 'labels': [{'name': 'été'}], 'draft': False}
+    assert json_backend.loads(PAYLOAD) == expected
+    assert json_backend.loads(PAYLOAD.decode()) == expected
+    with pytest.raises(ValueError):
+        json_backend.loads(b'not json')
+
+
+def test_auto(backend):
+    json_backend.set_backend('auto')
+    assert json_backend.get_backend() in ('json', 'orjson')
+
+
+def test_unknown_backend(backend):
+    with pytest.raises(ValueError, match='Unknown or unavailable'):
+        json_backend.set_backend('yaml')
+
+
+def test_github_response():
+    response = GitHubResponse()
+    response.status_code = 200
+    response._content = PAYLOAD
+    assert response.json()['labels'] == [{'name': 'été'}]
+    assert response.json(parse_int=str)['number'] == '1'
+
+    response._content = '{"name": "été"}'.encode('latin-1')
+    response.encoding = 'latin-1'
+    assert response.json() == {'name': 'été'}
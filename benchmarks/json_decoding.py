@@ -0,0 +1,96 @@
+"""
+Compare the time taken to decode GitHub payloads with each JSON backend.
+
+Run this with the paths of recorded payloads, e.g. the body of a webhook
+saved from the GitHub app settings or a page of results saved with::
+
+    curl -H "Authorization: token $TOKEN" \\
+        "https://api.github.com/repos/astropy/astropy/issues/1/timeline?per_page=100" > timeline.json
+
+    python benchmarks/json_decoding.py timeline.json pull_request.json
+
+Without any paths, a synthetic page of 100 pull requests (about 1 MB,
+similar to ``GET /repos/{repo}/pulls?per_page=100``) is used.
+"""
+import argparse
+import json
+import os
+import timeit
+
+from baldrick import json_backend
+
+
+def synthetic_page(items=100):
+    repo = 'astropy/astropy'
+    api = f'https://api.github.com/repos/{repo}'
+    user = {'login': 'pluto', 'id': 12345, 'type': 'User', 'site_admin': False,
+            **{f'{name}_url': f'https://api.github.com/users/pluto/{name}'
+               for name in ('followers', 'following', 'gists', 'starred', 'subscriptions',
+                            'organizations', 'repos', 'events', 'received_events')}}
+    repository = {'id': 2081289, 'full_name': repo, 'private': False, 'owner': user,
+                  'description': 'Astronomy and astrophysics core library',
+                  **{f'{name}_url': f'{api}/{name}{{/number}}'
+                     for name in ('issues', 'pulls', 'labels', 'milestones', 'comments', 'commits',
+                                  'contents', 'compare', 'merges', 'branches', 'tags', 'releases',
+                                  'deployments', 'downloads', 'notifications', 'assignees', 'blobs',
+                                  'git_tags', 'git_refs', 'trees', 'statuses', 'languages',
+                                  'stargazers', 'contributors', 'subscribers', 'subscription')}}
+    page = []
+    for number in range(items):
+        page.append({
+            'url': f'{api}/pulls/{number}', 'id': 100000 + number, 'number': number,
+            'state': 'open', 'locked': False, 'draft': number % 5 == 0,
+            'title': f'Fix the handling of units in table column {number}',
+            'body': 'This pull request fixes an issue with units. ' * 40,
+            'user': user,
+            'labels': [{'id': i, 'name': name, 'color': 'ededed', 'default': False,
+                        'url': f'{api}/labels/{name}'}
+                       for i, name in enumerate(['Bug', 'table', 'units', 'backport-v6.0.x'])],
+            'milestone': {'title': 'v6.1', 'number': 42, 'creator': user},
+            'created_at': '2024-01-01T00:00:00Z', 'updated_at': '2024-01-02T00:00:00Z',
+            'head': {'label': f'pluto:fix-{number}', 'ref': f'fix-{number}', 'sha': 'a' * 40,
+                     'user': user, 'repo': repository},
+            'base': {'label': 'astropy:main', 'ref': 'main', 'sha': 'b' * 40,
+                     'user': user, 'repo': repository},
+        })
+    return json.dumps(page).encode()
+
+
+def benchmark(name, data, number):
+    results = {}
+    for backend in ('json', 'orjson'):
+        try:
+            json_backend.set_backend(backend)
+        except ValueError:
+            continue
+        results[backend] = min(timeit.repeat(lambda: json_backend.loads(data), number=number, repeat=5)) / number
+
+    line = f'{name:40s} {len(data) / 1e6:8.2f} MB   json: {results["json"] * 1e3:8.2f} ms'
+    if 'orjson' in results:
+        line += (f'   orjson: {results["orjson"] * 1e3:8.2f} ms'
+                 f'   ({results["json"] / results["orjson"]:.1f}x faster)')
+    else:
+        line += '   (orjson is not installed)'
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='Files with recorded JSON payloads')
+    parser.add_argument('--number', type=int, default=20, help='Number of decodes per timing')
+    args = parser.parse_args(argv)
+
+    original = json_backend.get_backend()
+    try:
+        if args.paths:
+            for path in args.paths:
+                with open(path, 'rb') as f:
+                    benchmark(os.path.basename(path), f.read(), args.number)
+        else:
+            benchmark('synthetic page of 100 pull requests', synthetic_page(), args.number)
+    finally:
+        json_backend.set_backend(original)
+
+
+if __name__ == '__main__':
+    main()